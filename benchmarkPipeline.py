@@ -0,0 +1,302 @@
+# Times every stage of the transformer on a fixed set of recipes, entirely
+# offline. The pages of allRecipes.recipeURLs and every ConceptNet answer the
+# transformer asks for while handling them are recorded once (--record, which
+# needs the network) into a fixtures directory, and every run after that replays
+# them, so the numbers only move when our own code does. Each run reports the
+# p50/p99 time every stage takes per recipe, the throughput, and the peak memory
+# of the process, and can be compared against a saved baseline to catch
+# regressions. The stages are whatever metrics.instrumented records during a
+# real Transformer.transformAll, so the benchmark follows the transformer as it
+# changes.
+#
+# The fixtures directory holds pages/ (the raw pages), manifest.json (URL -> page
+# file) and edges.json (concept URI -> response). standInServer.py can serve the
+# same files (--pages <fixtures>/pages --conceptnet-edges <fixtures>/edges.json).
+#
+# The checked-in benchmarkFixtures/ holds eight hand-written sample pages in the
+# same JSON-LD form as the allRecipes pages (listed in the manifest as "sample:"
+# sources) and hand-written ConceptNet answers for every word and ingredient word
+# pair on them (IsA food or spice, MannerOf for verbs, UsedFor cook for tools,
+# nothing for the rest), so a fresh checkout can run the whole benchmark
+# straight away. --record replaces them with the real pages and answers.
+
+from recipeTransformer import Transformer, loadNLP
+from recipeScraper import formulateJSONFromHTML
+from conceptNet import ConceptNetClient, HTTPBackend
+from bulkScraper import BulkScraper, PageCache
+from metrics import Metrics, collecting, percentile
+from allRecipes import recipeURLs
+import argparse
+import resource
+import tempfile
+import time
+import json
+import sys
+import os
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarkFixtures")
+
+class RecordingBackend:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: backend (the real backend, e.g. an HTTPBackend)                  #
+    # Returns: None                                                            #
+    # Notes: Passes every lookup through and remembers the answer.             #
+    ############################################################################
+    def __init__(self, backend):
+        self.backend = backend
+        self.recorded = dict()
+
+    ############################################################################
+    # Name: fetch                                                              #
+    # Params: uri (concept URI)                                                #
+    # Returns: Dict with an "edges" list                                       #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def fetch(self, uri):
+        self.recorded[uri] = self.backend.fetch(uri)
+        return self.recorded[uri]
+
+    ############################################################################
+    # Name: fetchMany                                                          #
+    # Params: uris (list of concept URIs)                                      #
+    # Returns: Dict of uri -> response                                         #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def fetchMany(self, uris):
+        results = self.backend.fetchMany(uris)
+        self.recorded.update(results)
+        return results
+
+class FixtureBackend:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: edges (dict of concept URI -> response, from edges.json)         #
+    # Returns: None                                                            #
+    # Notes: Concepts that were never recorded get an empty answer and are     #
+    # counted in misses, since they mean the fixtures are out of date.         #
+    ############################################################################
+    def __init__(self, edges):
+        self.edges = edges
+        self.misses = set()
+
+    ############################################################################
+    # Name: fetch                                                              #
+    # Params: uri (concept URI)                                                #
+    # Returns: Dict with an "edges" list                                       #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def fetch(self, uri):
+        if uri not in self.edges:
+            self.misses.add(uri)
+            return {"edges": []}
+        return self.edges[uri]
+
+    ############################################################################
+    # Name: fetchMany                                                          #
+    # Params: uris (list of concept URIs)                                      #
+    # Returns: Dict of uri -> response                                         #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def fetchMany(self, uris):
+        return dict((uri, self.fetch(uri)) for uri in uris)
+
+################################################################################
+# Name: recordFixtures                                                         #
+# Params: fixturesDir, urls (recipe URLs), transformationTypes (list)          #
+# Returns: Dict with the number of pages and concepts recorded                 #
+# Notes: Downloads every page, then runs each recipe through every             #
+# transformation with a recording ConceptNet backend and no caches in the way, #
+# so every concept a run will ask for is captured.                             #
+################################################################################
+def recordFixtures(fixturesDir, urls, transformationTypes):
+    os.makedirs(os.path.join(fixturesDir, "pages"), exist_ok = True)
+    with tempfile.TemporaryDirectory() as pageCacheDir:
+        scraper = BulkScraper(PageCache(pageCacheDir))
+        manifest = dict()
+        for i in range(len(urls)):
+            pageName = "recipe" + str(i + 1) + ".html"
+            with open(os.path.join(fixturesDir, "pages", pageName), "w", encoding = "utf-8") as pageFile:
+                pageFile.write(scraper.fetchPage(urls[i]))
+            manifest[urls[i]] = pageName
+
+    recorder = RecordingBackend(HTTPBackend())
+    Transformer.conceptNet = ConceptNetClient(backend = recorder, cachePath = None)
+    Transformer.parseCache = None
+    for url in urls:
+        with open(os.path.join(fixturesDir, "pages", manifest[url]), encoding = "utf-8") as pageFile:
+            Transformer(recipeData = formulateJSONFromHTML(pageFile.read())).transformAll(transformationTypes)
+
+    with open(os.path.join(fixturesDir, "manifest.json"), "w", encoding = "utf-8") as manifestFile:
+        json.dump(manifest, manifestFile, indent = 2)
+    with open(os.path.join(fixturesDir, "edges.json"), "w", encoding = "utf-8") as edgesFile:
+        json.dump(recorder.recorded, edgesFile, sort_keys = True)
+    return {"pages": len(manifest), "concepts": len(recorder.recorded)}
+
+################################################################################
+# Name: loadFixtures                                                           #
+# Params: fixturesDir                                                          #
+# Returns: Tuple of (list of (url, page HTML), dict of concept URI ->          #
+# response)                                                                    #
+# Notes: Raises a FileNotFoundError that says how to record them if they are   #
+# missing.                                                                     #
+################################################################################
+def loadFixtures(fixturesDir):
+    manifestPath = os.path.join(fixturesDir, "manifest.json")
+    if not os.path.exists(manifestPath):
+        raise FileNotFoundError("No benchmark fixtures in " + fixturesDir + " (record them with: python benchmarkPipeline.py --record)")
+    with open(manifestPath, encoding = "utf-8") as manifestFile:
+        manifest = json.load(manifestFile)
+    pages = []
+    for url, pageName in manifest.items():
+        with open(os.path.join(fixturesDir, "pages", pageName), encoding = "utf-8") as pageFile:
+            pages.append((url, pageFile.read()))
+    with open(os.path.join(fixturesDir, "edges.json"), encoding = "utf-8") as edgesFile:
+        edges = json.load(edgesFile)
+    return pages, edges
+
+################################################################################
+# Name: runPass                                                                #
+# Params: pages (from loadFixtures), edges, transformationTypes, seed, timings #
+# (dict of stage -> list of seconds to add to, or None to not time anything)   #
+# Returns: FixtureBackend (to check for misses)                                #
+# Notes: One pass over every recipe with a fresh, memory-only ConceptNet       #
+# client and no parse cache, so every pass does the same work. Each recipe     #
+# goes through transformAll with its own metrics collector, and every stage    #
+# it recorded adds one entry: the stage's total time for that recipe, across   #
+# all of the transformations.                                                  #
+################################################################################
+def runPass(pages, edges, transformationTypes, seed, timings):
+    backend = FixtureBackend(edges)
+    Transformer.conceptNet = ConceptNetClient(backend = backend, cachePath = None)
+    Transformer.parseCache = None
+
+    for url, pageHTML in pages:
+        recipeMetrics = Metrics()
+        with collecting(recipeMetrics):
+            start = time.perf_counter()
+            recipeData = formulateJSONFromHTML(pageHTML)
+            recipeMetrics.observe("formulateJSON", time.perf_counter() - start)
+            Transformer(recipeData = recipeData, seed = seed).transformAll(transformationTypes)
+            recipeMetrics.observe("recipe", time.perf_counter() - start)
+        if timings is not None:
+            for stage, stats in recipeMetrics.snapshot()["stages"].items():
+                timings.setdefault(stage, []).append(stats["seconds"])
+    return backend
+
+################################################################################
+# Name: peakMemoryMB                                                           #
+# Params: None                                                                 #
+# Returns: Number                                                              #
+# Notes: The most memory this process has held at once (its peak resident set  #
+# size), spaCy model and all. Linux reports it in KB and macOS in bytes.       #
+################################################################################
+def peakMemoryMB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+################################################################################
+# Name: benchmark                                                              #
+# Params: pages, edges (from loadFixtures), transformationTypes, iterations    #
+# (timed passes), seed                                                         #
+# Returns: Dict with stage statistics, throughput, peak memory and the fixture #
+# misses                                                                       #
+# Notes: A warm-up pass (model load, knowledge base) is not timed.             #
+################################################################################
+def benchmark(pages, edges, transformationTypes, iterations = 5, seed = 0):
+    loadNLP()
+    runPass(pages, edges, transformationTypes, seed, None)
+
+    timings = dict()
+    start = time.perf_counter()
+    for iteration in range(iterations):
+        backend = runPass(pages, edges, transformationTypes, seed, timings)
+    elapsed = time.perf_counter() - start
+
+    stages = dict()
+    for stage, values in timings.items():
+        values = sorted(values)
+        stages[stage] = {"count": len(values), "p50": percentile(values, 0.5) * 1000, "p99": percentile(values, 0.99) * 1000}
+    return {"stages": stages, "recipesPerSecond": len(pages) * iterations / elapsed, "peakRSSMB": peakMemoryMB(),
+    "transformationTypes": transformationTypes, "iterations": iterations, "misses": sorted(backend.misses)}
+
+################################################################################
+# Name: compareToBaseline                                                      #
+# Params: results (from benchmark), baseline (an earlier benchmark result),    #
+# tolerance (fraction a p50 may grow by, like 0.2)                             #
+# Returns: List of strings describing each regression                          #
+# Notes: Stages that take under a tenth of a millisecond are skipped, since    #
+# their timings are mostly noise, and so are stages the baseline does not      #
+# have. Throughput and peak memory (if the baseline has a peakRSSMB) are held  #
+# to the same tolerance.                                                       #
+################################################################################
+def compareToBaseline(results, baseline, tolerance):
+    regressions = []
+    for stage, stats in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is not None and before["p50"] >= 0.1 and stats["p50"] > before["p50"] * (1 + tolerance):
+            regressions.append(stage + ": p50 " + "%.2f" % before["p50"] + "ms -> " + "%.2f" % stats["p50"] + "ms")
+    if results["recipesPerSecond"] < baseline["recipesPerSecond"] / (1 + tolerance):
+        regressions.append("throughput: " + "%.1f" % baseline["recipesPerSecond"] + " -> " + "%.1f" % results["recipesPerSecond"] + " recipes/s")
+    if "peakRSSMB" in baseline and results["peakRSSMB"] > baseline["peakRSSMB"] * (1 + tolerance):
+        regressions.append("peak memory: " + "%.1f" % baseline["peakRSSMB"] + " -> " + "%.1f" % results["peakRSSMB"] + " MB")
+    return regressions
+
+################################################################################
+# Name: printReport                                                            #
+# Params: results (from benchmark)                                             #
+# Returns: None                                                                #
+# Notes: One line per stage, in the order each stage first finished (so a      #
+# stage comes before the stages that call it).                                 #
+################################################################################
+def printReport(results):
+    print("stage".ljust(40) + "count".rjust(7) + "p50 ms".rjust(10) + "p99 ms".rjust(10))
+    for stage, stats in results["stages"].items():
+        print(stage.ljust(40) + str(stats["count"]).rjust(7) + ("%.3f" % stats["p50"]).rjust(10) + ("%.3f" % stats["p99"]).rjust(10))
+    print("throughput: " + "%.1f" % results["recipesPerSecond"] + " recipes/s (every transformation each)")
+    print("peak memory: " + "%.1f" % results["peakRSSMB"] + " MB (resident set)")
+    if results["misses"]:
+        print(str(len(results["misses"])) + " concepts were not in the fixtures; re-record them with --record", file = sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark every stage of the transformer against recorded fixtures.")
+    parser.add_argument("--fixtures", default = DEFAULT_FIXTURES_DIR, help = "fixtures directory")
+    parser.add_argument("--record", action = "store_true", help = "download the pages and ConceptNet answers into the fixtures (needs the network)")
+    parser.add_argument("--type", action = "append", dest = "types", choices = Transformer.transformationTypes,
+    help = "transformation to time (repeat for several; defaults to all of them)")
+    parser.add_argument("--iterations", type = int, default = 5, help = "timed passes over the recipes")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed for the random replacement choices")
+    parser.add_argument("--baseline", help = "compare against this saved result (defaults to baseline.json in the fixtures, if there is one)")
+    parser.add_argument("--save-baseline", action = "store_true", help = "save this run as the baseline")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "how much slower (as a fraction) counts as a regression")
+    parser.add_argument("--json", help = "also write the results to this file")
+    args = parser.parse_args()
+    transformationTypes = args.types or list(Transformer.transformationTypes)
+
+    if args.record:
+        counts = recordFixtures(args.fixtures, recipeURLs, transformationTypes)
+        print("Recorded " + str(counts["pages"]) + " pages and " + str(counts["concepts"]) + " concepts into " + args.fixtures)
+        sys.exit(0)
+
+    pages, edges = loadFixtures(args.fixtures)
+    results = benchmark(pages, edges, transformationTypes, args.iterations, args.seed)
+    printReport(results)
+    if args.json:
+        with open(args.json, "w", encoding = "utf-8") as resultsFile:
+            json.dump(results, resultsFile, indent = 2)
+
+    baselinePath = args.baseline or os.path.join(args.fixtures, "baseline.json")
+    status = 0
+    if args.save_baseline:
+        with open(baselinePath, "w", encoding = "utf-8") as baselineFile:
+            json.dump(results, baselineFile, indent = 2)
+        print("Saved the baseline to " + baselinePath)
+    elif os.path.exists(baselinePath):
+        with open(baselinePath, encoding = "utf-8") as baselineFile:
+            regressions = compareToBaseline(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression, file = sys.stderr)
+        if not regressions:
+            print("No regressions against " + baselinePath)
+        status = 1 if regressions else 0
+    sys.exit(status)
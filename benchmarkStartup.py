@@ -0,0 +1,97 @@
+# Measures the fixed cost every CLI run and every fresh worker pays before it
+# gets any work done: importing recipeTransformer, loading the spaCy model, and
+# pushing the first recipe through a transformation. Each measurement runs in a
+# brand new interpreter so nothing is already warm. The recipe is a saved page
+# and ConceptNet is answered from the benchmark fixtures (see
+# benchmarkPipeline.py), so no time goes to the network and every run does the
+# same work.
+
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import recipeTransformer
+print(time.perf_counter() - start)
+"""
+
+FIRST_TRANSFORM_SCRIPT = """
+import time, json, sys
+timings = dict()
+start = time.perf_counter()
+import recipeTransformer
+timings["import"] = time.perf_counter() - start
+
+# Untimed: point ConceptNet at the fixtures, and turn off the parse cache so the recipe really gets parsed
+from benchmarkPipeline import FixtureBackend, loadFixtures
+from conceptNet import ConceptNetClient
+from recipeScraper import formulateJSONFromHTML
+pages, edges = loadFixtures(sys.argv[2])
+recipeTransformer.Transformer.conceptNet = ConceptNetClient(backend = FixtureBackend(edges), cachePath = None)
+recipeTransformer.Transformer.parseCache = None
+
+stageStart = time.perf_counter()
+with open(sys.argv[1], encoding = "utf-8") as pageFile:
+    newTransformer = recipeTransformer.Transformer(recipeData = formulateJSONFromHTML(pageFile.read()))
+timings["readPage"] = time.perf_counter() - stageStart
+
+stageStart = time.perf_counter()
+recipeTransformer.loadNLP()
+timings["modelLoad"] = time.perf_counter() - stageStart
+
+stageStart = time.perf_counter()
+newTransformer.transform(sys.argv[3])
+timings["firstTransform"] = time.perf_counter() - stageStart
+
+timings["total"] = timings["import"] + timings["readPage"] + timings["modelLoad"] + timings["firstTransform"]
+print(json.dumps(timings))
+"""
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarkFixtures")
+
+################################################################################
+# Name: runFresh                                                               #
+# Params: script (Python source), args (extra argv for the script)             #
+# Returns: String (whatever the script printed)                                #
+# Notes: Runs the script in a new interpreter from this directory, so the repo #
+# modules import the same way they would for a real CLI run.                   #
+################################################################################
+def runFresh(script, args = []):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run([sys.executable, "-c", script] + args, cwd = here, check = True,
+    stdout = subprocess.PIPE, universal_newlines = True).stdout.strip().split("\n")[-1]
+
+################################################################################
+# Name: median                                                                 #
+# Params: values (list of numbers)                                             #
+# Returns: Float                                                               #
+# Notes: Medians are less noisy than means for process start-up times.         #
+################################################################################
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2 == 1:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time importing recipeTransformer and the first transform in a fresh process.")
+    parser.add_argument("--runs", type = int, default = 5, help = "fresh processes per measurement")
+    parser.add_argument("--fixtures", default = DEFAULT_FIXTURES_DIR, help = "benchmark fixtures answering the ConceptNet lookups")
+    parser.add_argument("--page", help = "saved recipe page used for the first-transform measurement (defaults to the first page in the fixtures)")
+    parser.add_argument("--type", default = "to vegetarian", help = "transformation used for the first-transform measurement")
+    parser.add_argument("--skip-transform", action = "store_true", help = "only measure the import")
+    args = parser.parse_args()
+
+    importTimes = [float(runFresh(IMPORT_SCRIPT)) for run in range(args.runs)]
+    print("import recipeTransformer: median " + "%.3f" % median(importTimes) + "s over " + str(args.runs) + " runs")
+
+    if not args.skip_transform:
+        page = args.page or os.path.join(args.fixtures, "pages", sorted(os.listdir(os.path.join(args.fixtures, "pages")))[0])
+        allTimings = [json.loads(runFresh(FIRST_TRANSFORM_SCRIPT, [page, args.fixtures, args.type])) for run in range(args.runs)]
+        for stage in ["import", "readPage", "modelLoad", "firstTransform", "total"]:
+            print("first transform, " + stage + ": median " + "%.3f" % median([timings[stage] for timings in allTimings]) + "s")
@@ -0,0 +1,86 @@
+# Compares the single-pass SubstitutionMatcher with the two replace loops that
+# _instTransformation used before it, on made-up instructions that mention the
+# transformed ingredients. The old cost grew with instructions x substitutions x
+# words; the matcher's should grow with the length of the instructions only.
+
+from substitution import SubstitutionMatcher
+import argparse
+import random
+import timeit
+
+FOODS = ["beef", "chicken", "pork", "sausage", "turkey", "steak", "salmon", "shrimp", "bacon", "lamb", "butter", "cheese",
+"cream", "milk", "broth", "stock", "sirloin", "breast", "tenderloin", "oregano", "basil", "thyme", "cumin", "paprika"]
+FILLER = ["add", "the", "stir", "into", "pan", "and", "cook", "until", "browned", "over", "medium", "heat", "then", "with", "remaining"]
+
+################################################################################
+# Name: legacySubstitute                                                       #
+# Params: sentence (an instruction), transformedIng (dict of original ->       #
+# replacement)                                                                 #
+# Returns: String                                                              #
+# Notes: The replacement loops from _instTransformation as they were before    #
+# substitution.py, kept here only to benchmark against.                        #
+################################################################################
+def legacySubstitute(sentence, transformedIng):
+    finalInst = sentence
+    for oldIng in transformedIng:
+        if len(oldIng.split(" ")) > 1 and all([x.lower() in finalInst.lower() for x in oldIng.split(" ")]):
+            finalInst = finalInst.replace(oldIng, transformedIng[oldIng])
+            finalInst = finalInst.replace(oldIng.lower(), transformedIng[oldIng])
+
+    for oldIng in transformedIng:
+        if oldIng.lower() in finalInst.lower() or any([x.lower() in finalInst.lower() for x in oldIng.split(" ")]):
+            if len(oldIng) > 1:
+                for ing in oldIng.split(" "):
+                    if ing not in transformedIng[oldIng]:
+                        finalInst = finalInst.replace(ing, transformedIng[oldIng])
+                        finalInst = finalInst.replace(ing.lower(), transformedIng[oldIng])
+            else:
+                finalInst = finalInst.replace(oldIng, transformedIng[oldIng])
+                finalInst = finalInst.replace(oldIng.lower(), transformedIng[oldIng])
+    return finalInst
+
+################################################################################
+# Name: makeWorkload                                                           #
+# Params: substitutionCount, instructionCount, rng (random.Random)             #
+# Returns: Tuple of (transformedIng dict, list of instructions)                #
+# Notes: Half of the ingredients are two-word phrases, and every instruction   #
+# mentions a few of them among filler words.                                   #
+################################################################################
+def makeWorkload(substitutionCount, instructionCount, rng):
+    transformedIng = dict()
+    while len(transformedIng) < substitutionCount:
+        original = rng.choice(FOODS) + str(len(transformedIng))
+        if rng.random() < 0.5:
+            original = rng.choice(FILLER[8:]) + " " + original
+        transformedIng[original] = rng.choice(["tofu", "vegetable broth", "coconut oil", "chorizo"])
+
+    originals = list(transformedIng)
+    instructions = []
+    for i in range(instructionCount):
+        words = [rng.choice(FILLER) for w in range(rng.randint(8, 20))]
+        for mention in range(3):
+            words.insert(rng.randrange(len(words)), rng.choice(originals))
+        instructions.append(" ".join(words).capitalize())
+    return transformedIng, instructions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time SubstitutionMatcher against the old _instTransformation loops.")
+    parser.add_argument("--instructions", type = int, default = 50, help = "instructions per transformation")
+    parser.add_argument("--repeat", type = int, default = 5, help = "timing repeats (the best one is reported)")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for substitutionCount in [4, 16, 64, 256]:
+        transformedIng, instructions = makeWorkload(substitutionCount, args.instructions, rng)
+        runLegacy = lambda: [legacySubstitute(sentence, transformedIng) for sentence in instructions]
+
+        def runMatcher(): # Building the matcher is part of every transformation, so it is timed too
+            matcher = SubstitutionMatcher(transformedIng)
+            return [matcher.substitute(sentence) for sentence in instructions]
+
+        number = max(1, 2000 // substitutionCount)
+        legacyTime = min(timeit.repeat(runLegacy, number = number, repeat = args.repeat)) / number
+        matcherTime = min(timeit.repeat(runMatcher, number = number, repeat = args.repeat)) / number
+        print(str(substitutionCount).rjust(4) + " substitutions x " + str(args.instructions) + " instructions: legacy " +
+        "%.3f" % (legacyTime * 1000) + "ms, matcher " + "%.3f" % (matcherTime * 1000) + "ms (" + "%.1f" % (legacyTime / matcherTime) + "x)")
@@ -0,0 +1,324 @@
+# Scrapes many recipes in one run. Pages are fetched concurrently over a single
+# pooled session, every raw page is kept in a content-addressed cache on disk,
+# and the formulateJSON output for each recipe is written out as JSON Lines.
+# Cached pages are re-fetched with conditional requests (ETag/Last-Modified), so
+# re-running over the same list is cheap, and --offline never touches the network.
+# With --store, the recipes also go into a deduplicating corpus store (see
+# corpusStore.py) in batches.
+
+from recipeScraper import formulateJSONFromHTML
+from corpusStore import CorpusStore
+from concurrent.futures import ThreadPoolExecutor
+from allRecipes import recipeURLs
+import collections
+import threading
+import argparse
+import hashlib
+import sqlite3
+import gzip
+import json
+import time
+import sys
+import os
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "recipeTransformer", "pages")
+DEFAULT_REFRESH_AFTER = 24 * 60 * 60 # Pages fetched more recently than this are not even re-validated
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0 Safari/537.36"
+
+class PageCache:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: directory (where the cache lives)                                #
+    # Returns: None                                                            #
+    # Notes: Page bodies are stored gzipped under objects/, named by the       #
+    # SHA-256 of their content, so identical pages are only kept once. A small #
+    # SQLite table maps each URL to its current content hash and the           #
+    # validators needed for a conditional re-fetch.                            #
+    ############################################################################
+    def __init__(self, directory = DEFAULT_CACHE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connectionPid = None
+
+    ############################################################################
+    # Name: _connect                                                           #
+    # Params: None                                                             #
+    # Returns: sqlite3.Connection                                              #
+    # Notes: Opened lazily and re-opened after a fork, like                    #
+    # conceptNet.DiskCache.                                                    #
+    ############################################################################
+    def _connect(self):
+        if self.connection is None or self.connectionPid != os.getpid():
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok = True)
+            self.connection = sqlite3.connect(os.path.join(self.directory, "pages.sqlite"), timeout = 30, check_same_thread = False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, hash TEXT, etag TEXT, lastModified TEXT, fetched REAL)")
+            self.connection.commit()
+            self.connectionPid = os.getpid()
+        return self.connection
+
+    ############################################################################
+    # Name: _objectPath                                                        #
+    # Params: contentHash (hex SHA-256 of a page)                              #
+    # Returns: String                                                          #
+    # Notes: Objects are spread over 256 subdirectories so no one directory    #
+    # gets huge.                                                               #
+    ############################################################################
+    def _objectPath(self, contentHash):
+        return os.path.join(self.directory, "objects", contentHash[:2], contentHash + ".html.gz")
+
+    ############################################################################
+    # Name: lookup                                                             #
+    # Params: url                                                              #
+    # Returns: Dict with hash, etag, lastModified and fetched, or None if the  #
+    # URL was never cached                                                     #
+    # Notes: Also returns None if the page itself has gone missing from disk,  #
+    # so it simply gets fetched again.                                         #
+    ############################################################################
+    def lookup(self, url):
+        with self.lock:
+            row = self._connect().execute("SELECT hash, etag, lastModified, fetched FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self._objectPath(row[0])):
+            return None
+        return {"hash": row[0], "etag": row[1], "lastModified": row[2], "fetched": row[3]}
+
+    ############################################################################
+    # Name: read                                                               #
+    # Params: contentHash (from lookup)                                        #
+    # Returns: String (the raw page)                                           #
+    # Notes: Pages are kept gzipped, so this decompresses them too.            #
+    ############################################################################
+    def read(self, contentHash):
+        with gzip.open(self._objectPath(contentHash), "rt", encoding = "utf-8") as page:
+            return page.read()
+
+    ############################################################################
+    # Name: store                                                              #
+    # Params: url, pageHTML (the raw page), etag and lastModified (response    #
+    # validators, if any)                                                      #
+    # Returns: String (the content hash)                                       #
+    # Notes: The object is written to a temporary file and renamed into place, #
+    # so a crash never leaves a truncated page behind.                         #
+    ############################################################################
+    def store(self, url, pageHTML, etag = None, lastModified = None):
+        content = pageHTML.encode("utf-8")
+        contentHash = hashlib.sha256(content).hexdigest()
+        objectPath = self._objectPath(contentHash)
+        if not os.path.exists(objectPath):
+            os.makedirs(os.path.dirname(objectPath), exist_ok = True)
+            temporaryPath = objectPath + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+            with gzip.open(temporaryPath, "wb") as page:
+                page.write(content)
+            os.replace(temporaryPath, objectPath)
+
+        with self.lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url, contentHash, etag, lastModified, time.time()))
+            connection.commit()
+        return contentHash
+
+    ############################################################################
+    # Name: touch                                                              #
+    # Params: url                                                              #
+    # Returns: None                                                            #
+    # Notes: Marks a cached page as freshly validated after the server         #
+    # answered 304 Not Modified.                                               #
+    ############################################################################
+    def touch(self, url):
+        with self.lock:
+            connection = self._connect()
+            connection.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), url))
+            connection.commit()
+
+class BulkScraper:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: cache (a PageCache), workers (concurrent fetches, which is also  #
+    # the connection pool size), offline (only serve from the cache),          #
+    # refreshAfter (seconds before a cached page gets re-validated), timeout   #
+    # (seconds per request)                                                    #
+    # Returns: None                                                            #
+    # Notes: Nothing touches the network until the first page is fetched.      #
+    ############################################################################
+    def __init__(self, cache, workers = 8, offline = False, refreshAfter = DEFAULT_REFRESH_AFTER, timeout = 30):
+        self.cache = cache
+        self.workers = workers
+        self.offline = offline
+        self.refreshAfter = refreshAfter
+        self.timeout = timeout
+        self.session = None
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: _session                                                           #
+    # Params: None                                                             #
+    # Returns: requests.Session                                                #
+    # Notes: One session for the whole run with a pool as big as our thread    #
+    # pool, so every worker reuses a kept-alive connection.                    #
+    ############################################################################
+    def _session(self):
+        with self.lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = self.workers, max_retries = 2)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+                self.session.headers["User-Agent"] = USER_AGENT
+            return self.session
+
+    ############################################################################
+    # Name: fetchPage                                                          #
+    # Params: source (a URL, or the path of a page saved to disk)              #
+    # Returns: String (the raw page)                                           #
+    # Notes: Saved pages are read straight from disk. For URLs, a recently     #
+    # fetched copy is used as is, an older one is re-validated with a          #
+    # conditional request, and anything else is downloaded and cached. A 304   #
+    # for a page that is not cached raises a LookupError rather than caching   #
+    # an empty page.                                                           #
+    ############################################################################
+    def fetchPage(self, source):
+        if source.startswith("file://"):
+            source = source[len("file://"):]
+        if not source.startswith("http://") and not source.startswith("https://"):
+            with open(source, encoding = "utf-8") as page:
+                return page.read()
+
+        entry = self.cache.lookup(source)
+        if entry is not None and (self.offline or time.time() - entry["fetched"] < self.refreshAfter):
+            return self.cache.read(entry["hash"])
+        if self.offline:
+            raise LookupError(source + " is not in the page cache")
+
+        headers = dict()
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["lastModified"]:
+                headers["If-Modified-Since"] = entry["lastModified"]
+        response = self._session().get(source, headers = headers, timeout = self.timeout)
+        if response.status_code == 304:
+            if entry is None: # Not something we asked for, and its empty body is no page
+                raise LookupError(source + " answered 304 Not Modified, but there is no cached copy of it")
+            self.cache.touch(source)
+            return self.cache.read(entry["hash"])
+
+        response.raise_for_status()
+        self.cache.store(source, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.text
+
+    ############################################################################
+    # Name: scrapeOne                                                          #
+    # Params: source (a URL or saved page)                                     #
+    # Returns: Dict (the formulateJSON output plus the source under "url", or  #
+    # the source and an "error" message)                                       #
+    # Notes: Errors are caught here so that one bad page does not stop the     #
+    # rest of the batch.                                                       #
+    ############################################################################
+    def scrapeOne(self, source):
+        try:
+            recipe = {"url": source}
+            recipe.update(formulateJSONFromHTML(self.fetchPage(source)))
+            return recipe
+        except Exception as error:
+            return {"url": source, "error": type(error).__name__ + ": " + str(error)}
+
+    ############################################################################
+    # Name: scrape                                                             #
+    # Params: sources (iterable of URLs or saved pages)                        #
+    # Returns: Generator of dicts from scrapeOne, in the same order as sources #
+    # Notes: See boundedMap; sources is only read as fast as the output is     #
+    # used, so it can be a stream of any length.                               #
+    ############################################################################
+    def scrape(self, sources):
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for recipe in boundedMap(self.scrapeOne, sources, executor, 2 * self.workers):
+                yield recipe
+
+################################################################################
+# Name: boundedMap                                                             #
+# Params: function, items (iterable), executor (a concurrent.futures           #
+# executor), window (most calls in flight at once)                             #
+# Returns: Generator of function(item) for every item, in the same order as    #
+# items                                                                        #
+# Notes: Unlike executor.map, which submits every item before returning        #
+# anything, this only reads the next item once a result has been handed on, so #
+# a slow consumer holds back the reading and memory stays bounded however long #
+# items is.                                                                    #
+################################################################################
+def boundedMap(function, items, executor, window):
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+################################################################################
+# Name: readSourceList                                                         #
+# Params: path (a text file with one URL or saved page per line)               #
+# Returns: List of strings                                                     #
+# Notes: Blank lines and lines starting with # are skipped.                    #
+################################################################################
+def readSourceList(path):
+    sources = []
+    with open(path, encoding = "utf-8") as sourceFile:
+        for line in sourceFile:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                sources.append(line)
+    return sources
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Scrape many recipes into JSON Lines.")
+    parser.add_argument("sources", nargs = "*", help = "recipe URLs or saved pages (defaults to allRecipes.recipeURLs)")
+    parser.add_argument("--url-file", help = "file with one URL or saved page per line")
+    parser.add_argument("--output", help = "JSON Lines output file (defaults to stdout, unless --store is given)")
+    parser.add_argument("--store", help = "also add the recipes to this corpus store (see corpusStore.py)")
+    parser.add_argument("--cache", default = DEFAULT_CACHE_DIR, help = "page cache directory")
+    parser.add_argument("--workers", type = int, default = 8, help = "concurrent fetches")
+    parser.add_argument("--offline", action = "store_true", help = "only use pages already in the cache")
+    parser.add_argument("--refresh-after", type = float, default = DEFAULT_REFRESH_AFTER, help = "seconds before a cached page is re-validated")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.url_file:
+        sources.extend(readSourceList(args.url_file))
+    if not sources:
+        sources = list(recipeURLs)
+
+    scraper = BulkScraper(PageCache(args.cache), args.workers, args.offline, args.refresh_after)
+    store = CorpusStore(args.store) if args.store else None
+    output = open(args.output, "w", encoding = "utf-8") if args.output else (None if store is not None else sys.stdout)
+    failures = 0
+    batch = [] # Recipes waiting to go into the store
+    added = 0
+    duplicates = 0
+    for recipe in scraper.scrape(sources):
+        if "error" in recipe:
+            failures += 1
+            print("Could not scrape " + recipe["url"] + ": " + recipe["error"], file = sys.stderr)
+            continue
+        if output is not None:
+            output.write(json.dumps(recipe) + "\n")
+            output.flush()
+        if store is not None:
+            batch.append(recipe)
+            if len(batch) >= 500: # One transaction per batch, not per recipe
+                newRecipes, oldRecipes = store.addMany(batch)
+                added += newRecipes
+                duplicates += oldRecipes
+                batch = []
+    if store is not None and batch:
+        newRecipes, oldRecipes = store.addMany(batch)
+        added += newRecipes
+        duplicates += oldRecipes
+    if output is not None and output is not sys.stdout:
+        output.close()
+    print("Scraped " + str(len(sources) - failures) + " of " + str(len(sources)) + " recipes.", file = sys.stderr)
+    if store is not None:
+        print("Stored " + str(added) + " new recipes (" + str(duplicates) + " already in the store).", file = sys.stderr)
+    sys.exit(1 if failures else 0)
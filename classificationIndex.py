@@ -0,0 +1,151 @@
+# An offline digest of the ConceptNet dump holding just the answers the
+# transformer needs: which terms are foods, spices, verbs, and cooking tools.
+# Building it takes one pass over the dump; after that every classification is
+# a lookup in a memory-mapped hash table (see mappedTable.py) instead of an HTTP
+# call plus a scan over 100 edges.
+
+from conceptNet import iterDumpEdges
+from mappedTable import writeMappedTable, MappedTable
+import sys
+import os
+
+INDEX_VERSION = 1 # Bump this whenever the rules in buildClassificationIndex change
+
+# Section names inside the index file
+FOOD = "food" # Single words that are a kind of food
+FOOD_PHRASE = "foodPhrase" # Underscore-joined phrases like "ground_beef"
+SPICE = "spice"
+VERB = "verb"
+COOKING_TOOL = "cookingTool"
+
+################################################################################
+# Name: _term                                                                  #
+# Params: uri (a ConceptNet node like "/c/en/ground_beef/n")                   #
+# Returns: String                                                              #
+# Notes: Just the term part of the node, lowercased.                           #
+################################################################################
+def _term(uri):
+    return uri.split("/")[3].lower()
+
+################################################################################
+# Name: buildClassificationIndex                                               #
+# Params: dumpPath (ConceptNet assertions CSV), indexPath (output file)        #
+# Returns: Dict of section name -> number of terms                             #
+# Notes: The rules mirror the edge checks the transformer used to run on live  #
+# API responses. IsA edges pointing at "/food" make a single word a food, and  #
+# IsA edges mentioning "food" anywhere make a two-word phrase one. IsA edges   #
+# pointing at "/spice" make a spice, MannerOf edges mark the verb ("/v") nodes #
+# on either side, and UsedFor edges ending at "cook" mark cooking tools.       #
+################################################################################
+def buildClassificationIndex(dumpPath, indexPath):
+    sections = {FOOD: set(), FOOD_PHRASE: set(), SPICE: set(), VERB: set(), COOKING_TOOL: set()}
+    for assertion, relation, start, end in iterDumpEdges(dumpPath):
+        relation = relation.lower()
+        if relation == "/r/isa":
+            startTerm = _term(start)
+            if "_" in startTerm:
+                if "food" in end.lower():
+                    sections[FOOD_PHRASE].add(startTerm)
+            else:
+                if "/food" in end.lower():
+                    sections[FOOD].add(startTerm)
+                if "/spice" in end.lower():
+                    sections[SPICE].add(startTerm)
+        elif relation == "/r/mannerof":
+            for node in (start, end):
+                if node.split("/")[4:5] == ["v"]:
+                    sections[VERB].add(_term(node))
+        elif relation == "/r/usedfor" and _term(end) == "cook":
+            sections[COOKING_TOOL].add(_term(start))
+
+    writeMappedTable(indexPath, sections, {"kind": "classification", "version": INDEX_VERSION})
+    return dict((name, len(terms)) for name, terms in sections.items())
+
+class ClassificationIndex:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (a file made by buildClassificationIndex)                   #
+    # Returns: None                                                            #
+    # Notes: Raises a ValueError if the file was built by a different version  #
+    # of the rules, since its answers would no longer match ours.              #
+    ############################################################################
+    def __init__(self, path):
+        self.table = MappedTable(path)
+        if self.table.metadata.get("kind") != "classification" or self.table.metadata.get("version") != INDEX_VERSION:
+            raise ValueError(path + " is not a version " + str(INDEX_VERSION) + " classification index; please rebuild it")
+        self.foods = self.table.section(FOOD)
+        self.foodPhrases = self.table.section(FOOD_PHRASE)
+        self.spices = self.table.section(SPICE)
+        self.verbs = self.table.section(VERB)
+        self.cookingTools = self.table.section(COOKING_TOOL)
+        status = os.stat(path)
+        self.fingerprint = str(INDEX_VERSION) + ":" + str(status.st_size) + ":" + str(int(status.st_mtime)) # Changes whenever the file is rebuilt
+
+    ############################################################################
+    # Name: isFood                                                             #
+    # Params: term (a single word)                                             #
+    # Returns: Boolean                                                         #
+    # Notes: Stands in for the IsA-food edge scan in Transformer._isAFood.     #
+    ############################################################################
+    def isFood(self, term):
+        return term.lower() in self.foods
+
+    ############################################################################
+    # Name: isFoodPhrase                                                       #
+    # Params: firstWord, secondWord (e.g. "ground" and "beef")                 #
+    # Returns: Boolean                                                         #
+    # Notes: Stands in for the two-word phrase lookup in                       #
+    # Transformer._ingParse.                                                   #
+    ############################################################################
+    def isFoodPhrase(self, firstWord, secondWord):
+        return (firstWord + "_" + secondWord).lower() in self.foodPhrases
+
+    ############################################################################
+    # Name: isSpice                                                            #
+    # Params: term (a single word)                                             #
+    # Returns: Boolean                                                         #
+    # Notes: Used to collect spices for the style transformations.             #
+    ############################################################################
+    def isSpice(self, term):
+        return term.lower() in self.spices
+
+    ############################################################################
+    # Name: isVerb                                                             #
+    # Params: term (a single word)                                             #
+    # Returns: Boolean                                                         #
+    # Notes: Stands in for the MannerOf edge scan in Transformer._isAnAction.  #
+    ############################################################################
+    def isVerb(self, term):
+        return term.lower() in self.verbs
+
+    ############################################################################
+    # Name: isCookingTool                                                      #
+    # Params: term (a single word)                                             #
+    # Returns: Boolean                                                         #
+    # Notes: Stands in for the UsedFor-cook edge scan in                       #
+    # Transformer._instParse.                                                  #
+    ############################################################################
+    def isCookingTool(self, term):
+        return term.lower() in self.cookingTools
+
+openIndexes = dict() # Path -> ClassificationIndex, so every Transformer in a process shares one mapping
+
+################################################################################
+# Name: loadClassificationIndex                                                #
+# Params: path (a file made by buildClassificationIndex)                       #
+# Returns: ClassificationIndex                                                 #
+# Notes: Maps each file only once per process. Worker processes forked after   #
+# this is called inherit the mapping as well.                                  #
+################################################################################
+def loadClassificationIndex(path):
+    if path not in openIndexes:
+        openIndexes[path] = ClassificationIndex(path)
+    return openIndexes[path]
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        counts = buildClassificationIndex(sys.argv[2], sys.argv[3])
+        for name in sorted(counts):
+            print(name + ": " + str(counts[name]))
+    else:
+        print("Usage: python classificationIndex.py build <conceptnet-assertions.csv.gz> <classification.idx>")
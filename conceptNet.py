@@ -0,0 +1,549 @@
+# A small client layer for the ConceptNet API. Every lookup goes through an
+# in-process LRU first, then a durable SQLite cache on disk, and only then the
+# backend: either the live API or a local copy of the ConceptNet edge dump.
+# The dump format is described here: https://github.com/commonsense/conceptnet5/wiki/Downloads
+
+from concurrent.futures import ThreadPoolExecutor
+from metrics import instrumented, currentCollector, collecting, recordCacheLookup, recordCount
+from collections import OrderedDict
+import threading
+import sqlite3
+import json
+import gzip
+import time
+import sys
+import os
+
+CONCEPTNET_URL = "http://api.conceptnet.io"
+QUERY_LIMIT = 100 # Number of edges fetched per concept (this is what the transformer always asked for)
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recipeTransformer", "conceptnet.sqlite")
+DEFAULT_TTL = 30 * 24 * 60 * 60 # ConceptNet barely changes, so a month is plenty
+DEFAULT_MAX_ENTRIES = 500000
+DEFAULT_RATE = 2.0 # Requests per second; the public API asks for no more than 120 a minute
+
+################################################################################
+# Name: conceptURI                                                             #
+# Params: term (a word or underscore-joined phrase like "ground_beef")         #
+# Returns: String                                                              #
+# Notes: The key every cache layer uses for a concept.                         #
+################################################################################
+def conceptURI(term):
+    return "/c/en/" + term
+
+################################################################################
+# Name: conceptNode                                                            #
+# Params: uri (a full ConceptNet node like "/c/en/beef/n/wn/food")             #
+# Returns: String                                                              #
+# Notes: Strips the part of speech and sense off a node, since the API returns #
+# edges for "/c/en/beef/n" when you ask for "/c/en/beef".                      #
+################################################################################
+def conceptNode(uri):
+    return "/".join(uri.split("/")[:4])
+
+################################################################################
+# Name: conceptLabel                                                           #
+# Params: uri (a full ConceptNet node)                                         #
+# Returns: String                                                              #
+# Notes: The dump does not carry the human readable labels the API gives us,   #
+# but for English nodes they are just the term with spaces.                    #
+################################################################################
+def conceptLabel(uri):
+    return uri.split("/")[3].replace("_", " ")
+
+################################################################################
+# Name: makeEdge                                                               #
+# Params: assertion, relation, start, end (URIs from a dump row)               #
+# Returns: Dict                                                                #
+# Notes: Builds an edge shaped like the ones the API returns, keeping only the #
+# fields the transformer actually reads.                                       #
+################################################################################
+def makeEdge(assertion, relation, start, end):
+    return {"@id": assertion, "rel": {"@id": relation},
+    "start": {"@id": start, "label": conceptLabel(start)},
+    "end": {"@id": end, "label": conceptLabel(end)}}
+
+################################################################################
+# Name: trimEdge                                                               #
+# Params: edge (an edge dict from the API)                                     #
+# Returns: Dict                                                                #
+# Notes: The API sends a lot of provenance we never look at, so only the same  #
+# fields makeEdge builds get cached.                                           #
+################################################################################
+def trimEdge(edge):
+    return {"@id": edge["@id"], "rel": {"@id": edge["rel"]["@id"]},
+    "start": {"@id": edge["start"]["@id"], "label": edge["start"].get("label", "")},
+    "end": {"@id": edge["end"]["@id"], "label": edge["end"].get("label", "")}}
+
+################################################################################
+# Name: iterDumpEdges                                                          #
+# Params: dumpPath (path to a ConceptNet assertions CSV, gzipped or not)       #
+# Returns: Generator of (assertion, relation, start, end) tuples               #
+# Notes: Only English-to-English edges are kept since that is all the          #
+# transformer ever asks about. The dump is several GB, so this streams.        #
+################################################################################
+def iterDumpEdges(dumpPath):
+    opener = gzip.open if dumpPath.endswith(".gz") else open
+    with opener(dumpPath, "rt", encoding = "utf-8") as dump:
+        for line in dump:
+            fields = line.split("\t")
+            if len(fields) < 4:
+                continue
+            assertion, relation, start, end = fields[:4]
+            if start.startswith("/c/en/") and end.startswith("/c/en/"):
+                yield assertion, relation, start, end
+
+class LRUCache:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: maxSize (number of entries held before the oldest is dropped)    #
+    # Returns: None                                                            #
+    # Notes: A plain OrderedDict LRU. Guarded by a lock since the prefetching  #
+    # and worker code may share one client between threads.                    #
+    ############################################################################
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: key                                                              #
+    # Returns: The cached value, or None                                       #
+    # Notes: Marks the entry as most recently used.                            #
+    ############################################################################
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: key, value                                                       #
+    # Returns: None                                                            #
+    # Notes: Drops the least recently used entries once we are over maxSize.   #
+    ############################################################################
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last = False)
+
+class DiskCache:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (SQLite file), ttl (seconds an entry stays valid),          #
+    # maxEntries (row count above which the oldest entries are evicted)        #
+    # Returns: None                                                            #
+    # Notes: The connection is opened lazily and re-opened after a fork, so a  #
+    # cache created in a parent process is safe to use in its workers.         #
+    ############################################################################
+    def __init__(self, path = DEFAULT_CACHE_PATH, ttl = DEFAULT_TTL, maxEntries = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connectionPid = None
+        self.writesSinceEviction = 0
+
+    ############################################################################
+    # Name: _connect                                                           #
+    # Params: None                                                             #
+    # Returns: sqlite3.Connection                                              #
+    # Notes: Opens (or re-opens, if we are in a forked child) the cache        #
+    # database and makes sure the table exists.                                #
+    ############################################################################
+    def _connect(self):
+        if self.connection is None or self.connectionPid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            self.connection = sqlite3.connect(self.path, timeout = 30, check_same_thread = False)
+            self.connection.execute("PRAGMA journal_mode=WAL") # Lets several processes read while one writes
+            self.connection.execute("CREATE TABLE IF NOT EXISTS concepts (uri TEXT PRIMARY KEY, body TEXT, fetched REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS conceptsByAge ON concepts (fetched)")
+            self.connection.commit()
+            self.connectionPid = os.getpid()
+        return self.connection
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: uri (concept URI)                                                #
+    # Returns: Dict, or None if missing or expired                             #
+    # Notes: Expired entries are left in place; the next put overwrites them.  #
+    ############################################################################
+    def get(self, uri):
+        with self.lock:
+            row = self._connect().execute("SELECT body, fetched FROM concepts WHERE uri = ?", (uri,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: uri (concept URI), value (the response to store)                 #
+    # Returns: None                                                            #
+    # Notes: Every so often this also runs the TTL and size based eviction.    #
+    ############################################################################
+    def put(self, uri, value):
+        with self.lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO concepts VALUES (?, ?, ?)", (uri, json.dumps(value), time.time()))
+            self.writesSinceEviction += 1
+            if self.writesSinceEviction >= 1000: # Counting rows on every write would be wasteful
+                self._evict(connection)
+            connection.commit()
+
+    ############################################################################
+    # Name: putMany                                                            #
+    # Params: results (dict of uri -> response)                                #
+    # Returns: None                                                            #
+    # Notes: Same as put, but in one transaction, which matters when a         #
+    # prefetch brings back hundreds of concepts.                               #
+    ############################################################################
+    def putMany(self, results):
+        now = time.time()
+        with self.lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO concepts VALUES (?, ?, ?)",
+            [(uri, json.dumps(value), now) for uri, value in results.items()])
+            self.writesSinceEviction += len(results)
+            if self.writesSinceEviction >= 1000:
+                self._evict(connection)
+            connection.commit()
+
+    ############################################################################
+    # Name: _evict                                                             #
+    # Params: connection (open cache database)                                 #
+    # Returns: None                                                            #
+    # Notes: First drop anything past its TTL, then the oldest rows until we   #
+    # are back under maxEntries.                                               #
+    ############################################################################
+    def _evict(self, connection):
+        self.writesSinceEviction = 0
+        connection.execute("DELETE FROM concepts WHERE fetched < ?", (time.time() - self.ttl,))
+        count = connection.execute("SELECT COUNT(*) FROM concepts").fetchone()[0]
+        if count > self.maxEntries:
+            connection.execute("DELETE FROM concepts WHERE uri IN (SELECT uri FROM concepts ORDER BY fetched LIMIT ?)",
+            (count - self.maxEntries,))
+
+class RateLimiter:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: perSecond (sustained request rate), burst (how many requests may #
+    # go out back to back)                                                     #
+    # Returns: None                                                            #
+    # Notes: A token bucket shared by every thread talking to one host.        #
+    ############################################################################
+    def __init__(self, perSecond, burst = 1):
+        self.perSecond = perSecond
+        self.burst = burst
+        self.tokens = burst
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: wait                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Blocks the calling thread until it is allowed to send a request.  #
+    ############################################################################
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * self.perSecond)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.perSecond
+            time.sleep(delay)
+
+class HTTPBackend:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: baseURL (where the API lives; point it at a local stand-in for   #
+    # offline runs), limit (edges per concept), timeout (seconds),             #
+    # maxConnections (size of the connection pool and of the prefetch thread   #
+    # pool), retries (attempts per request on connection errors and 429/5xx    #
+    # answers), backoff (seconds, doubled on every retry), perSecond and burst #
+    # (rate limit for this host, or None for no limit)                         #
+    # Returns: None                                                            #
+    # Notes: One keep-alive session is reused for every call. Nothing is       #
+    # created until the first request.                                         #
+    ############################################################################
+    def __init__(self, baseURL = CONCEPTNET_URL, limit = QUERY_LIMIT, timeout = 30, maxConnections = 8, retries = 4, backoff = 0.5,
+    perSecond = DEFAULT_RATE, burst = 10):
+        self.baseURL = baseURL.rstrip("/")
+        self.limit = limit
+        self.timeout = timeout
+        self.maxConnections = maxConnections
+        self.retries = retries
+        self.backoff = backoff
+        self.rateLimiter = RateLimiter(perSecond, burst) if perSecond is not None else None
+        self.session = None
+        self.executor = None
+        self.ownerPid = None # The process the session and thread pool belong to
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: fingerprint                                                        #
+    # Params: None                                                             #
+    # Returns: String naming where the answers come from                       #
+    # Notes: Part of the parse cache key, so parses made from another server   #
+    # or with another edge limit miss.                                         #
+    ############################################################################
+    def fingerprint(self):
+        return "http " + self.baseURL + " limit " + str(self.limit)
+
+    ############################################################################
+    # Name: _session                                                           #
+    # Params: None                                                             #
+    # Returns: requests.Session                                                #
+    # Notes: Mounts an adapter whose pool is as big as our thread pool, so     #
+    # concurrent prefetches reuse connections instead of opening new ones, and #
+    # lets urllib3 handle retrying with exponential backoff.                   #
+    ############################################################################
+    def _session(self):
+        with self.lock:
+            if self.ownerPid != os.getpid(): # A forked worker inherits neither live threads nor safe sockets, so start over
+                self.session = None
+                self.executor = None
+                self.ownerPid = os.getpid()
+            if self.session is None:
+                import requests # Only needed when we actually go to the network
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total = self.retries, backoff_factor = self.backoff, status_forcelist = [429, 500, 502, 503, 504])
+                adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.maxConnections, max_retries = retry)
+                self.session = requests.Session()
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+
+    ############################################################################
+    # Name: fetch                                                              #
+    # Params: uri (concept URI)                                                #
+    # Returns: Dict with an "edges" list                                       #
+    # Notes: The same request the transformer used to make by hand. Counted    #
+    # (requests and bytes received) in the current metrics collector, if any.  #
+    ############################################################################
+    @instrumented("conceptNet HTTP")
+    def fetch(self, uri):
+        session = self._session()
+        if self.rateLimiter is not None:
+            self.rateLimiter.wait()
+        response = session.get(self.baseURL + uri + "?offset=0&limit=" + str(self.limit), timeout = self.timeout)
+        recordCount("networkRequests")
+        recordCount("networkBytes", len(response.content))
+        response.raise_for_status()
+        return {"edges": [trimEdge(edge) for edge in response.json().get("edges", [])]}
+
+    ############################################################################
+    # Name: fetchMany                                                          #
+    # Params: uris (list of concept URIs)                                      #
+    # Returns: Dict of uri -> response                                         #
+    # Notes: Runs the requests on a bounded thread pool, so a batch takes      #
+    # about as long as its slowest request (or as long as the rate limit       #
+    # allows) instead of the sum of all of them. The pool threads report to    #
+    # the caller's metrics collector.                                          #
+    ############################################################################
+    def fetchMany(self, uris):
+        self._session()
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers = self.maxConnections)
+        collector = currentCollector()
+        results = dict()
+        for uri, result in zip(uris, self.executor.map(lambda uri: self._fetchQuietly(uri, collector), uris)):
+            if result is not None:
+                results[uri] = result
+        return results
+
+    ############################################################################
+    # Name: _fetchQuietly                                                      #
+    # Params: uri (concept URI), collector (metrics.Metrics to report to, or   #
+    # None)                                                                    #
+    # Returns: Dict, or None if the request failed                             #
+    # Notes: One bad concept should not sink the whole batch. Whatever failed  #
+    # is simply left uncached, so the later query call retries it and raises   #
+    # the real error.                                                          #
+    ############################################################################
+    def _fetchQuietly(self, uri, collector = None):
+        try:
+            with collecting(collector):
+                return self.fetch(uri)
+        except Exception:
+            return None
+
+class LocalDumpBackend:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: indexPath (an SQLite file made by buildDumpIndex), limit         #
+    # Returns: None                                                            #
+    # Notes: Serves lookups straight from a local copy of the edge dump, so    #
+    # the transformer never touches the network.                               #
+    ############################################################################
+    def __init__(self, indexPath, limit = QUERY_LIMIT):
+        if not os.path.exists(indexPath):
+            raise FileNotFoundError("No ConceptNet dump index at " + indexPath + " (build one with: python conceptNet.py build-index <dump> <index>)")
+        self.indexPath = indexPath
+        self.limit = limit
+        self.connection = None
+        self.connectionPid = None
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: fingerprint                                                        #
+    # Params: None                                                             #
+    # Returns: String naming the dump index, its size and when it was built    #
+    # Notes: As for HTTPBackend.fingerprint; rebuilding the index changes it.  #
+    ############################################################################
+    def fingerprint(self):
+        stat = os.stat(self.indexPath)
+        return "dump " + os.path.abspath(self.indexPath) + " " + str(stat.st_size) + " " + str(int(stat.st_mtime)) + " limit " + str(self.limit)
+
+    ############################################################################
+    # Name: fetch                                                              #
+    # Params: uri (concept URI)                                                #
+    # Returns: Dict with an "edges" list                                       #
+    # Notes: Reads the dump index read-only, re-opening it after a fork.       #
+    ############################################################################
+    @instrumented("conceptNet dump")
+    def fetch(self, uri):
+        with self.lock:
+            if self.connection is None or self.connectionPid != os.getpid():
+                self.connection = sqlite3.connect("file:" + self.indexPath + "?mode=ro", uri = True, check_same_thread = False)
+                self.connectionPid = os.getpid()
+            rows = self.connection.execute("SELECT assertion, relation, start, end FROM edges WHERE node = ? LIMIT ?",
+            (conceptNode(uri), self.limit)).fetchall()
+        return {"edges": [makeEdge(*row) for row in rows]}
+
+    ############################################################################
+    # Name: fetchMany                                                          #
+    # Params: uris (list of concept URIs)                                      #
+    # Returns: Dict of uri -> response                                         #
+    # Notes: Local lookups are fast enough that there is nothing to gain from  #
+    # threads here.                                                            #
+    ############################################################################
+    def fetchMany(self, uris):
+        return dict((uri, self.fetch(uri)) for uri in uris)
+
+################################################################################
+# Name: buildDumpIndex                                                         #
+# Params: dumpPath (ConceptNet assertions CSV), indexPath (SQLite output)      #
+# Returns: Integer (number of edges indexed)                                   #
+# Notes: Every edge is filed under both of its nodes, mirroring how the API    #
+# answers "/c/en/<term>" with edges pointing either way.                       #
+################################################################################
+def buildDumpIndex(dumpPath, indexPath):
+    if os.path.exists(indexPath):
+        os.remove(indexPath)
+    connection = sqlite3.connect(indexPath)
+    connection.execute("CREATE TABLE edges (node TEXT, assertion TEXT, relation TEXT, start TEXT, end TEXT)")
+    count = 0
+    batch = []
+    for assertion, relation, start, end in iterDumpEdges(dumpPath):
+        batch.append((conceptNode(start), assertion, relation, start, end))
+        if conceptNode(end) != conceptNode(start):
+            batch.append((conceptNode(end), assertion, relation, start, end))
+        count += 1
+        if len(batch) >= 100000:
+            connection.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    connection.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", batch)
+    connection.execute("CREATE INDEX edgesByNode ON edges (node)") # Building the index last is much faster
+    connection.commit()
+    connection.close()
+    return count
+
+class ConceptNetClient:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: backend (HTTPBackend by default), cachePath (SQLite file, or     #
+    # None for no disk cache), memorySize (LRU entries), ttl, maxEntries       #
+    # Returns: None                                                            #
+    # Notes: Nothing is opened here, so building a client at import time is    #
+    # free.                                                                    #
+    ############################################################################
+    def __init__(self, backend = None, cachePath = DEFAULT_CACHE_PATH, memorySize = 4096, ttl = DEFAULT_TTL, maxEntries = DEFAULT_MAX_ENTRIES):
+        self.backend = backend if backend is not None else HTTPBackend()
+        self.memory = LRUCache(memorySize)
+        self.disk = DiskCache(cachePath, ttl, maxEntries) if cachePath is not None else None
+
+    ############################################################################
+    # Name: fingerprint                                                        #
+    # Params: None                                                             #
+    # Returns: String                                                          #
+    # Notes: The backend's fingerprint, or its class name for backends that do #
+    # not have one.                                                            #
+    ############################################################################
+    def fingerprint(self):
+        if hasattr(self.backend, "fingerprint"):
+            return self.backend.fingerprint()
+        return type(self.backend).__name__
+
+    ############################################################################
+    # Name: query                                                              #
+    # Params: term (word or underscore-joined phrase to look up)               #
+    # Returns: Dict with an "edges" list, shaped like the API response         #
+    # Notes: Checks the LRU, then the disk cache, then the backend. Whatever   #
+    # the backend says is written back to both caches.                         #
+    ############################################################################
+    def query(self, term):
+        uri = conceptURI(term)
+        result = self.memory.get(uri)
+        recordCacheLookup("conceptNet memory", result is not None)
+        if result is not None:
+            return result
+
+        if self.disk is not None:
+            result = self.disk.get(uri)
+            recordCacheLookup("conceptNet disk", result is not None)
+        if result is None:
+            result = self.backend.fetch(uri)
+            if self.disk is not None:
+                self.disk.put(uri, result)
+        self.memory.put(uri, result)
+        return result
+
+    ############################################################################
+    # Name: prefetch                                                           #
+    # Params: terms (iterable of words or underscore-joined phrases)           #
+    # Returns: None                                                            #
+    # Notes: Resolves a whole batch of concepts at once. Anything already      #
+    # cached is skipped, and the rest goes to the backend in one concurrent    #
+    # batch, so the query calls that follow are all cache hits.                #
+    ############################################################################
+    def prefetch(self, terms):
+        missing = []
+        for uri in set(conceptURI(term) for term in terms):
+            inMemory = self.memory.get(uri) is not None
+            recordCacheLookup("conceptNet memory", inMemory)
+            if inMemory:
+                continue
+            result = self.disk.get(uri) if self.disk is not None else None
+            if self.disk is not None:
+                recordCacheLookup("conceptNet disk", result is not None)
+            if result is not None:
+                self.memory.put(uri, result)
+            else:
+                missing.append(uri)
+
+        if missing:
+            results = self.backend.fetchMany(sorted(missing))
+            if self.disk is not None:
+                self.disk.putMany(results)
+            for uri, result in results.items():
+                self.memory.put(uri, result)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build-index":
+        print("Indexed " + str(buildDumpIndex(sys.argv[2], sys.argv[3])) + " edges.")
+    else:
+        print("Usage: python conceptNet.py build-index <conceptnet-assertions.csv.gz> <index.sqlite>")
@@ -0,0 +1,383 @@
+# A local store for a corpus of scraped recipes: one SQLite file holding every
+# recipe once (as zlib-compressed JSON, keyed by a hash of its ingredients and
+# instructions, so the same recipe scraped under two URLs is only kept once), the
+# URLs each recipe was found at, and an inverted index from ingredient terms to
+# the recipes that use them. That makes questions like "which recipes have beef
+# sirloin in them" a single indexed query, and since recipes are read back in
+# pages of a few hundred, a corpus of any size can be streamed through the
+# transformer without ever being held in memory.
+#
+# Ingredient terms come from similarityIndex.ingredientTerms (the amount and unit
+# taken off, known foods kept as whole phrases), plus every word of each phrase,
+# so "beef sirloin" finds a recipe whether the knowledge base knows it as one food
+# or as two words. Every word is cut back to its singular by spelling alone
+# (normalizedWord), so "onion" and "onions" find the same recipes. Since the
+# phrases depend on the knowledge base, a store remembers which one it was
+# indexed with and asks to be reindexed when that changes.
+
+from similarityIndex import ingredientTerms
+from knowledgeBase import loadKnowledgeBase
+from conceptNet import LRUCache
+import threading
+import hashlib
+import sqlite3
+import json
+import zlib
+import time
+import sys
+import os
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recipeTransformer", "corpus.sqlite")
+TERMS_VERSION = "2" # Bump this whenever ingredientTokens changes, so old stores know to reindex
+SQLITE_HEADER = b"SQLite format 3\x00" # The first bytes of every SQLite file
+
+################################################################################
+# Name: contentHash                                                            #
+# Params: recipeData (a scraped recipe)                                        #
+# Returns: String (hex SHA-256)                                                #
+# Notes: Like parseCache.parseKey, only the ingredients and instructions       #
+# count, so the same recipe under another URL or name is a duplicate.          #
+################################################################################
+def contentHash(recipeData):
+    content = json.dumps([recipeData["ingredients"], recipeData["instructions"]], ensure_ascii = False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+################################################################################
+# Name: normalizedWord                                                         #
+# Params: word (lower case)                                                    #
+# Returns: String (the word with a plural ending taken off)                    #
+# Notes: Goes by spelling alone, so a word and its plural always end up the    #
+# same whatever the knowledge base knows ("tomatoes" and "tomato" both give    #
+# "tomato", "berries" gives "berry"). Words like "asparagus" and "glass" are   #
+# left alone.                                                                  #
+################################################################################
+def normalizedWord(word):
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes", "zes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+################################################################################
+# Name: ingredientTokens                                                       #
+# Params: ingredient (an ingredient line or a query, like "beef sirloin"),     #
+# knowledgeBase                                                                #
+# Returns: Set of the terms the inverted index files it under                  #
+# Notes: A query's tokens are worked out the same way, so a recipe matches     #
+# when it has all of them.                                                     #
+################################################################################
+def ingredientTokens(ingredient, knowledgeBase):
+    tokens = set()
+    for term in ingredientTerms(ingredient, knowledgeBase):
+        words = [normalizedWord(word) for word in term.split(" ")]
+        tokens.add(" ".join(words))
+        tokens.update(words)
+    return tokens
+
+################################################################################
+# Name: isCorpusStore                                                          #
+# Params: path                                                                 #
+# Returns: Boolean                                                             #
+# Notes: Checks the file header, so a store can be passed wherever a recipe    #
+# file can, whatever it is named.                                              #
+################################################################################
+def isCorpusStore(path):
+    try:
+        with open(path, "rb") as storeFile:
+            return storeFile.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+class CorpusStore:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (SQLite file), knowledgeBase (defaults to the usual one)    #
+    # Returns: None                                                            #
+    # Notes: Opened lazily and re-opened after a fork, like                    #
+    # parseCache.ParseCache.                                                   #
+    ############################################################################
+    def __init__(self, path = DEFAULT_STORE_PATH, knowledgeBase = None):
+        self.path = path
+        self.knowledgeBase = knowledgeBase
+        self.lineTokens = LRUCache(65536) # Ingredient line -> its tokens; lines like "1 cup butter" recur all through a corpus
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connectionPid = None
+
+    ############################################################################
+    # Name: _connect                                                           #
+    # Params: None                                                             #
+    # Returns: sqlite3.Connection                                              #
+    # Notes: Makes sure the tables exist.                                      #
+    ############################################################################
+    def _connect(self):
+        if self.connection is None or self.connectionPid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            connection = sqlite3.connect(self.path, timeout = 30, check_same_thread = False)
+            connection.execute("PRAGMA journal_mode=WAL") # Lets the transformer stream recipes out while the scraper adds more
+            connection.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, and much faster for bulk inserts
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS recipes (id INTEGER PRIMARY KEY, hash TEXT UNIQUE, name TEXT, body BLOB, added REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, recipeId INTEGER)")
+            connection.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT, recipeId INTEGER, PRIMARY KEY (term, recipeId)) WITHOUT ROWID")
+            connection.execute("INSERT OR IGNORE INTO meta VALUES ('termsVersion', ?)", (TERMS_VERSION,))
+            connection.execute("INSERT OR IGNORE INTO meta VALUES ('knowledgeHash', ?)", (self._knowledge().metadata["sourceHash"],))
+            connection.commit()
+            self.connection = connection
+            self.connectionPid = os.getpid()
+        return self.connection
+
+    ############################################################################
+    # Name: _knowledge                                                         #
+    # Params: None                                                             #
+    # Returns: KnowledgeBase                                                   #
+    # Notes: Loaded the first time it is needed.                               #
+    ############################################################################
+    def _knowledge(self):
+        if self.knowledgeBase is None:
+            self.knowledgeBase = loadKnowledgeBase()
+        return self.knowledgeBase
+
+    ############################################################################
+    # Name: _tokens                                                            #
+    # Params: recipeData                                                       #
+    # Returns: Set of the terms for all the recipe's ingredients               #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def _tokens(self, recipeData):
+        knowledgeBase = self._knowledge()
+        tokens = set()
+        for ingredient in recipeData.get("ingredients", []):
+            lineTokens = self.lineTokens.get(ingredient)
+            if lineTokens is None:
+                lineTokens = frozenset(ingredientTokens(ingredient, knowledgeBase))
+                self.lineTokens.put(ingredient, lineTokens)
+            tokens.update(lineTokens)
+        return tokens
+
+    ############################################################################
+    # Name: _checkVersion                                                      #
+    # Params: connection                                                       #
+    # Returns: None                                                            #
+    # Notes: Raises a ValueError for a store indexed with other                #
+    # ingredientTokens or another knowledge base, which "python corpusStore.py #
+    # reindex" fixes. Queries by ingredient only make sense against terms made #
+    # the same way.                                                            #
+    ############################################################################
+    def _checkVersion(self, connection):
+        meta = dict(connection.execute("SELECT key, value FROM meta"))
+        if meta.get("termsVersion") != TERMS_VERSION:
+            problem = "was indexed with version " + str(meta.get("termsVersion")) + " ingredient terms"
+        elif meta.get("knowledgeHash") != self._knowledge().metadata["sourceHash"]:
+            problem = "was indexed with another version of the knowledge base"
+        else:
+            return
+        raise ValueError(self.path + " " + problem + "; run \"python corpusStore.py reindex " + self.path + "\"")
+
+    ############################################################################
+    # Name: addMany                                                            #
+    # Params: recipes (iterable of scraped recipe dicts, e.g. from             #
+    # BulkScraper.scrape), batchSize (recipes per transaction)                 #
+    # Returns: Tuple of (recipes added, duplicates skipped)                    #
+    # Notes: Reads recipes as it goes, so it can be a stream of any length.    #
+    # Recipes with an "error" are skipped and not counted. A duplicate still   #
+    # has its URL recorded.                                                    #
+    ############################################################################
+    def addMany(self, recipes, batchSize = 500):
+        added = 0
+        duplicates = 0
+        batch = []
+        for recipeData in recipes:
+            if "error" in recipeData:
+                continue
+            batch.append(recipeData)
+            if len(batch) >= batchSize:
+                newRecipes = self._addBatch(batch)
+                added += newRecipes
+                duplicates += len(batch) - newRecipes
+                batch = []
+        if batch:
+            newRecipes = self._addBatch(batch)
+            added += newRecipes
+            duplicates += len(batch) - newRecipes
+        return added, duplicates
+
+    ############################################################################
+    # Name: add                                                                #
+    # Params: recipeData (a scraped recipe)                                    #
+    # Returns: Boolean (False if the store already had it)                     #
+    # Notes: One transaction per call; addMany is much faster for many         #
+    # recipes.                                                                 #
+    ############################################################################
+    def add(self, recipeData):
+        return self._addBatch([recipeData]) == 1
+
+    ############################################################################
+    # Name: _addBatch                                                          #
+    # Params: batch (list of scraped recipes)                                  #
+    # Returns: Integer (how many of them were new)                             #
+    # Notes: The hashing, compressing and term extraction happen before the    #
+    # lock is taken, and the whole batch goes in as one transaction.           #
+    ############################################################################
+    def _addBatch(self, batch):
+        rows = []
+        for recipeData in batch:
+            body = json.dumps(recipeData, ensure_ascii = False, separators = (",", ":"))
+            rows.append((contentHash(recipeData), recipeData.get("recipeName"), zlib.compress(body.encode("utf-8")), recipeData.get("url"),
+            self._tokens(recipeData)))
+        now = time.time()
+        added = 0
+        with self.lock:
+            connection = self._connect()
+            self._checkVersion(connection)
+            with connection: # One transaction, rolled back if anything fails
+                for recipeHash, name, body, url, tokens in rows:
+                    cursor = connection.execute("INSERT OR IGNORE INTO recipes (hash, name, body, added) VALUES (?, ?, ?, ?)", (recipeHash, name, body, now))
+                    if cursor.rowcount:
+                        recipeId = cursor.lastrowid
+                        connection.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)", [(token, recipeId) for token in tokens])
+                        added += 1
+                    else:
+                        recipeId = connection.execute("SELECT id FROM recipes WHERE hash = ?", (recipeHash,)).fetchone()[0]
+                    if url:
+                        connection.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, recipeId))
+        return added
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: recipeId                                                         #
+    # Returns: Dict (the recipe as it was added), or None if there is no such  #
+    # recipe                                                                   #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def get(self, recipeId):
+        with self.lock:
+            row = self._connect().execute("SELECT body FROM recipes WHERE id = ?", (recipeId,)).fetchone()
+        return None if row is None else json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    ############################################################################
+    # Name: recipeIds                                                          #
+    # Params: ingredient (like "beef sirloin"), or None for every recipe       #
+    # Returns: List of recipe IDs, in the order the recipes were added         #
+    # Notes: A recipe matches when its ingredients have every one of the       #
+    # query's terms between them. An ingredient with no terms matches nothing. #
+    ############################################################################
+    def recipeIds(self, ingredient = None):
+        with self.lock:
+            connection = self._connect()
+            if ingredient is None:
+                return [row[0] for row in connection.execute("SELECT id FROM recipes ORDER BY id")]
+            self._checkVersion(connection)
+            tokens = sorted(ingredientTokens(ingredient, self._knowledge()))
+            if not tokens:
+                return []
+            query = ("SELECT recipeId FROM terms WHERE term IN (" + ", ".join("?" * len(tokens)) + ") GROUP BY recipeId HAVING COUNT(*) = ? ORDER BY recipeId")
+            return [row[0] for row in connection.execute(query, tokens + [len(tokens)])]
+
+    ############################################################################
+    # Name: recipes                                                            #
+    # Params: ingredient (as for recipeIds, or None for every recipe),         #
+    # pageSize (recipes read per query)                                        #
+    # Returns: Generator of (recipe ID, recipe dict) tuples, in the order the  #
+    # recipes were added                                                       #
+    # Notes: Only one page of recipes (and, for a query, its list of IDs) is   #
+    # in memory at a time, and no read transaction is held between pages, so   #
+    # the store can be added to meanwhile.                                     #
+    ############################################################################
+    def recipes(self, ingredient = None, pageSize = 200):
+        if ingredient is not None:
+            recipeIds = self.recipeIds(ingredient)
+            for start in range(0, len(recipeIds), pageSize):
+                page = recipeIds[start:start + pageSize]
+                with self.lock:
+                    rows = self._connect().execute("SELECT id, body FROM recipes WHERE id IN (" + ", ".join("?" * len(page)) + ") ORDER BY id",
+                    page).fetchall()
+                for recipeId, body in rows:
+                    yield recipeId, json.loads(zlib.decompress(body).decode("utf-8"))
+            return
+
+        lastId = 0
+        while True:
+            with self.lock:
+                rows = self._connect().execute("SELECT id, body FROM recipes WHERE id > ? ORDER BY id LIMIT ?", (lastId, pageSize)).fetchall()
+            if not rows:
+                return
+            for recipeId, body in rows:
+                yield recipeId, json.loads(zlib.decompress(body).decode("utf-8"))
+            lastId = rows[-1][0]
+
+    ############################################################################
+    # Name: urls                                                               #
+    # Params: None                                                             #
+    # Returns: List of every URL a stored recipe was scraped from              #
+    # Notes: The store's counterpart to allRecipes.recipeURLs.                 #
+    ############################################################################
+    def urls(self):
+        with self.lock:
+            return [row[0] for row in self._connect().execute("SELECT url FROM urls ORDER BY url")]
+
+    ############################################################################
+    # Name: __len__                                                            #
+    # Params: None                                                             #
+    # Returns: Integer (number of distinct recipes)                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def __len__(self):
+        with self.lock:
+            return self._connect().execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    ############################################################################
+    # Name: reindex                                                            #
+    # Params: pageSize (recipes re-read per transaction)                       #
+    # Returns: Integer (number of recipes reindexed)                           #
+    # Notes: Rebuilds the inverted index with the current ingredientTokens     #
+    # (and knowledge base), streaming the recipes like recipes does.           #
+    ############################################################################
+    def reindex(self, pageSize = 500):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM terms")
+        total = 0
+        lastId = 0
+        while True:
+            with self.lock:
+                connection = self._connect()
+                rows = connection.execute("SELECT id, body FROM recipes WHERE id > ? ORDER BY id LIMIT ?", (lastId, pageSize)).fetchall()
+                if not rows:
+                    break
+                with connection:
+                    for recipeId, body in rows:
+                        tokens = self._tokens(json.loads(zlib.decompress(body).decode("utf-8")))
+                        connection.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)", [(token, recipeId) for token in tokens])
+            total += len(rows)
+            lastId = rows[-1][0]
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('termsVersion', ?)", (TERMS_VERSION,))
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('knowledgeHash', ?)", (self._knowledge().metadata["sourceHash"],))
+        return total
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "add":
+        from recipeTransformer import readRecipeSources # Only the command line needs it, and it imports this module too
+        store = CorpusStore(sys.argv[2])
+        recipes = (recipeData for label, url, recipeData in readRecipeSources(sys.argv[3:]) if recipeData is not None)
+        added, duplicates = store.addMany(recipes)
+        print("Added " + str(added) + " recipes (" + str(duplicates) + " duplicates skipped); the store has " + str(len(store)) + ".")
+    elif len(sys.argv) == 4 and sys.argv[1] == "query":
+        for recipeId, recipeData in CorpusStore(sys.argv[2]).recipes(sys.argv[3]):
+            print(str(recipeId) + "\t" + str(recipeData.get("recipeName")) + "\t" + str(recipeData.get("url", "")))
+    elif len(sys.argv) == 3 and sys.argv[1] == "reindex":
+        print("Reindexed " + str(CorpusStore(sys.argv[2]).reindex()) + " recipes.")
+    else:
+        print("Usage: python corpusStore.py add <corpus.sqlite> <recipes.jsonl>...")
+        print("       python corpusStore.py query <corpus.sqlite> <ingredient>")
+        print("       python corpusStore.py reindex <corpus.sqlite>")
@@ -0,0 +1,211 @@
+# Transforms a whole corpus of recipes across every core. Recipes are handed out
+# in small chunks to a pool of worker processes, each holding its own spaCy model
+# and sharing the read-only classification index (the file is memory-mapped, so
+# the operating system keeps one copy of it for all of them). Results come back
+# in input order as JSON Lines, and a recipe that fails, even one that kills its
+# worker outright, only costs that recipe its entry.
+
+from recipeTransformer import Transformer, transformRecipes, readRecipeSources, loadNLP
+from conceptNet import ConceptNetClient, LocalDumpBackend
+from classificationIndex import loadClassificationIndex
+from similarityIndex import loadSimilarityIndex
+from knowledgeBase import loadKnowledgeBase
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import collections
+import argparse
+import json
+import sys
+import os
+
+################################################################################
+# Name: _initWorker                                                            #
+# Params: conceptNetIndexPath, classificationIndexPath (either may be None),   #
+# useParseCache, similarityIndexPath (or None)                                 #
+# Returns: None                                                                #
+# Notes: Runs once in every worker process as it starts, so the model load and #
+# index mapping are paid once per worker rather than once per chunk.           #
+################################################################################
+def _initWorker(conceptNetIndexPath, classificationIndexPath, useParseCache, similarityIndexPath = None):
+    if conceptNetIndexPath:
+        Transformer.conceptNet = ConceptNetClient(backend = LocalDumpBackend(conceptNetIndexPath))
+    if classificationIndexPath:
+        Transformer.classificationIndex = loadClassificationIndex(classificationIndexPath)
+    if similarityIndexPath:
+        Transformer.similarityIndex = loadSimilarityIndex(similarityIndexPath)
+    if not useParseCache:
+        Transformer.parseCache = None
+    loadNLP()
+
+################################################################################
+# Name: _transformChunk                                                        #
+# Params: chunk (list of (label, url, recipeData) tuples),                     #
+# transformationTypes, seed                                                    #
+# Returns: List of dicts from transformRecipes                                 #
+# Notes: What actually runs in the workers. transformRecipes already turns     #
+# ordinary exceptions into per-recipe error entries.                           #
+################################################################################
+def _transformChunk(chunk, transformationTypes, seed):
+    return transformRecipes(chunk, transformationTypes, seed)
+
+class CorpusTransformer:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: workers (processes; defaults to one per core), chunkSize         #
+    # (recipes per task), transformationTypes (list, or None for all of them), #
+    # conceptNetIndexPath and classificationIndexPath (passed on to every      #
+    # worker), seed (given to every Transformer, so a recipe's random choices  #
+    # do not depend on which worker or chunk it lands in), useParseCache       #
+    # (whether workers read and fill the shared parse cache),                  #
+    # similarityIndexPath (passed on to every worker)                          #
+    # Returns: None                                                            #
+    # Notes: No processes are started until transform is called.               #
+    ############################################################################
+    def __init__(self, workers = None, chunkSize = 8, transformationTypes = None, conceptNetIndexPath = None,
+    classificationIndexPath = None, seed = None, useParseCache = True, similarityIndexPath = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunkSize = chunkSize
+        self.transformationTypes = transformationTypes
+        self.conceptNetIndexPath = conceptNetIndexPath
+        self.classificationIndexPath = classificationIndexPath
+        self.seed = seed
+        self.useParseCache = useParseCache
+        self.similarityIndexPath = similarityIndexPath
+        self.window = 2 * self.workers # Chunks in flight at once, so every worker always has its next chunk queued
+        self.executor = None
+
+    ############################################################################
+    # Name: _startPool                                                         #
+    # Params: None                                                             #
+    # Returns: ProcessPoolExecutor                                             #
+    # Notes: Also used to replace a pool that broke because a worker died.     #
+    ############################################################################
+    def _startPool(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+        self.executor = ProcessPoolExecutor(max_workers = self.workers, initializer = _initWorker,
+        initargs = (self.conceptNetIndexPath, self.classificationIndexPath, self.useParseCache, self.similarityIndexPath))
+        return self.executor
+
+    ############################################################################
+    # Name: _chunks                                                            #
+    # Params: recipeSources (iterable of (label, url, recipeData) tuples)      #
+    # Returns: Generator of lists of at most chunkSize tuples                  #
+    # Notes: Reads the sources lazily, so a huge corpus is never all in memory #
+    # at once.                                                                 #
+    ############################################################################
+    def _chunks(self, recipeSources):
+        chunk = []
+        for source in recipeSources:
+            chunk.append(source)
+            if len(chunk) == self.chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    ############################################################################
+    # Name: _submit                                                            #
+    # Params: chunk (list of (label, url, recipeData) tuples)                  #
+    # Returns: Tuple of (future, the executor it went to)                      #
+    # Notes: A pool that broke since the last check is replaced first; its     #
+    # lost chunks are sorted out in transform.                                 #
+    ############################################################################
+    def _submit(self, chunk):
+        try:
+            return self.executor.submit(_transformChunk, chunk, self.transformationTypes, self.seed), self.executor
+        except BrokenProcessPool:
+            self._startPool()
+            return self.executor.submit(_transformChunk, chunk, self.transformationTypes, self.seed), self.executor
+
+    ############################################################################
+    # Name: _retryAlone                                                        #
+    # Params: chunk (a chunk that was lost when a worker died)                 #
+    # Returns: List of dicts, one per recipe in the chunk                      #
+    # Notes: Each recipe is sent off on its own and waited for before the next #
+    # one goes, so if the pool breaks again we know exactly which recipe did   #
+    # it. Only that recipe gets an error entry.                                #
+    ############################################################################
+    def _retryAlone(self, chunk):
+        entries = []
+        for source in chunk:
+            future, submittedTo = self._submit([source])
+            try:
+                entries.extend(future.result())
+            except BrokenProcessPool:
+                entries.append({"source": source[0], "error": "BrokenProcessPool: the worker died transforming this recipe"})
+                self._startPool()
+        return entries
+
+    ############################################################################
+    # Name: transform                                                          #
+    # Params: recipeSources (iterable of (label, url, recipeData) tuples, as   #
+    # from readRecipeSources)                                                  #
+    # Returns: Generator of dicts, one per source and in the same order        #
+    # Notes: At most window chunks are in flight, and results are handed back  #
+    # oldest first. When a worker dies the pool is restarted and every chunk   #
+    # lost with it is retried one recipe at a time (see _retryAlone).          #
+    ############################################################################
+    def transform(self, recipeSources):
+        chunks = self._chunks(recipeSources)
+        pending = collections.deque() # (chunk, future, executor it went to)
+        loadKnowledgeBase() # Compiles it here if need be, rather than in every worker at once
+        self._startPool()
+        try:
+            while True:
+                while len(pending) < self.window:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append((chunk,) + self._submit(chunk))
+                if not pending:
+                    break
+
+                chunk, future, submittedTo = pending.popleft()
+                try:
+                    entries = future.result()
+                except BrokenProcessPool:
+                    if submittedTo is self.executor: # The first casualty replaces the pool; the rest went to the old one
+                        self._startPool()
+                    entries = self._retryAlone(chunk)
+                except Exception as error: # E.g. a recipe that could not be pickled; the whole chunk shares the message
+                    entries = [{"source": source[0], "error": type(error).__name__ + ": " + str(error)} for source in chunk]
+
+                for entry in entries:
+                    yield entry
+        finally:
+            self.executor.shutdown(wait = True)
+            self.executor = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Transform a corpus of recipes on every core, writing JSON Lines.")
+    parser.add_argument("sources", nargs = "+", help = "recipe URLs, JSON files of scraped recipes (like bulkScraper.py writes) and/or corpus stores")
+    parser.add_argument("--containing", help = "only take the recipes in corpus stores that use this ingredient, like \"beef sirloin\"")
+    parser.add_argument("--type", action = "append", dest = "types", choices = Transformer.transformationTypes,
+    help = "transformation to apply (repeat for several; defaults to all of them)")
+    parser.add_argument("--output", help = "JSON Lines output file (defaults to stdout)")
+    parser.add_argument("--workers", type = int, help = "worker processes (defaults to one per core)")
+    parser.add_argument("--chunk-size", type = int, default = 8, help = "recipes handed to a worker at a time")
+    parser.add_argument("--conceptnet-index", help = "serve ConceptNet lookups from this local dump index (see conceptNet.py)")
+    parser.add_argument("--classification-index", help = "classify words with this precompiled index (see classificationIndex.py)")
+    parser.add_argument("--seed", type = int, help = "seed the random replacement choices so runs are reproducible")
+    parser.add_argument("--similarity-index", help = "pick replacements that suit each recipe with this index (see similarityIndex.py) instead of at random")
+    parser.add_argument("--no-parse-cache", action = "store_true", help = "parse every recipe from scratch, without reading or writing the parse cache")
+    args = parser.parse_args()
+
+    corpusTransformer = CorpusTransformer(args.workers, args.chunk_size, args.types, args.conceptnet_index, args.classification_index,
+    args.seed, not args.no_parse_cache, args.similarity_index)
+    output = open(args.output, "w", encoding = "utf-8") if args.output else sys.stdout
+    total = 0
+    failures = 0
+    for entry in corpusTransformer.transform(readRecipeSources(args.sources, args.containing)):
+        total += 1
+        if "error" in entry:
+            failures += 1
+            print("Could not transform " + entry["source"] + ": " + entry["error"], file = sys.stderr)
+        output.write(json.dumps(entry) + "\n")
+        output.flush()
+    if output is not sys.stdout:
+        output.close()
+    print("Transformed " + str(total - failures) + " of " + str(total) + " recipes.", file = sys.stderr)
+    sys.exit(1 if failures else 0)
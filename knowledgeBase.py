@@ -0,0 +1,249 @@
+# The substitution knowledge base: which words are foods (and of what kind), the
+# verbs ConceptNet misses, the cuisines with their swaps and spices, and the
+# dietary profiles. It is edited as knowledgeBase.json and compiled into a
+# memory-mapped table (see mappedTable.py), so loading it costs the same whether
+# it lists a dozen ingredients or thousands, and every process shares one copy.
+# The compiled file is rebuilt automatically whenever the JSON changes.
+#
+# Sections of the compiled file:
+#   terms:   word or phrase (lowercased) -> bitmask of its categories, as a little-endian integer
+#   members: category -> its words in JSON order, newline-separated
+#   swaps:   "<cuisine>\t<word>" -> the word it is swapped for
+
+from mappedTable import writeMappedTable, MappedTable
+import hashlib
+import json
+import sys
+import os
+
+KB_VERSION = 1 # Bump this whenever the compiled layout or compileKnowledgeBase changes
+DEFAULT_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledgeBase.json")
+DEFAULT_COMPILED_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recipeTransformer", "knowledgeBase.kb")
+
+COOKING_VERBS = "cookingVerbs" # Category for the verbs ConceptNet misses
+
+################################################################################
+# Name: _sourceHash                                                            #
+# Params: sourcePath (a knowledge base JSON file)                              #
+# Returns: String                                                              #
+# Notes: Stored in the compiled file so a stale one is noticed.                #
+################################################################################
+def _sourceHash(sourcePath):
+    with open(sourcePath, "rb") as sourceFile:
+        return hashlib.sha256(sourceFile.read()).hexdigest()
+
+################################################################################
+# Name: compileKnowledgeBase                                                   #
+# Params: sourcePath (knowledge base JSON), compiledPath (output file)         #
+# Returns: Dict with the number of terms, categories and cuisines              #
+# Notes: Every food category, the cooking verbs, and two categories per        #
+# cuisine ("<cuisine>Swaps" for the words it swaps and "<cuisine>Spices") each #
+# get a bit. Words and phrases are stored lowercased; members keeps them as    #
+# written, since chosen replacements come from there.                          #
+################################################################################
+def compileKnowledgeBase(sourcePath = DEFAULT_SOURCE_PATH, compiledPath = DEFAULT_COMPILED_PATH):
+    with open(sourcePath, encoding = "utf-8") as sourceFile:
+        source = json.load(sourceFile)
+
+    memberLists = dict() # Category -> words, in the order they were written
+    for category, words in source.get("foods", dict()).items():
+        memberLists[category] = list(words)
+    memberLists[COOKING_VERBS] = list(source.get(COOKING_VERBS, []))
+    swaps = dict()
+    for cuisine, guide in source.get("cuisines", dict()).items():
+        memberLists[cuisine + "Swaps"] = list(guide.get("swaps", dict()))
+        memberLists[cuisine + "Spices"] = list(guide.get("spices", []))
+        for word, replacement in guide.get("swaps", dict()).items():
+            swaps[cuisine + "\t" + word.lower()] = replacement.encode("utf-8")
+
+    categories = list(memberLists)
+    masks = dict()
+    for bit in range(len(categories)):
+        for word in memberLists[categories[bit]]:
+            masks[word.lower()] = masks.get(word.lower(), 0) | (1 << bit)
+    terms = dict()
+    for term, mask in masks.items():
+        terms[term] = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+    metadata = {"kind": "knowledgeBase", "version": KB_VERSION, "sourceHash": _sourceHash(sourcePath), "categories": categories,
+    "foodCategories": list(source.get("foods", dict())), "cuisines": list(source.get("cuisines", dict())),
+    "profiles": source.get("profiles", dict()), "longestTerm": max([len(term.split()) for term in terms] + [1])}
+    members = dict((category, "\n".join(words).encode("utf-8")) for category, words in memberLists.items())
+
+    os.makedirs(os.path.dirname(os.path.abspath(compiledPath)), exist_ok = True)
+    writeMappedTable(compiledPath, {"terms": terms, "members": members, "swaps": swaps}, metadata)
+    return {"terms": len(terms), "categories": len(categories), "cuisines": len(metadata["cuisines"])}
+
+class KnowledgeBase:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (a file made by compileKnowledgeBase)                       #
+    # Returns: None                                                            #
+    # Notes: Raises a ValueError for files from another version of the         #
+    # compiler.                                                                #
+    ############################################################################
+    def __init__(self, path):
+        self.table = MappedTable(path)
+        self.metadata = self.table.metadata
+        if self.metadata.get("kind") != "knowledgeBase" or self.metadata.get("version") != KB_VERSION:
+            raise ValueError(path + " is not a version " + str(KB_VERSION) + " knowledge base; please recompile it")
+        self.terms = self.table.section("terms")
+        self.memberLists = self.table.section("members")
+        self.swaps = self.table.section("swaps")
+        self.categories = self.metadata["categories"]
+        self.bits = dict((self.categories[bit], 1 << bit) for bit in range(len(self.categories)))
+        self.foodMask = 0 # Any of these bits makes a word a food
+        for category in self.metadata["foodCategories"]:
+            self.foodMask |= self.bits[category]
+        self.cuisines = self.metadata["cuisines"]
+        self.profiles = self.metadata["profiles"]
+        self.longestTerm = self.metadata["longestTerm"]
+
+    ############################################################################
+    # Name: bit                                                                #
+    # Params: category                                                         #
+    # Returns: Integer, or None for categories the knowledge base does not     #
+    # have                                                                     #
+    # Notes: Bits follow the order categories were compiled in, so they only   #
+    # mean something within one compiled file.                                 #
+    ############################################################################
+    def bit(self, category):
+        return self.bits.get(category)
+
+    ############################################################################
+    # Name: mask                                                               #
+    # Params: term (a word or phrase)                                          #
+    # Returns: Integer (0 for terms the knowledge base does not know)          #
+    # Notes: Case-insensitive.                                                 #
+    ############################################################################
+    def mask(self, term):
+        value = self.terms.get(term.lower())
+        return int.from_bytes(value, "little") if value is not None else 0
+
+    ############################################################################
+    # Name: isIn                                                               #
+    # Params: term, category                                                   #
+    # Returns: Boolean                                                         #
+    # Notes: E.g. isIn("sirloin", "pairedWords").                              #
+    ############################################################################
+    def isIn(self, term, category):
+        return bool(self.mask(term) & self.bits.get(category, 0))
+
+    ############################################################################
+    # Name: isFood                                                             #
+    # Params: term                                                             #
+    # Returns: Boolean                                                         #
+    # Notes: Whether the term is in any of the food categories; this is what   #
+    # Transformer.allFoods used to hold.                                       #
+    ############################################################################
+    def isFood(self, term):
+        return bool(self.mask(term) & self.foodMask)
+
+    ############################################################################
+    # Name: isCookingVerb                                                      #
+    # Params: term                                                             #
+    # Returns: Boolean                                                         #
+    # Notes: ConceptNet can be very bad at detecting what things are verbs, so #
+    # these are listed by hand.                                                #
+    ############################################################################
+    def isCookingVerb(self, term):
+        return self.isIn(term, COOKING_VERBS)
+
+    ############################################################################
+    # Name: longestMatch                                                       #
+    # Params: words (list of words), start (index to match from)               #
+    # Returns: Tuple of (number of words matched, mask), or (0, 0) when no     #
+    # term starts there                                                        #
+    # Notes: Tries the longest phrase the knowledge base has first, so         #
+    # "coconut oil" wins over "oil".                                           #
+    ############################################################################
+    def longestMatch(self, words, start = 0):
+        for length in range(min(self.longestTerm, len(words) - start), 0, -1):
+            mask = self.mask(" ".join(words[start:start + length]))
+            if mask:
+                return length, mask
+        return 0, 0
+
+    ############################################################################
+    # Name: members                                                            #
+    # Params: category                                                         #
+    # Returns: List of strings (empty for unknown categories)                  #
+    # Notes: In the order the JSON lists them.                                 #
+    ############################################################################
+    def members(self, category):
+        value = self.memberLists.get(category)
+        if not value:
+            return []
+        return value.decode("utf-8").split("\n")
+
+    ############################################################################
+    # Name: swapFor                                                            #
+    # Params: cuisine (like "Mexican"), word                                   #
+    # Returns: String, or None if the cuisine does not swap that word          #
+    # Notes: The word is matched case-insensitively.                           #
+    ############################################################################
+    def swapFor(self, cuisine, word):
+        value = self.swaps.get(cuisine + "\t" + word.lower())
+        return value.decode("utf-8") if value is not None else None
+
+    ############################################################################
+    # Name: spicesFor                                                          #
+    # Params: cuisine                                                          #
+    # Returns: List of strings                                                 #
+    # Notes: Written the way they should appear in a recipe (e.g. "Chili       #
+    # Powder").                                                                #
+    ############################################################################
+    def spicesFor(self, cuisine):
+        return self.members(cuisine + "Spices")
+
+    ############################################################################
+    # Name: avoids                                                             #
+    # Params: profile (like "vegan"), term                                     #
+    # Returns: Boolean                                                         #
+    # Notes: Raises a KeyError for unknown profiles.                           #
+    ############################################################################
+    def avoids(self, profile, term):
+        mask = self.mask(term)
+        return any(mask & self.bits.get(category, 0) for category in self.profiles[profile]["avoid"])
+
+openKnowledgeBases = dict() # (source, compiled path) -> KnowledgeBase, so it is loaded once per process
+
+################################################################################
+# Name: loadKnowledgeBase                                                      #
+# Params: sourcePath (knowledge base JSON), compiledPath (where the compiled   #
+# form is kept)                                                                #
+# Returns: KnowledgeBase                                                       #
+# Notes: Compiles the JSON first if there is no compiled file yet or the JSON  #
+# changed since. Worker processes forked after this is called inherit the      #
+# mapping.                                                                     #
+################################################################################
+def loadKnowledgeBase(sourcePath = DEFAULT_SOURCE_PATH, compiledPath = DEFAULT_COMPILED_PATH):
+    key = (sourcePath, compiledPath)
+    if key not in openKnowledgeBases:
+        knowledgeBase = None
+        if os.path.exists(compiledPath):
+            try:
+                knowledgeBase = KnowledgeBase(compiledPath)
+                if knowledgeBase.metadata.get("sourceHash") != _sourceHash(sourcePath):
+                    knowledgeBase.table.close()
+                    knowledgeBase = None
+            except ValueError: # Compiled by another version; just compile it again
+                knowledgeBase = None
+        if knowledgeBase is None:
+            compileKnowledgeBase(sourcePath, compiledPath)
+            knowledgeBase = KnowledgeBase(compiledPath)
+        openKnowledgeBases[key] = knowledgeBase
+    return openKnowledgeBases[key]
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3, 4) and sys.argv[1] == "compile":
+        counts = compileKnowledgeBase(*sys.argv[2:])
+        for name in sorted(counts):
+            print(name + ": " + str(counts[name]))
+    elif len(sys.argv) == 3 and sys.argv[1] == "lookup":
+        knowledgeBase = loadKnowledgeBase()
+        mask = knowledgeBase.mask(sys.argv[2])
+        print(", ".join(category for category in knowledgeBase.categories if mask & knowledgeBase.bits[category]) or "(unknown)")
+    else:
+        print("Usage: python knowledgeBase.py compile [knowledgeBase.json] [knowledgeBase.kb]")
+        print("       python knowledgeBase.py lookup <term>")
@@ -0,0 +1,212 @@
+# A tiny read-only key/value file format that gets memory-mapped instead of
+# loaded. Each file holds named sections, and each section is an open-addressing
+# hash table, so a lookup is a hash plus a probe or two straight out of the page
+# cache. Since nothing is copied into the Python heap, every process that maps
+# the same file shares a single copy of it.
+#
+# Layout (all integers little-endian):
+#   header:   magic "RCPT", format version (uint16), reserved (uint16), metadata length (uint64)
+#   metadata: UTF-8 JSON with the section directory plus whatever the writer passed in
+#   sections: 8-byte aligned; a slot array of uint32 entry offsets (0 means empty)
+#             followed by entries of key length (uint16), value length (uint32), key, value
+
+import struct
+import mmap
+import json
+import zlib
+import os
+
+MAGIC = b"RCPT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQ")
+SLOT = struct.Struct("<I")
+ENTRY = struct.Struct("<HI")
+
+################################################################################
+# Name: _hashKey                                                               #
+# Params: key (bytes)                                                          #
+# Returns: Integer                                                             #
+# Notes: Python's own hash() is randomized per process, so a stable hash is    #
+# needed for a file that outlives the process that wrote it.                   #
+################################################################################
+def _hashKey(key):
+    return zlib.crc32(key)
+
+################################################################################
+# Name: _packSection                                                           #
+# Params: entries (dict of str -> bytes)                                       #
+# Returns: Tuple of (section bytes, slot count)                                #
+# Notes: The table is kept at most half full so probes stay short.             #
+################################################################################
+def _packSection(entries):
+    slotCount = 8
+    while slotCount < 2 * len(entries):
+        slotCount *= 2
+
+    slots = [0] * slotCount
+    body = bytearray()
+    entryStart = slotCount * SLOT.size
+    for key in sorted(entries): # Sorted so the same input always gives the same file
+        keyBytes = key.encode("utf-8")
+        value = entries[key]
+        slot = _hashKey(keyBytes) & (slotCount - 1)
+        while slots[slot] != 0:
+            slot = (slot + 1) & (slotCount - 1)
+        slots[slot] = entryStart + len(body)
+        body += ENTRY.pack(len(keyBytes), len(value)) + keyBytes + value
+
+    return b"".join(SLOT.pack(offset) for offset in slots) + bytes(body), slotCount
+
+################################################################################
+# Name: writeMappedTable                                                       #
+# Params: path (output file), sections (dict of section name -> either a dict  #
+# of str -> bytes, or an iterable of str for a plain set), metadata            #
+# (JSON-serializable dict stored alongside the tables)                         #
+# Returns: None                                                                #
+# Notes: Written to a temporary file and renamed into place, so readers that   #
+# already have the old file mapped are never handed a half-written one.        #
+################################################################################
+def writeMappedTable(path, sections, metadata = None):
+    packed = []
+    for name in sorted(sections):
+        entries = sections[name]
+        if not isinstance(entries, dict):
+            entries = dict.fromkeys(entries, b"")
+        packed.append((name, len(entries)) + _packSection(entries))
+
+    # The section offsets depend on the metadata length and vice versa, so settle the length first
+    directory = dict()
+    for name, count, data, slotCount in packed:
+        directory[name] = [0, slotCount, count]
+    allMetadata = {"sections": directory, "metadata": metadata or dict()}
+    while True:
+        offset = HEADER.size + len(json.dumps(allMetadata).encode("utf-8"))
+        changed = False
+        for name, count, data, slotCount in packed:
+            offset += -offset % 8
+            if directory[name][0] != offset:
+                directory[name][0] = offset
+                changed = True
+            offset += len(data)
+        if not changed:
+            break
+
+    metadataBytes = json.dumps(allMetadata).encode("utf-8")
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp" # Several processes may rebuild the same file at once
+    with open(temporaryPath, "wb") as output:
+        output.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(metadataBytes)))
+        output.write(metadataBytes)
+        for name, count, data, slotCount in packed:
+            output.write(b"\0" * (directory[name][0] - output.tell()))
+            output.write(data)
+    os.replace(temporaryPath, path)
+
+class MappedSection:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: buffer (the mmap), offset, slotCount, count (from the section    #
+    # directory)                                                               #
+    # Returns: None                                                            #
+    # Notes: Just remembers where the section lives; nothing is read yet.      #
+    ############################################################################
+    def __init__(self, buffer, offset, slotCount, count):
+        self.buffer = buffer
+        self.offset = offset
+        self.mask = slotCount - 1
+        self.count = count
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: key (str), default (returned when the key is missing)            #
+    # Returns: Bytes                                                           #
+    # Notes: Linear probing, comparing the stored key bytes in place.          #
+    ############################################################################
+    def get(self, key, default = None):
+        keyBytes = key.encode("utf-8")
+        slot = _hashKey(keyBytes) & self.mask
+        while True:
+            entryOffset = SLOT.unpack_from(self.buffer, self.offset + slot * SLOT.size)[0]
+            if entryOffset == 0:
+                return default
+            keyStart = self.offset + entryOffset + ENTRY.size
+            keyLength, valueLength = ENTRY.unpack_from(self.buffer, self.offset + entryOffset)
+            if keyLength == len(keyBytes) and self.buffer[keyStart:keyStart + keyLength] == keyBytes:
+                return self.buffer[keyStart + keyLength:keyStart + keyLength + valueLength]
+            slot = (slot + 1) & self.mask
+
+    ############################################################################
+    # Name: __contains__                                                       #
+    # Params: key (str)                                                        #
+    # Returns: Boolean                                                         #
+    # Notes: Lets a section be used like a set.                                #
+    ############################################################################
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    ############################################################################
+    # Name: __len__                                                            #
+    # Params: None                                                             #
+    # Returns: Integer                                                         #
+    # Notes: Number of keys in the section.                                    #
+    ############################################################################
+    def __len__(self):
+        return self.count
+
+    ############################################################################
+    # Name: items                                                              #
+    # Params: None                                                             #
+    # Returns: Generator of (str, bytes) pairs                                 #
+    # Notes: Walks the slot array, so this is for dumping and debugging, not   #
+    # for lookups.                                                             #
+    ############################################################################
+    def items(self):
+        for slot in range(self.mask + 1):
+            entryOffset = SLOT.unpack_from(self.buffer, self.offset + slot * SLOT.size)[0]
+            if entryOffset != 0:
+                keyLength, valueLength = ENTRY.unpack_from(self.buffer, self.offset + entryOffset)
+                keyStart = self.offset + entryOffset + ENTRY.size
+                yield (self.buffer[keyStart:keyStart + keyLength].decode("utf-8"),
+                self.buffer[keyStart + keyLength:keyStart + keyLength + valueLength])
+
+class MappedTable:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (a file made by writeMappedTable)                           #
+    # Returns: None                                                            #
+    # Notes: Maps the file read-only and checks the header. Raises a           #
+    # ValueError for files from an unknown format version.                     #
+    ############################################################################
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as mappedFile:
+            self.buffer = mmap.mmap(mappedFile.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, reserved, metadataLength = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a mapped table file")
+        if version != FORMAT_VERSION:
+            raise ValueError(path + " uses format version " + str(version) + " but we only read version " + str(FORMAT_VERSION))
+        allMetadata = json.loads(self.buffer[HEADER.size:HEADER.size + metadataLength].decode("utf-8"))
+        self.metadata = allMetadata["metadata"]
+        self.sections = dict()
+        for name, (offset, slotCount, count) in allMetadata["sections"].items():
+            self.sections[name] = MappedSection(self.buffer, offset, slotCount, count)
+
+    ############################################################################
+    # Name: section                                                            #
+    # Params: name (section name given to writeMappedTable)                    #
+    # Returns: MappedSection                                                   #
+    # Notes: Raises a KeyError for sections the file does not have.            #
+    ############################################################################
+    def section(self, name):
+        return self.sections[name]
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Unmaps the file. Only needed when a process wants to swap in a    #
+    # rebuilt file.                                                            #
+    ############################################################################
+    def close(self):
+        self.buffer.close()
@@ -0,0 +1,335 @@
+# Optional instrumentation for the transformer: how often each stage runs and
+# how long it takes, how the caches are doing, and how much goes over the network.
+# Instrumented functions report to whichever Metrics collector is active on the
+# current thread (see collecting), so a Transformer can gather its own recipe's
+# numbers even though the ConceptNet client is shared by every recipe. With no
+# collector active, an instrumented call costs one thread-local lookup.
+#
+# Stage times are wall time and include any instrumented stages called inside
+# them (e.g. _ingParse includes its _isAFood calls).
+#
+# The opt-in SamplingProfiler writes folded stacks ("frame;frame;frame count"),
+# which flamegraph.pl, speedscope and most other flame graph tools read directly.
+
+from collections import Counter
+import functools
+import threading
+import time
+import sys
+import os
+
+localState = threading.local() # localState.collector is the Metrics the current thread reports to
+
+class Metrics:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: parent (another Metrics that everything recorded here is also    #
+    # added to, or None)                                                       #
+    # Returns: None                                                            #
+    # Notes: A per-recipe collector usually has processMetrics as its parent,  #
+    # so the process-wide totals come for free.                                #
+    ############################################################################
+    def __init__(self, parent = None):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.stages = dict() # Stage -> [calls, total seconds, longest call in seconds]
+        self.caches = dict() # Cache -> [hits, misses]
+        self.counters = Counter() # E.g. networkRequests, networkBytes
+
+    ############################################################################
+    # Name: observe                                                            #
+    # Params: stage (name), seconds                                            #
+    # Returns: None                                                            #
+    # Notes: Records one call of the stage.                                    #
+    ############################################################################
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                self.stages[stage] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+        if self.parent is not None:
+            self.parent.observe(stage, seconds)
+
+    ############################################################################
+    # Name: cacheLookup                                                        #
+    # Params: cache (name), hit (Boolean)                                      #
+    # Returns: None                                                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def cacheLookup(self, cache, hit):
+        with self.lock:
+            stats = self.caches.setdefault(cache, [0, 0])
+            stats[0 if hit else 1] += 1
+        if self.parent is not None:
+            self.parent.cacheLookup(cache, hit)
+
+    ############################################################################
+    # Name: increment                                                          #
+    # Params: counter (name), amount                                           #
+    # Returns: None                                                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def increment(self, counter, amount = 1):
+        with self.lock:
+            self.counters[counter] += amount
+        if self.parent is not None:
+            self.parent.increment(counter, amount)
+
+    ############################################################################
+    # Name: snapshot                                                           #
+    # Params: None                                                             #
+    # Returns: Dict with "stages", "caches" (including hit rates) and          #
+    # "counters"                                                               #
+    # Notes: A JSON-serializable copy, safe to keep while recording goes on.   #
+    ############################################################################
+    def snapshot(self):
+        with self.lock:
+            stages = dict((stage, {"calls": stats[0], "seconds": stats[1], "maxSeconds": stats[2]}) for stage, stats in self.stages.items())
+            caches = dict((cache, {"hits": stats[0], "misses": stats[1], "hitRate": stats[0] / (stats[0] + stats[1])})
+            for cache, stats in self.caches.items())
+            return {"stages": stages, "caches": caches, "counters": dict(self.counters)}
+
+    ############################################################################
+    # Name: reset                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Does not touch the parent.                                        #
+    ############################################################################
+    def reset(self):
+        with self.lock:
+            self.stages = dict()
+            self.caches = dict()
+            self.counters = Counter()
+
+processMetrics = Metrics() # Everything recorded in this process, whichever recipe it was for
+
+################################################################################
+# Name: currentCollector                                                       #
+# Params: None                                                                 #
+# Returns: Metrics, or None                                                    #
+# Notes: The collector the current thread reports to.                          #
+################################################################################
+def currentCollector():
+    return getattr(localState, "collector", None)
+
+class collecting:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: collector (a Metrics, or None to record nothing)                 #
+    # Returns: None                                                            #
+    # Notes: A context manager; inside the with block, this thread reports to  #
+    # collector. Blocks can be nested.                                         #
+    ############################################################################
+    def __init__(self, collector):
+        self.collector = collector
+        self.previous = None
+
+    ############################################################################
+    # Name: __enter__                                                          #
+    # Params: None                                                             #
+    # Returns: The collector                                                   #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def __enter__(self):
+        self.previous = currentCollector()
+        localState.collector = self.collector
+        return self.collector
+
+    ############################################################################
+    # Name: __exit__                                                           #
+    # Params: exception details (ignored)                                      #
+    # Returns: False, so exceptions carry on                                   #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def __exit__(self, *exception):
+        localState.collector = self.previous
+        return False
+
+################################################################################
+# Name: instrumented                                                           #
+# Params: stage (name to record calls under)                                   #
+# Returns: A decorator                                                         #
+# Notes: Times every call of the decorated function into the current           #
+# collector, if there is one.                                                  #
+################################################################################
+def instrumented(stage):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            collector = currentCollector()
+            if collector is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                collector.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+################################################################################
+# Name: recordCacheLookup                                                      #
+# Params: cache (name), hit (Boolean)                                          #
+# Returns: None                                                                #
+# Notes: For code that is not a Metrics owner itself, like the caches.         #
+################################################################################
+def recordCacheLookup(cache, hit):
+    collector = currentCollector()
+    if collector is not None:
+        collector.cacheLookup(cache, hit)
+
+################################################################################
+# Name: recordCount                                                            #
+# Params: counter (name), amount                                               #
+# Returns: None                                                                #
+# Notes: Same idea as recordCacheLookup.                                       #
+################################################################################
+def recordCount(counter, amount = 1):
+    collector = currentCollector()
+    if collector is not None:
+        collector.increment(counter, amount)
+
+################################################################################
+# Name: percentile                                                             #
+# Params: values (sorted list of numbers), fraction (like 0.99)                #
+# Returns: Number, or None for an empty list                                   #
+# Notes: Nearest-rank, so the answer is always one of the values.              #
+################################################################################
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+################################################################################
+# Name: _prometheusLabel                                                       #
+# Params: value                                                                #
+# Returns: String                                                              #
+# Notes: Escapes a label value the way the text exposition format wants.       #
+################################################################################
+def _prometheusLabel(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+################################################################################
+# Name: toPrometheus                                                           #
+# Params: snapshot (from Metrics.snapshot), prefix (put in front of every      #
+# metric name)                                                                 #
+# Returns: String in the Prometheus text exposition format                     #
+# Notes: Stages become labelled counters of calls and seconds, caches a        #
+# counter labelled by result, and every other counter keeps its own name.      #
+################################################################################
+def toPrometheus(snapshot, prefix = "recipe_transformer_"):
+    lines = []
+    lines.append("# TYPE " + prefix + "stage_calls_total counter")
+    for stage, stats in sorted(snapshot["stages"].items()):
+        lines.append(prefix + "stage_calls_total{stage=\"" + _prometheusLabel(stage) + "\"} " + str(stats["calls"]))
+    lines.append("# TYPE " + prefix + "stage_seconds_total counter")
+    for stage, stats in sorted(snapshot["stages"].items()):
+        lines.append(prefix + "stage_seconds_total{stage=\"" + _prometheusLabel(stage) + "\"} " + repr(stats["seconds"]))
+    lines.append("# TYPE " + prefix + "cache_lookups_total counter")
+    for cache, stats in sorted(snapshot["caches"].items()):
+        lines.append(prefix + "cache_lookups_total{cache=\"" + _prometheusLabel(cache) + "\",result=\"hit\"} " + str(stats["hits"]))
+        lines.append(prefix + "cache_lookups_total{cache=\"" + _prometheusLabel(cache) + "\",result=\"miss\"} " + str(stats["misses"]))
+    for counter, value in sorted(snapshot["counters"].items()):
+        name = prefix + "".join("_" + letter.lower() if letter.isupper() else letter for letter in counter) + "_total" # networkBytes -> network_bytes_total
+        lines.append("# TYPE " + name + " counter")
+        lines.append(name + " " + str(value))
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: interval (seconds between samples)                               #
+    # Returns: None                                                            #
+    # Notes: Samples every thread but its own from a background thread, so the #
+    # code being profiled runs unmodified. Nothing is sampled until start.     #
+    ############################################################################
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.stacks = Counter() # Folded stack -> samples
+        self.stopping = threading.Event()
+        self.thread = None
+
+    ############################################################################
+    # Name: _frameName                                                         #
+    # Params: frame                                                            #
+    # Returns: String like "recipeTransformer.py:_ingParse"                    #
+    # Notes: Semicolons would break the folded format, so they never appear.   #
+    ############################################################################
+    def _frameName(self, frame):
+        return (os.path.basename(frame.f_code.co_filename) + ":" + frame.f_code.co_name).replace(";", ":")
+
+    ############################################################################
+    # Name: _sample                                                            #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: The profiler thread's loop. Each stack is rooted at its thread's  #
+    # name, so the prefetch threads show up apart from the main one.           #
+    ############################################################################
+    def _sample(self):
+        ownId = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for threadId, frame in sys._current_frames().items():
+                if threadId == ownId:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(self._frameName(frame))
+                    frame = frame.f_back
+                frames.append(names.get(threadId, "thread-" + str(threadId)).replace(";", ":"))
+                self.stacks[";".join(reversed(frames))] += 1
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: None                                                             #
+    # Returns: The profiler, so it can be used as "with                        #
+    # SamplingProfiler().start() as profiler"                                  #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target = self._sample, name = "samplingProfiler", daemon = True)
+        self.thread.start()
+        return self
+
+    ############################################################################
+    # Name: stop                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    ############################################################################
+    # Name: __enter__ and __exit__                                             #
+    # Params: As for any context manager                                       #
+    # Returns: The profiler, and False so exceptions carry on                  #
+    # Notes: Stops sampling when the with block ends.                          #
+    ############################################################################
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.stop()
+        return False
+
+    ############################################################################
+    # Name: write                                                              #
+    # Params: path                                                             #
+    # Returns: Integer (number of samples written)                             #
+    # Notes: One "stack count" line per distinct stack, the folded format      #
+    # flame graph tools expect.                                                #
+    ############################################################################
+    def write(self, path):
+        with open(path, "w", encoding = "utf-8") as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write(stack + " " + str(count) + "\n")
+        return sum(self.stacks.values())
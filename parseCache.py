@@ -0,0 +1,119 @@
+# Keeps what Transformer._ingParse and _instParse work out for a recipe (the
+# ingredient and instruction predicates plus the spices found along the way) in
+# an SQLite file, so parsing a recipe we have seen before costs one lookup
+# instead of a spaCy run and a round of ConceptNet calls. Entries are keyed by a
+# hash of the recipe text together with everything that can change the parse
+# (see parseKey), so a new parser, knowledge base or classifier simply misses.
+
+from conceptNet import DEFAULT_TTL
+import threading
+import hashlib
+import sqlite3
+import json
+import zlib
+import time
+import os
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recipeTransformer", "parses.sqlite")
+DEFAULT_MAX_ENTRIES = 200000
+
+################################################################################
+# Name: parseKey                                                               #
+# Params: recipeData (a scraped recipe), versions (list of strings naming the  #
+# parser, knowledge base and classifier in use)                                #
+# Returns: String (hex SHA-256)                                                #
+# Notes: Only the ingredients and instructions go into the hash, since they    #
+# are all the parser reads; the same recipe under another URL or name still    #
+# hits.                                                                        #
+################################################################################
+def parseKey(recipeData, versions):
+    content = json.dumps([recipeData["ingredients"], recipeData["instructions"], versions], ensure_ascii = False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class ParseCache:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (SQLite file), ttl (seconds an entry stays valid),          #
+    # maxEntries (row count above which the oldest entries are evicted)        #
+    # Returns: None                                                            #
+    # Notes: Opened lazily and re-opened after a fork, like                    #
+    # conceptNet.DiskCache. The TTL defaults to the ConceptNet cache's, since  #
+    # a parse is only as fresh as the ConceptNet answers behind it.            #
+    ############################################################################
+    def __init__(self, path = DEFAULT_CACHE_PATH, ttl = DEFAULT_TTL, maxEntries = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connectionPid = None
+        self.writesSinceEviction = 0
+
+    ############################################################################
+    # Name: _connect                                                           #
+    # Params: None                                                             #
+    # Returns: sqlite3.Connection                                              #
+    # Notes: Makes sure the table exists.                                      #
+    ############################################################################
+    def _connect(self):
+        if self.connection is None or self.connectionPid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            self.connection = sqlite3.connect(self.path, timeout = 30, check_same_thread = False)
+            self.connection.execute("PRAGMA journal_mode=WAL") # Lets several processes read while one writes
+            self.connection.execute("CREATE TABLE IF NOT EXISTS parses (key TEXT PRIMARY KEY, body BLOB, stored REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS parsesByAge ON parses (stored)")
+            self.connection.commit()
+            self.connectionPid = os.getpid()
+        return self.connection
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: key (from parseKey)                                              #
+    # Returns: Dict with ingPredicates, instPredicates (lists of               #
+    # recipeModel records in their toList form) and spices, or None if missing #
+    # or expired                                                               #
+    # Notes: None of the lists and dicts handed back are shared with anyone    #
+    # else, so callers can keep them.                                          #
+    ############################################################################
+    def get(self, key):
+        with self.lock:
+            row = self._connect().execute("SELECT body, stored FROM parses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: key (from parseKey), ingPredicates, instPredicates (lists of     #
+    # records in their toList form), spices (set of words)                     #
+    # Returns: None                                                            #
+    # Notes: Stored as zlib-compressed JSON. Every so often this also runs the #
+    # TTL and size based eviction.                                             #
+    ############################################################################
+    def put(self, key, ingPredicates, instPredicates, spices):
+        body = json.dumps({"ingPredicates": ingPredicates, "instPredicates": instPredicates, "spices": sorted(spices)},
+        ensure_ascii = False, separators = (",", ":"))
+        with self.lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO parses VALUES (?, ?, ?)", (key, zlib.compress(body.encode("utf-8")), time.time()))
+            self.writesSinceEviction += 1
+            if self.writesSinceEviction >= 1000: # Counting rows on every write would be wasteful
+                self._evict(connection)
+            connection.commit()
+
+    ############################################################################
+    # Name: _evict                                                             #
+    # Params: connection (open cache database)                                 #
+    # Returns: None                                                            #
+    # Notes: First drop anything past its TTL, then the oldest rows until we   #
+    # are back under maxEntries.                                               #
+    ############################################################################
+    def _evict(self, connection):
+        self.writesSinceEviction = 0
+        connection.execute("DELETE FROM parses WHERE stored < ?", (time.time() - self.ttl,))
+        count = connection.execute("SELECT COUNT(*) FROM parses").fetchone()[0]
+        if count > self.maxEntries:
+            connection.execute("DELETE FROM parses WHERE key IN (SELECT key FROM parses ORDER BY stored LIMIT ?)",
+            (count - self.maxEntries,))
@@ -0,0 +1,447 @@
+# Reads the amount and unit at the start of an ingredient ("1 1/2 cups", "½ tsp",
+# "2-3 lbs", "1 (15 ounce) can") and rescales or converts them for whole corpora
+# at once. Parsing is plain Python, done once per ingredient; after that every
+# ingredient of every recipe sits in NumPy columns (value, unit, and where both
+# are in the text), so scaling to a number of servings and converting between
+# metric and US measures are a handful of array operations however many recipes
+# there are. Only the ingredients whose amount actually changed are re-rendered,
+# by splicing the new amount and unit in at their offsets.
+#
+# Volume converts to volume and mass to mass; going from cups to grams would need
+# the density of every food, so that is left alone, as are counted units like
+# cloves and cans (they scale, but have nothing to convert to).
+#
+# NumPy is only imported once a bulk path needs it (see _loadNumPy), since the
+# transformer imports this module just for findQuantity.
+
+from recipeModel import spliceText
+import argparse
+import json
+import sys
+import re
+
+UNICODE_FRACTIONS = {"½": 1 / 2, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 1 / 4, "¾": 3 / 4, "⅕": 1 / 5, "⅖": 2 / 5, "⅗": 3 / 5, "⅘": 4 / 5,
+"⅙": 1 / 6, "⅚": 5 / 6, "⅛": 1 / 8, "⅜": 3 / 8, "⅝": 5 / 8, "⅞": 7 / 8}
+
+# One number: a (mixed) fraction like "1/2", "1 1/2" or "1-1/2", a unicode fraction like "½" or "1½", or a whole or decimal number
+NUMBER_PATTERN = re.compile(r"(?:(?P<whole>\d+)(?:\s+|-))?(?P<numerator>\d+)\s*[/⁄]\s*(?P<denominator>\d+)"
+r"|(?P<unicodeWhole>\d+)?\s*(?P<unicode>[" + "".join(UNICODE_FRACTIONS) + "])"
+r"|(?P<decimal>\d*\.\d+|\d+)")
+RANGE_PATTERN = re.compile(r"\s*(?:-|–|to|or)\s*") # Between the two ends of "2-3" or "2 to 3"
+UNIT_PATTERN = re.compile(r"\s*(?:\([^)]*\)\s*)?([^\W\d_]+\.?)(?:\s+([^\W\d_]+\.?))?") # "cups", "fl oz", "tbsp." or "(15 ounce) can"; an abbreviation's period is part of it
+
+# Dimension codes for the unit columns
+COUNT = 0 # Cloves, cans, pinches: scaled, never converted
+VOLUME = 1 # Measured in millilitres
+MASS = 2 # Measured in grams
+
+# Canonical unit -> (dimension, size in millilitres or grams, singular and plural as we write them, other spellings)
+UNITS = {
+    "teaspoon": (VOLUME, 4.92892, "teaspoon", "teaspoons", ["tsp", "tsps", "teaspoonful", "teaspoonfuls"]),
+    "tablespoon": (VOLUME, 14.7868, "tablespoon", "tablespoons", ["tbsp", "tbsps", "tbs", "tbl", "tblsp", "tablespoonful", "tablespoonfuls"]),
+    "fluid ounce": (VOLUME, 29.5735, "fluid ounce", "fluid ounces", ["fl oz", "fl ounce", "fl ounces", "fluid oz"]),
+    "cup": (VOLUME, 236.588, "cup", "cups", ["c"]),
+    "pint": (VOLUME, 473.176, "pint", "pints", ["pt", "pts"]),
+    "quart": (VOLUME, 946.353, "quart", "quarts", ["qt", "qts"]),
+    "gallon": (VOLUME, 3785.41, "gallon", "gallons", ["gal", "gals"]),
+    "milliliter": (VOLUME, 1.0, "ml", "ml", ["milliliters", "millilitre", "millilitres", "mls"]),
+    "liter": (VOLUME, 1000.0, "l", "l", ["liters", "litre", "litres"]),
+    "ounce": (MASS, 28.3495, "ounce", "ounces", ["oz", "ozs"]),
+    "pound": (MASS, 453.592, "pound", "pounds", ["lb", "lbs"]),
+    "gram": (MASS, 1.0, "g", "g", ["grams", "gramme", "grammes", "gr"]),
+    "kilogram": (MASS, 1000.0, "kg", "kg", ["kilograms", "kilo", "kilos", "kgs"]),
+    "pinch": (COUNT, 1.0, "pinch", "pinches", []),
+    "dash": (COUNT, 1.0, "dash", "dashes", []),
+    "clove": (COUNT, 1.0, "clove", "cloves", []),
+    "can": (COUNT, 1.0, "can", "cans", []),
+    "jar": (COUNT, 1.0, "jar", "jars", []),
+    "package": (COUNT, 1.0, "package", "packages", ["pkg", "pkgs", "packet", "packets"]),
+    "slice": (COUNT, 1.0, "slice", "slices", []),
+    "stick": (COUNT, 1.0, "stick", "sticks", []),
+    "sprig": (COUNT, 1.0, "sprig", "sprigs", []),
+    "bunch": (COUNT, 1.0, "bunch", "bunches", []),
+    "head": (COUNT, 1.0, "head", "heads", []),
+    "stalk": (COUNT, 1.0, "stalk", "stalks", []),
+    "piece": (COUNT, 1.0, "piece", "pieces", [])
+}
+
+UNIT_NAMES = list(UNITS) # Unit code -> canonical unit; the unit columns hold indices into this
+UNIT_CODES = dict((UNIT_NAMES[code], code) for code in range(len(UNIT_NAMES)))
+UNIT_SPELLINGS = dict() # Every lowercase spelling -> canonical unit
+for unit in UNIT_NAMES:
+    for spelling in [unit, UNITS[unit][2], UNITS[unit][3]] + UNITS[unit][4]:
+        UNIT_SPELLINGS[spelling.lower()] = unit
+
+# Which unit a converted amount is written in: (dimension, largest amount in millilitres or grams it is used below, unit)
+CONVERSIONS = {
+    "metric": [(VOLUME, 1000.0, "milliliter"), (VOLUME, float("inf"), "liter"), (MASS, 1000.0, "gram"), (MASS, float("inf"), "kilogram")],
+    "imperial": [(VOLUME, UNITS["tablespoon"][1] - 0.01, "teaspoon"), (VOLUME, UNITS["cup"][1] / 4 - 0.01, "tablespoon"),
+    (VOLUME, float("inf"), "cup"), (MASS, UNITS["pound"][1] - 0.01, "ounce"), (MASS, float("inf"), "pound")]
+}
+METRIC_NAMES = ("milliliter", "liter", "gram", "kilogram") # Written as decimals rather than fractions
+
+FRACTION_TEXTS = ["", "1/8", "1/4", "1/3", "3/8", "1/2", "5/8", "2/3", "3/4", "7/8", ""] # What amounts written as fractions get rounded to
+
+np = None # NumPy, once _loadNumPy has imported it
+UNIT_DIMENSIONS = UNIT_SIZES = METRIC_UNITS = FRACTIONS = None # Arrays over unit codes (and FRACTION_TEXTS), built by _loadNumPy
+
+################################################################################
+# Name: _loadNumPy                                                             #
+# Params: None                                                                 #
+# Returns: None                                                                #
+# Notes: Imports NumPy and builds the unit arrays the first time it is called. #
+# Everything that works on columns calls this first; findQuantity and          #
+# parseQuantity never do.                                                      #
+################################################################################
+def _loadNumPy():
+    global np, UNIT_DIMENSIONS, UNIT_SIZES, METRIC_UNITS, FRACTIONS
+    if np is None:
+        import numpy
+        UNIT_DIMENSIONS = numpy.array([UNITS[unit][0] for unit in UNIT_NAMES], dtype = numpy.int8)
+        UNIT_SIZES = numpy.array([UNITS[unit][1] for unit in UNIT_NAMES])
+        METRIC_UNITS = numpy.array([unit in METRIC_NAMES for unit in UNIT_NAMES])
+        FRACTIONS = numpy.array([0, 1 / 8, 1 / 4, 1 / 3, 3 / 8, 1 / 2, 5 / 8, 2 / 3, 3 / 4, 7 / 8, 1])
+        np = numpy # Last, so another thread never sees np without the arrays
+
+################################################################################
+# Name: _readNumber                                                            #
+# Params: text, position                                                       #
+# Returns: Tuple of (value, end offset), or None if no number starts at        #
+# position                                                                     #
+# Notes: None needed.                                                          #
+################################################################################
+def _readNumber(text, position):
+    match = NUMBER_PATTERN.match(text, position)
+    if match is None:
+        return None
+    if match.group("numerator") is not None:
+        if int(match.group("denominator")) == 0:
+            return None
+        value = int(match.group("whole") or 0) + int(match.group("numerator")) / int(match.group("denominator"))
+    elif match.group("unicode") is not None:
+        value = int(match.group("unicodeWhole") or 0) + UNICODE_FRACTIONS[match.group("unicode")]
+    else:
+        value = float(match.group("decimal"))
+    return value, match.end()
+
+################################################################################
+# Name: findQuantity                                                           #
+# Params: text (an ingredient, like "1 1/2 cups flour")                        #
+# Returns: Tuple of (value, high end of a range or None, quantity start,       #
+# quantity end, canonical unit or None, unit start, unit end), or None when    #
+# the ingredient does not start with an amount                                 #
+# Notes: A range like "2-3" is one quantity span with both ends. Missing unit  #
+# offsets are -1, as in recipeModel.IngredientRecord.                          #
+################################################################################
+def findQuantity(text):
+    start = len(text) - len(text.lstrip())
+    number = _readNumber(text, start)
+    if number is None:
+        return None
+    value, end = number
+    high = None
+    separator = RANGE_PATTERN.match(text, end)
+    if separator is not None:
+        other = _readNumber(text, separator.end())
+        if other is not None:
+            high, end = other
+
+    unit, unitStart, unitEnd = None, -1, -1
+    match = UNIT_PATTERN.match(text, end)
+    if match is not None:
+        twoWordUnit = canonicalUnit(match.group(1) + " " + match.group(2)) if match.group(2) is not None else None
+        if twoWordUnit is not None: # Two-word units like "fl oz" first
+            unit, unitStart, unitEnd = twoWordUnit, match.start(1), match.end(2)
+        elif canonicalUnit(match.group(1)) is not None:
+            unit, unitStart, unitEnd = canonicalUnit(match.group(1)), match.start(1), match.end(1)
+    return value, high, start, end, unit, unitStart, unitEnd
+
+################################################################################
+# Name: parseQuantity                                                          #
+# Params: text (just the amount, like "1 1/2", "½" or "2-3")                   #
+# Returns: Float (the low end of a range), or None if text is not an amount    #
+# Notes: None needed.                                                          #
+################################################################################
+def parseQuantity(text):
+    found = findQuantity(text)
+    return found[0] if found is not None and found[3] == len(text.rstrip()) else None
+
+################################################################################
+# Name: canonicalUnit                                                          #
+# Params: text (a unit as written, like "Tbsp." or "cups")                     #
+# Returns: String (a key of UNITS), or None if it is not a unit we know        #
+# Notes: Abbreviation periods are ignored, so "fl. oz." is "fluid ounce".      #
+################################################################################
+def canonicalUnit(text):
+    return UNIT_SPELLINGS.get(" ".join(word.rstrip(".") for word in text.lower().split()))
+
+################################################################################
+# Name: formatQuantities                                                       #
+# Params: values (array of amounts), metric (Boolean array; True writes that   #
+# amount as a decimal rather than a fraction)                                  #
+# Returns: List of strings                                                     #
+# Notes: Fractions are rounded to the nearest eighth or third ("1 1/2"), and   #
+# decimals to a sensible precision. The rounding is done on the whole array;   #
+# only the final strings are built one by one.                                 #
+################################################################################
+def formatQuantities(values, metric):
+    _loadNumPy()
+    whole = np.floor(values)
+    nearest = np.abs((values - whole)[:, None] - FRACTIONS[None, :]).argmin(axis = 1)
+    whole = whole + (nearest == len(FRACTIONS) - 1) # Rounded up to the next whole number
+    nearest = np.where((whole == 0) & ((nearest == 0) | (nearest == len(FRACTIONS) - 1)) & (values > 0), 1, nearest) # Never round a real amount away to nothing
+    decimals = np.where(values >= 100, np.round(values / 5) * 5, np.where(values >= 10, np.round(values), np.round(values, 1)))
+
+    texts = []
+    for i in range(len(values)):
+        if metric[i]:
+            texts.append(("%.1f" % decimals[i]).rstrip("0").rstrip("."))
+        elif whole[i] and FRACTION_TEXTS[nearest[i]]:
+            texts.append(str(int(whole[i])) + " " + FRACTION_TEXTS[nearest[i]])
+        elif whole[i]:
+            texts.append(str(int(whole[i])))
+        else:
+            texts.append(FRACTION_TEXTS[nearest[i]])
+    return texts
+
+class QuantityColumns:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: texts (list of ingredients), recipes (recipe index of each),     #
+    # values, highs (NaN where missing), units (unit codes, -1 where missing), #
+    # quantityStarts, quantityEnds, unitStarts, unitEnds (offsets, -1 where    #
+    # missing)                                                                 #
+    # Returns: None                                                            #
+    # Notes: Usually built with fromRecipes or fromRecords. The amounts as     #
+    # parsed are kept alongside, so rendering can tell which ones changed.     #
+    ############################################################################
+    def __init__(self, texts, recipes, values, highs, units, quantityStarts, quantityEnds, unitStarts, unitEnds):
+        _loadNumPy()
+        self.texts = texts
+        self.recipes = np.asarray(recipes, dtype = np.int32)
+        self.values = np.asarray(values, dtype = np.float64)
+        self.highs = np.asarray(highs, dtype = np.float64)
+        self.units = np.asarray(units, dtype = np.int16)
+        self.quantityStarts = np.asarray(quantityStarts, dtype = np.int32)
+        self.quantityEnds = np.asarray(quantityEnds, dtype = np.int32)
+        self.unitStarts = np.asarray(unitStarts, dtype = np.int32)
+        self.unitEnds = np.asarray(unitEnds, dtype = np.int32)
+        self.originalValues = self.values
+        self.originalHighs = self.highs
+        self.originalUnits = self.units
+        # Whether each unit was written out in full ("cups" rather than "c."), so it can be rewritten to match a new amount
+        self.spelledOut = np.array([self.units[i] >= 0 and texts[i][self.unitStarts[i]:self.unitEnds[i]].lower().rstrip(".") in
+        UNITS[UNIT_NAMES[self.units[i]]][2:4] for i in range(len(texts))], dtype = bool)
+
+    ############################################################################
+    # Name: fromRecipes                                                        #
+    # Params: ingredientLists (iterable of lists of ingredient strings, one    #
+    # list per recipe)                                                         #
+    # Returns: QuantityColumns                                                 #
+    # Notes: Finds the amounts with findQuantity, so no parse is needed.       #
+    ############################################################################
+    @classmethod
+    def fromRecipes(cls, ingredientLists):
+        _loadNumPy()
+        columns = ([], [], [], [], [], [], [], [], [])
+        recipe = 0
+        for ingredients in ingredientLists:
+            for text in ingredients:
+                found = findQuantity(text)
+                if found is None:
+                    found = (np.nan, None, -1, -1, None, -1, -1)
+                value, high, quantityStart, quantityEnd, unit, unitStart, unitEnd = found
+                row = (text, recipe, value, np.nan if high is None else high, -1 if unit is None else UNIT_CODES[unit], quantityStart, quantityEnd,
+                unitStart, unitEnd)
+                for column, item in zip(columns, row):
+                    column.append(item)
+            recipe += 1
+        return cls(*columns)
+
+    ############################################################################
+    # Name: fromRecords                                                        #
+    # Params: recordLists (iterable of lists of recipeModel.IngredientRecord,  #
+    # one list per recipe, e.g. Transformer.ingPredicates)                     #
+    # Returns: QuantityColumns                                                 #
+    # Notes: Uses the quantity and unit the parser found.                      #
+    ############################################################################
+    @classmethod
+    def fromRecords(cls, recordLists):
+        _loadNumPy()
+        columns = ([], [], [], [], [], [], [], [], [])
+        recipe = 0
+        for records in recordLists:
+            for record in records:
+                found = findQuantity(record.quantity) if record.quantity is not None else None
+                unit = canonicalUnit(record.unit) if record.unit is not None else None
+                row = (record.text, recipe, np.nan if found is None else found[0], np.nan if found is None or found[1] is None else found[1],
+                -1 if unit is None else UNIT_CODES[unit], record.quantityStart, record.quantityEnd, record.unitStart if unit is not None else -1,
+                record.unitEnd if unit is not None else -1)
+                for column, item in zip(columns, row):
+                    column.append(item)
+            recipe += 1
+        return cls(*columns)
+
+    ############################################################################
+    # Name: _derived                                                           #
+    # Params: values, highs, units (new columns)                               #
+    # Returns: QuantityColumns                                                 #
+    # Notes: Shares everything else (including the original amounts) with this #
+    # one.                                                                     #
+    ############################################################################
+    def _derived(self, values, highs, units):
+        derived = QuantityColumns.__new__(QuantityColumns)
+        derived.__dict__.update(self.__dict__)
+        derived.values, derived.highs, derived.units = values, highs, units
+        return derived
+
+    ############################################################################
+    # Name: scaled                                                             #
+    # Params: factors (one number for every recipe, or an array with one per   #
+    # recipe)                                                                  #
+    # Returns: QuantityColumns                                                 #
+    # Notes: Ingredients without an amount stay as they are.                   #
+    ############################################################################
+    def scaled(self, factors):
+        factors = np.asarray(factors, dtype = np.float64)
+        rowFactors = factors[self.recipes] if factors.ndim else factors
+        return self._derived(self.values * rowFactors, self.highs * rowFactors, self.units)
+
+    ############################################################################
+    # Name: converted                                                          #
+    # Params: system ("metric", or "imperial" for US cups, spoons, ounces and  #
+    # pounds)                                                                  #
+    # Returns: QuantityColumns                                                 #
+    # Notes: Each volume or mass goes to whichever unit of the system reads    #
+    # best for its size (teaspoons up to a tablespoon, grams up to a kilogram, #
+    # and so on). Counted units and ingredients without a unit are left alone. #
+    ############################################################################
+    def converted(self, system):
+        known = self.units >= 0
+        codes = np.where(known, self.units, 0)
+        dimensions = np.where(known, UNIT_DIMENSIONS[codes], COUNT)
+        base = self.values * UNIT_SIZES[codes] # In millilitres or grams
+        conditions = []
+        targets = []
+        for dimension, below, unit in CONVERSIONS[system]: # The first match wins, so each dimension's units go smallest first
+            conditions.append((dimensions == dimension) & (base < below))
+            targets.append(UNIT_CODES[unit])
+        units = np.select(conditions, targets, self.units).astype(np.int16)
+        sizes = UNIT_SIZES[np.where(units >= 0, units, 0)]
+        ratio = np.where(dimensions != COUNT, UNIT_SIZES[codes] / sizes, 1.0)
+        return self._derived(self.values * ratio, self.highs * ratio, units)
+
+    ############################################################################
+    # Name: changedRows                                                        #
+    # Params: None                                                             #
+    # Returns: Array of the rows whose amount or unit differs from the text    #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def changedRows(self):
+        changed = ~np.isnan(self.values) & (~np.isclose(self.values, self.originalValues) | (self.units != self.originalUnits) |
+        (~np.isnan(self.highs) & ~np.isclose(self.highs, self.originalHighs)))
+        return np.flatnonzero(changed)
+
+    ############################################################################
+    # Name: rendered                                                           #
+    # Params: None                                                             #
+    # Returns: List of ingredient strings, one per row                         #
+    # Notes: Unchanged ingredients come back exactly as written. A changed one #
+    # gets its new amount (and, if the unit changed or was written out in      #
+    # full, its unit) spliced in.                                              #
+    ############################################################################
+    def rendered(self):
+        texts = list(self.texts)
+        rows = self.changedRows()
+        if not len(rows):
+            return texts
+        codes = np.where(self.units[rows] >= 0, self.units[rows], 0)
+        metric = METRIC_UNITS[codes] & (self.units[rows] >= 0)
+        values = formatQuantities(self.values[rows], metric)
+        hasHigh = ~np.isnan(self.highs[rows])
+        highs = formatQuantities(np.where(hasHigh, self.highs[rows], 0), metric)
+        for i in range(len(rows)):
+            row = rows[i]
+            quantity = values[i] + ("-" + highs[i] if hasHigh[i] else "")
+            unit = None
+            if self.units[row] >= 0 and (self.units[row] != self.originalUnits[row] or self.spelledOut[row]):
+                plural = hasHigh[i] or _readNumber(values[i], 0)[0] > 1 # The amount as written, so 0.98 cups rounded to "1" is "1 cup"
+                unit = UNITS[UNIT_NAMES[self.units[row]]][3 if plural else 2]
+                if self.units[row] == self.originalUnits[row] and self.texts[row][self.unitEnds[row] - 1] == ".":
+                    unit += "." # Only the number changed, so "g." or "cups." keeps its period; a converted unit is written without one
+            texts[row] = spliceText(self.texts[row], [(int(self.quantityStarts[row]), int(self.quantityEnds[row]), quantity),
+            (int(self.unitStarts[row]), int(self.unitEnds[row]), unit)])
+        return texts
+
+    ############################################################################
+    # Name: renderedByRecipe                                                   #
+    # Params: None                                                             #
+    # Returns: List with one list of ingredient strings per recipe             #
+    # Notes: Recipes without any ingredients get an empty list.                #
+    ############################################################################
+    def renderedByRecipe(self):
+        texts = self.rendered()
+        recipeCount = int(self.recipes.max()) + 1 if len(self.recipes) else 0
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(self.recipes, minlength = recipeCount))])
+        return [texts[bounds[recipe]:bounds[recipe + 1]] for recipe in range(recipeCount)]
+
+################################################################################
+# Name: scaleRecipes                                                           #
+# Params: recipes (list of scraped recipe dicts), factor (multiply every       #
+# amount by this), servings (scale each recipe to serve this many instead;     #
+# recipes without a "servings" count fall back to factor), system ("metric",   #
+# "imperial", or None to keep the units)                                       #
+# Returns: List of recipe dicts with their ingredients rewritten (and          #
+# "servings" updated)                                                          #
+# Notes: The whole list is scaled and converted in one go; see                 #
+# QuantityColumns.                                                             #
+################################################################################
+def scaleRecipes(recipes, factor = 1.0, servings = None, system = None):
+    columns = QuantityColumns.fromRecipes([recipe.get("ingredients", []) for recipe in recipes])
+    if servings is not None:
+        counts = np.array([recipe.get("servings") or np.nan for recipe in recipes], dtype = np.float64)
+        factors = np.where(np.isnan(counts), factor, servings / np.where(np.isnan(counts), 1, counts))
+    else:
+        factors = np.full(len(recipes), factor)
+    columns = columns.scaled(factors)
+    if system is not None:
+        columns = columns.converted(system)
+
+    scaled = []
+    ingredientLists = columns.renderedByRecipe()
+    for i in range(len(recipes)):
+        recipe = dict(recipes[i])
+        recipe["ingredients"] = ingredientLists[i] if i < len(ingredientLists) else []
+        if recipe.get("servings") and factors[i] != 1:
+            servingCount = recipe["servings"] * float(factors[i])
+            recipe["servings"] = int(servingCount) if servingCount.is_integer() else round(servingCount, 2)
+        scaled.append(recipe)
+    return scaled
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Rescale and/or convert the ingredient amounts of scraped recipes.")
+    parser.add_argument("inputs", nargs = "*", default = ["-"], help = "JSON Lines files of scraped recipes (like bulkScraper.py writes), or \"-\" for stdin")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "multiply every amount by this")
+    parser.add_argument("--servings", type = float, help = "scale each recipe to serve this many (recipes that do not say how many they serve use --scale)")
+    parser.add_argument("--system", choices = list(CONVERSIONS), help = "convert amounts to this system of measures")
+    parser.add_argument("--chunk-size", type = int, default = 10000, help = "recipes scaled together at a time")
+    parser.add_argument("--output", help = "JSON Lines output file (defaults to stdout)")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding = "utf-8") if args.output else sys.stdout
+    chunk = []
+    for name in args.inputs:
+        inputFile = sys.stdin if name == "-" else open(name, encoding = "utf-8")
+        for line in inputFile:
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) == args.chunk_size:
+                for recipe in scaleRecipes(chunk, args.scale, args.servings, args.system):
+                    output.write(json.dumps(recipe) + "\n")
+                chunk = []
+        if inputFile is not sys.stdin:
+            inputFile.close()
+    for recipe in scaleRecipes(chunk, args.scale, args.servings, args.system):
+        output.write(json.dumps(recipe) + "\n")
+    if output is not sys.stdout:
+        output.close()
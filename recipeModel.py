@@ -0,0 +1,281 @@
+# The parsed form of a recipe. Each ingredient and instruction becomes a small
+# slotted record holding its original text plus character offsets for the parts
+# the transformations care about (the ingredient name, quantity and unit, or the
+# cooking method and tool). A transformed sentence is rendered by splicing the
+# replacements in at those offsets, so nothing else in the sentence is touched,
+# not even another word that happens to contain the same letters. Offsets of -1
+# mean the part was not found.
+#
+# For large corpora, IngredientColumns and InstructionColumns keep the same data
+# column by column in arrays, which is a fraction of the size of the records.
+
+from array import array
+
+class IngredientRecord:
+    __slots__ = ("text", "name", "nameStart", "nameEnd", "quantityStart", "quantityEnd", "unitStart", "unitEnd")
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: text (the ingredient as written), name (what the ingredient is,  #
+    # like "ground beef"), nameStart and nameEnd (where the name sits in       #
+    # text), quantityStart, quantityEnd, unitStart, unitEnd (-1 when missing)  #
+    # Returns: None                                                            #
+    # Notes: The name is kept on its own because it is not always a plain      #
+    # slice of text (the parser can tie together words that are not next to    #
+    # each other).                                                             #
+    ############################################################################
+    def __init__(self, text, name, nameStart, nameEnd, quantityStart = -1, quantityEnd = -1, unitStart = -1, unitEnd = -1):
+        self.text = text
+        self.name = name
+        self.nameStart = nameStart
+        self.nameEnd = nameEnd
+        self.quantityStart = quantityStart
+        self.quantityEnd = quantityEnd
+        self.unitStart = unitStart
+        self.unitEnd = unitEnd
+
+    ############################################################################
+    # Name: quantity                                                           #
+    # Params: None                                                             #
+    # Returns: String, or None                                                 #
+    # Notes: Read straight out of the text, so it costs no memory of its own.  #
+    ############################################################################
+    @property
+    def quantity(self):
+        return self.text[self.quantityStart:self.quantityEnd] if self.quantityStart >= 0 else None
+
+    ############################################################################
+    # Name: unit                                                               #
+    # Params: None                                                             #
+    # Returns: String, or None                                                 #
+    # Notes: The measurement, like "cups". Read straight out of the text.      #
+    ############################################################################
+    @property
+    def unit(self):
+        return self.text[self.unitStart:self.unitEnd] if self.unitStart >= 0 else None
+
+    ############################################################################
+    # Name: render                                                             #
+    # Params: name, quantity, unit (replacements; None keeps what the text     #
+    # says)                                                                    #
+    # Returns: String                                                          #
+    # Notes: Splices the replacements in by offset, leaving the rest of the    #
+    # text exactly as it was.                                                  #
+    ############################################################################
+    def render(self, name = None, quantity = None, unit = None):
+        return spliceText(self.text, [(self.nameStart, self.nameEnd, name), (self.quantityStart, self.quantityEnd, quantity),
+        (self.unitStart, self.unitEnd, unit)])
+
+    ############################################################################
+    # Name: toList                                                             #
+    # Params: None                                                             #
+    # Returns: List (the fields in __slots__ order)                            #
+    # Notes: A compact JSON-friendly form, used by the parse cache.            #
+    ############################################################################
+    def toList(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    ############################################################################
+    # Name: fromList                                                           #
+    # Params: fields (from toList)                                             #
+    # Returns: IngredientRecord                                                #
+    # Notes: None needed beyond toList's.                                      #
+    ############################################################################
+    @classmethod
+    def fromList(cls, fields):
+        return cls(*fields)
+
+    ############################################################################
+    # Name: __repr__                                                           #
+    # Params: None                                                             #
+    # Returns: String                                                          #
+    # Notes: For debugging.                                                    #
+    ############################################################################
+    def __repr__(self):
+        return "IngredientRecord(" + repr(self.name) + ", quantity = " + repr(self.quantity) + ", unit = " + repr(self.unit) + ")"
+
+class InstructionRecord:
+    __slots__ = ("text", "methodStart", "methodEnd", "toolStart", "toolEnd")
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: text (the instruction as written), methodStart and methodEnd     #
+    # (where the primary cooking method sits in text), toolStart and toolEnd   #
+    # (the tool it uses; -1 when missing)                                      #
+    # Returns: None                                                            #
+    # Notes: Like IngredientRecord, only offsets are stored.                   #
+    ############################################################################
+    def __init__(self, text, methodStart, methodEnd, toolStart = -1, toolEnd = -1):
+        self.text = text
+        self.methodStart = methodStart
+        self.methodEnd = methodEnd
+        self.toolStart = toolStart
+        self.toolEnd = toolEnd
+
+    ############################################################################
+    # Name: method                                                             #
+    # Params: None                                                             #
+    # Returns: String                                                          #
+    # Notes: The primary cooking method, like "Heat".                          #
+    ############################################################################
+    @property
+    def method(self):
+        return self.text[self.methodStart:self.methodEnd]
+
+    ############################################################################
+    # Name: tool                                                               #
+    # Params: None                                                             #
+    # Returns: String, or None                                                 #
+    # Notes: The cooking tool, like "skillet".                                 #
+    ############################################################################
+    @property
+    def tool(self):
+        return self.text[self.toolStart:self.toolEnd] if self.toolStart >= 0 else None
+
+    ############################################################################
+    # Name: render                                                             #
+    # Params: rewrite (function applied to every stretch of text outside the   #
+    # method and tool)                                                         #
+    # Returns: String                                                          #
+    # Notes: The method and tool are never handed to rewrite, so an ingredient #
+    # substitution can not clobber them.                                       #
+    ############################################################################
+    def render(self, rewrite):
+        protected = sorted(span for span in [(self.methodStart, self.methodEnd), (self.toolStart, self.toolEnd)] if span[0] >= 0)
+        pieces = []
+        position = 0
+        for start, end in protected:
+            if start < position: # The tool and method can be the same word
+                continue
+            pieces.append(rewrite(self.text[position:start]))
+            pieces.append(self.text[start:end])
+            position = end
+        pieces.append(rewrite(self.text[position:]))
+        return "".join(pieces)
+
+    ############################################################################
+    # Name: toList                                                             #
+    # Params: None                                                             #
+    # Returns: List (the fields in __slots__ order)                            #
+    # Notes: A compact JSON-friendly form, used by the parse cache.            #
+    ############################################################################
+    def toList(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    ############################################################################
+    # Name: fromList                                                           #
+    # Params: fields (from toList)                                             #
+    # Returns: InstructionRecord                                               #
+    # Notes: None needed beyond toList's.                                      #
+    ############################################################################
+    @classmethod
+    def fromList(cls, fields):
+        return cls(*fields)
+
+    ############################################################################
+    # Name: __repr__                                                           #
+    # Params: None                                                             #
+    # Returns: String                                                          #
+    # Notes: For debugging.                                                    #
+    ############################################################################
+    def __repr__(self):
+        return "InstructionRecord(" + repr(self.method) + ", tool = " + repr(self.tool) + ")"
+
+################################################################################
+# Name: spliceText                                                             #
+# Params: text, replacements (list of (start, end, new text) with new text     #
+# None to keep that stretch, and start -1 for nothing)                         #
+# Returns: String                                                              #
+# Notes: Replacements are applied in offset order in a single pass;            #
+# overlapping ones after the first are skipped.                                #
+################################################################################
+def spliceText(text, replacements):
+    pieces = []
+    position = 0
+    for start, end, newText in sorted(replacement for replacement in replacements if replacement[0] >= 0 and replacement[2] is not None):
+        if start < position:
+            continue
+        pieces.append(text[position:start])
+        pieces.append(newText)
+        position = end
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+class RecordColumns:
+    recordType = None # Set by the subclasses below
+    stringFields = ()
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Every field of recordType that is not a string gets an array of   #
+    # 32-bit integers, plus one more saying which recipe each record came      #
+    # from.                                                                    #
+    ############################################################################
+    def __init__(self):
+        self.recipes = array("i")
+        self.columns = dict()
+        for field in self.recordType.__slots__:
+            self.columns[field] = [] if field in self.stringFields else array("i")
+
+    ############################################################################
+    # Name: append                                                             #
+    # Params: recipe (an integer id for the recipe the record belongs to),     #
+    # record                                                                   #
+    # Returns: Integer (the record's row)                                      #
+    # Notes: None needed; the record itself is not kept.                       #
+    ############################################################################
+    def append(self, recipe, record):
+        self.recipes.append(recipe)
+        for field in self.recordType.__slots__:
+            self.columns[field].append(getattr(record, field))
+        return len(self.recipes) - 1
+
+    ############################################################################
+    # Name: extend                                                             #
+    # Params: recipe (an integer id), records (iterable of records)            #
+    # Returns: None                                                            #
+    # Notes: Adds a whole recipe's records at once.                            #
+    ############################################################################
+    def extend(self, recipe, records):
+        for record in records:
+            self.append(recipe, record)
+
+    ############################################################################
+    # Name: __len__                                                            #
+    # Params: None                                                             #
+    # Returns: Integer                                                         #
+    # Notes: Number of records across all recipes.                             #
+    ############################################################################
+    def __len__(self):
+        return len(self.recipes)
+
+    ############################################################################
+    # Name: __getitem__                                                        #
+    # Params: row                                                              #
+    # Returns: A recordType object                                             #
+    # Notes: Builds a fresh record from the columns.                           #
+    ############################################################################
+    def __getitem__(self, row):
+        return self.recordType(*[self.columns[field][row] for field in self.recordType.__slots__])
+
+    ############################################################################
+    # Name: rowsFor                                                            #
+    # Params: recipe (an integer id)                                           #
+    # Returns: List of rows                                                    #
+    # Notes: A scan over the recipe column, which is fine for occasional       #
+    # lookups; keep the rows append returns for anything hotter.               #
+    ############################################################################
+    def rowsFor(self, recipe):
+        return [row for row in range(len(self.recipes)) if self.recipes[row] == recipe]
+
+class IngredientColumns(RecordColumns):
+    recordType = IngredientRecord
+    stringFields = ("text", "name")
+
+class InstructionColumns(RecordColumns):
+    recordType = InstructionRecord
+    stringFields = ("text",)
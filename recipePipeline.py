@@ -0,0 +1,229 @@
+# Streams recipes through scrape, parse and transform, writing each result as a
+# JSON Lines entry as soon as it is ready. Input is read line by line from files
+# or stdin: a line holding a JSON object is an already scraped recipe (like
+# bulkScraper.py writes), and any other line is a URL or saved page to scrape.
+# Every stage pulls from the one before it only as fast as it is being drained,
+# so memory stays bounded by the scrape window and the batch (or worker) window
+# no matter how large the corpus is, and a slow output holds back the scraping
+# instead of piling results up.
+
+from recipeTransformer import Transformer, transformInBatches
+from corpusTransformer import CorpusTransformer
+from bulkScraper import BulkScraper, PageCache, boundedMap, DEFAULT_CACHE_DIR
+from conceptNet import ConceptNetClient, LocalDumpBackend
+from classificationIndex import loadClassificationIndex
+from similarityIndex import loadSimilarityIndex
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import argparse
+import json
+import sys
+
+################################################################################
+# Name: readInputs                                                             #
+# Params: inputs (list of file paths, "-" for stdin, or single recipe URLs)    #
+# Returns: Generator of (label, item) tuples, where item is a line of input or #
+# an already loaded recipe dict                                                #
+# Notes: Files are read lazily, one line at a time. A file that is one JSON    #
+# document (a recipe, or a list of them, written over several lines) can not   #
+# be streamed, so that one file is read whole.                                 #
+################################################################################
+def readInputs(inputs):
+    for name in inputs:
+        if name.startswith("http://") or name.startswith("https://"):
+            yield name, name
+            continue
+
+        label = "stdin" if name == "-" else name
+        inputFile = sys.stdin if name == "-" else open(name, encoding = "utf-8")
+        try:
+            lineNumber = 0
+            for line in inputFile:
+                lineNumber += 1
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("[") or (line.startswith("{") and lineNumber == 1 and not _isJSON(line)):
+                    recipes = json.loads(line + inputFile.read()) # A plain JSON document rather than JSON Lines
+                    if isinstance(recipes, dict):
+                        recipes = [recipes]
+                    for i in range(len(recipes)):
+                        yield label + ":" + str(i + 1), recipes[i]
+                    break
+                yield label + ":" + str(lineNumber), line
+        finally:
+            if inputFile is not sys.stdin:
+                inputFile.close()
+
+################################################################################
+# Name: _isJSON                                                                #
+# Params: text                                                                 #
+# Returns: Boolean                                                             #
+# Notes: Whether text parses as JSON on its own.                               #
+################################################################################
+def _isJSON(text):
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+class RecipePipeline:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: scraper (a bulkScraper.BulkScraper; one with the default page    #
+    # cache is made when None), batchSize (recipes parsed together in one      #
+    # nlp.pipe call), workers (worker processes for parsing and transforming;  #
+    # 0 keeps it all in this process), transformationTypes (list, or None for  #
+    # all of them), seed (given to every Transformer), conceptNetIndexPath,    #
+    # classificationIndexPath, useParseCache, similarityIndexPath (as for      #
+    # corpusTransformer.CorpusTransformer)                                     #
+    # Returns: None                                                            #
+    # Notes: In this process, the ConceptNet and classification settings apply #
+    # to Transformer directly; with workers, CorpusTransformer passes them on  #
+    # to each one.                                                             #
+    ############################################################################
+    def __init__(self, scraper = None, batchSize = 8, workers = 0, transformationTypes = None, seed = None, conceptNetIndexPath = None,
+    classificationIndexPath = None, useParseCache = True, similarityIndexPath = None):
+        self.scraper = scraper if scraper is not None else BulkScraper(PageCache())
+        self.batchSize = batchSize
+        self.workers = workers
+        self.transformationTypes = transformationTypes
+        self.seed = seed
+        self.conceptNetIndexPath = conceptNetIndexPath
+        self.classificationIndexPath = classificationIndexPath
+        self.useParseCache = useParseCache
+        self.similarityIndexPath = similarityIndexPath
+
+    ############################################################################
+    # Name: _loadOne                                                           #
+    # Params: entry (a (label, item) tuple from readInputs)                    #
+    # Returns: Tuple of (label, recipeData), or a dict with the label under    #
+    # "source" and an "error" message                                          #
+    # Notes: Runs in the scraping threads. A JSON line is parsed; anything     #
+    # else goes to the scraper.                                                #
+    ############################################################################
+    def _loadOne(self, entry):
+        label, item = entry
+        try:
+            if isinstance(item, dict):
+                return item.get("url", label), item
+            if item.startswith("{"):
+                recipeData = json.loads(item)
+                return recipeData.get("url", label), recipeData
+            recipeData = self.scraper.scrapeOne(item)
+            if "error" in recipeData:
+                return {"source": item, "error": recipeData["error"]}
+            return item, recipeData
+        except Exception as error:
+            return {"source": label, "error": type(error).__name__ + ": " + str(error)}
+
+    ############################################################################
+    # Name: _load                                                              #
+    # Params: entries (iterable of (label, item) tuples, as from readInputs)   #
+    # Returns: Generator of what _loadOne returns, in input order              #
+    # Notes: Up to twice the scraper's worker count of pages are fetched at    #
+    # once (see bulkScraper.boundedMap).                                       #
+    ############################################################################
+    def _load(self, entries):
+        with ThreadPoolExecutor(max_workers = self.scraper.workers) as executor:
+            for loaded in boundedMap(self._loadOne, entries, executor, 2 * self.scraper.workers):
+                yield loaded
+
+    ############################################################################
+    # Name: _transformInProcess                                                #
+    # Params: recipeSources (iterable of (label, url, recipeData) tuples)      #
+    # Returns: Generator of dicts from transformRecipes, in input order        #
+    # Notes: Small batches keep spaCy's nlp.pipe efficient while the first     #
+    # results still come out within a batch of the start.                      #
+    ############################################################################
+    def _transformInProcess(self, recipeSources):
+        return transformInBatches(recipeSources, self.transformationTypes, self.seed, self.batchSize)
+
+    ############################################################################
+    # Name: _transform                                                         #
+    # Params: recipeSources (iterable of (label, url, recipeData) tuples)      #
+    # Returns: Generator of result dicts, in input order                       #
+    # Notes: Either in this process or on a CorpusTransformer pool, depending  #
+    # on workers.                                                              #
+    ############################################################################
+    def _transform(self, recipeSources):
+        if self.workers:
+            corpusTransformer = CorpusTransformer(self.workers, self.batchSize, self.transformationTypes, self.conceptNetIndexPath,
+            self.classificationIndexPath, self.seed, self.useParseCache, self.similarityIndexPath)
+            return corpusTransformer.transform(recipeSources)
+
+        if not self.useParseCache:
+            Transformer.parseCache = None
+        if self.conceptNetIndexPath:
+            Transformer.conceptNet = ConceptNetClient(backend = LocalDumpBackend(self.conceptNetIndexPath))
+        if self.classificationIndexPath:
+            Transformer.classificationIndex = loadClassificationIndex(self.classificationIndexPath)
+        if self.similarityIndexPath:
+            Transformer.similarityIndex = loadSimilarityIndex(self.similarityIndexPath)
+        return self._transformInProcess(recipeSources)
+
+    ############################################################################
+    # Name: run                                                                #
+    # Params: entries (iterable of (label, item) tuples, as from readInputs)   #
+    # Returns: Generator of dicts, one per entry and in the same order: the    #
+    # transformRecipes output, or an "error" entry for input that could not be #
+    # read or scraped                                                          #
+    # Notes: Recipes that failed to load never reach the transform stage; they #
+    # wait in a queue and are handed back in their place in the order.         #
+    ############################################################################
+    def run(self, entries):
+        order = collections.deque() # One item per loaded entry: its error, or None for a recipe sent on to be transformed
+
+        def recipeSources():
+            for loaded in self._load(entries):
+                if isinstance(loaded, dict):
+                    order.append(loaded)
+                else:
+                    order.append(None)
+                    yield loaded[0], None, loaded[1]
+
+        for result in self._transform(recipeSources()):
+            while order[0] is not None: # Failures that came before this recipe
+                yield order.popleft()
+            order.popleft()
+            yield result
+        while order: # Failures after the last recipe
+            yield order.popleft()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Stream recipes through scraping and transformation, writing JSON Lines as results are ready.")
+    parser.add_argument("inputs", nargs = "*", default = ["-"],
+    help = "files of recipe URLs and/or JSON Lines recipes, \"-\" for stdin (the default), or single recipe URLs")
+    parser.add_argument("--type", action = "append", dest = "types", choices = Transformer.transformationTypes,
+    help = "transformation to apply (repeat for several; defaults to all of them)")
+    parser.add_argument("--output", help = "JSON Lines output file (defaults to stdout)")
+    parser.add_argument("--batch-size", type = int, default = 8, help = "recipes parsed together (or handed to a worker at a time)")
+    parser.add_argument("--workers", type = int, default = 0, help = "worker processes for parsing and transforming (defaults to none)")
+    parser.add_argument("--scrape-workers", type = int, default = 8, help = "concurrent page fetches")
+    parser.add_argument("--cache", default = DEFAULT_CACHE_DIR, help = "page cache directory")
+    parser.add_argument("--offline", action = "store_true", help = "only use pages already in the page cache")
+    parser.add_argument("--conceptnet-index", help = "serve ConceptNet lookups from this local dump index (see conceptNet.py)")
+    parser.add_argument("--classification-index", help = "classify words with this precompiled index (see classificationIndex.py)")
+    parser.add_argument("--seed", type = int, help = "seed the random replacement choices so runs are reproducible")
+    parser.add_argument("--similarity-index", help = "pick replacements that suit each recipe with this index (see similarityIndex.py) instead of at random")
+    parser.add_argument("--no-parse-cache", action = "store_true", help = "parse every recipe from scratch, without reading or writing the parse cache")
+    args = parser.parse_args()
+
+    scraper = BulkScraper(PageCache(args.cache), args.scrape_workers, args.offline)
+    pipeline = RecipePipeline(scraper, args.batch_size, args.workers, args.types, args.seed, args.conceptnet_index,
+    args.classification_index, not args.no_parse_cache, args.similarity_index)
+    output = open(args.output, "w", encoding = "utf-8") if args.output else sys.stdout
+    total = 0
+    failures = 0
+    for entry in pipeline.run(readInputs(args.inputs)):
+        total += 1
+        if "error" in entry:
+            failures += 1
+            print("Could not transform " + entry["source"] + ": " + entry["error"], file = sys.stderr)
+        output.write(json.dumps(entry) + "\n")
+        output.flush()
+    if output is not sys.stdout:
+        output.close()
+    print("Transformed " + str(total - failures) + " of " + str(total) + " recipes.", file = sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -1,32 +1,65 @@
 ### Adapted from the documentation provided here: https://pypi.org/project/requests-html/
 ### Written by: Mukundan Kuthalam
-from requests_html import HTMLSession
 import sys
 import json
+import html
 import re
+import os
+
+sharedSession = None # One HTMLSession per process, created on first use
+sharedSessionPid = None
+
+def getSession():
+    global sharedSession, sharedSessionPid
+
+    # requests_html pulls in a whole headless browser stack, so it is only imported once we actually scrape.
+    # A forked worker gets its own session rather than sharing the parent's open connections.
+    if sharedSession is None or sharedSessionPid != os.getpid():
+        from requests_html import HTMLSession
+        sharedSession = HTMLSession()
+        sharedSessionPid = os.getpid()
+
+    return sharedSession
 
 def openSession(url):
     request = None # HTTP Request to scrape the website source
 
     # Open a request to fetch the HTML content
     try:
-        session = HTMLSession()
-        request = session.get(url)
+        request = getSession().get(url)
     except:
         request = None
 
     return request
 
 def formulateJSON(request):
+    return formulateJSONFromHTML(request.text)
+
+def formulateJSONFromHTML(pageHTML):
     finalJSON = dict() # Result that gets moved to a json
     # Keys used in the final JSON
     recipeKey = "recipeName"
     ingredientsKey = "ingredients"
     instructionsKey = "instructions"
 
-    # Get the portion of the website source that contains the info we need
+    # Recipe pages describe the recipe in a JSON-LD block (https://schema.org/Recipe), so we decode that properly
+    # instead of slicing strings. Working from the raw page text lets cached pages go through here too
+    recipe = findRecipeJSONLD(pageHTML)
+    if recipe is not None:
+        finalJSON[recipeKey] = cleanText(recipe.get("name", ""))
+        finalJSON[ingredientsKey] = [cleanText(ingredient) for ingredient in recipe.get("recipeIngredient", []) if cleanText(ingredient)]
+        finalJSON[instructionsKey] = splitInstructions(instructionTexts(recipe.get("recipeInstructions", [])))
+        servings = getServings(recipe.get("recipeYield"))
+        if servings is not None: # So quantities.py can scale the recipe to a number of servings
+            finalJSON["servings"] = servings
+        return finalJSON
+
+    # Older page layouts: get the portion of the website source that contains the info we need
     # Notice this object comes as a string, so we need to parse it to what we want
-    recipeDetails = request.html.find("script", first = True).text
+    firstScript = scriptPattern.search(pageHTML)
+    if firstScript is None:
+        raise ValueError("No recipe information found on the page")
+    recipeDetails = firstScript.group(1).strip()
 
     # Now we get each necessary part of info by traversing the above string
     finalJSON[recipeKey] = getRecipeName(recipeDetails)
@@ -35,6 +68,82 @@ def formulateJSON(request):
 
     return finalJSON
 
+scriptPattern = re.compile(r"<script[^>]*>(.*?)</script>", re.DOTALL | re.IGNORECASE)
+jsonLDPattern = re.compile(r"<script[^>]*type\s*=\s*[\"']application/ld\+json[\"'][^>]*>", re.IGNORECASE)
+jsonDecoder = json.JSONDecoder()
+
+def findRecipeJSONLD(pageHTML):
+    # A page can carry several JSON-LD blocks (breadcrumbs, videos, ...), so check each one for a Recipe
+    for match in jsonLDPattern.finditer(pageHTML):
+        start = match.end()
+        while start < len(pageHTML) and pageHTML[start].isspace(): # raw_decode does not skip leading whitespace
+            start += 1
+        try:
+            # raw_decode parses in place from the offset, so the page never gets sliced or copied
+            data = jsonDecoder.raw_decode(pageHTML, start)[0]
+        except ValueError:
+            continue
+        recipe = findRecipeObject(data)
+        if recipe is not None:
+            return recipe
+    return None
+
+def findRecipeObject(data):
+    # The Recipe can be the top-level object, one entry of a list, or nested in an "@graph"
+    if isinstance(data, list):
+        for item in data:
+            recipe = findRecipeObject(item)
+            if recipe is not None:
+                return recipe
+    elif isinstance(data, dict):
+        objectType = data.get("@type", "")
+        if objectType == "Recipe" or (isinstance(objectType, list) and "Recipe" in objectType):
+            return data
+        if "@graph" in data:
+            return findRecipeObject(data["@graph"])
+    return None
+
+def instructionTexts(instructions):
+    # Steps come as plain strings, HowToStep objects, or HowToSection objects holding more steps
+    if isinstance(instructions, str):
+        return [instructions]
+    if isinstance(instructions, dict): # A lone HowToStep or HowToSection, not a list of them
+        instructions = [instructions]
+
+    texts = []
+    for step in instructions:
+        if isinstance(step, str):
+            texts.append(step)
+        elif isinstance(step, dict):
+            if "itemListElement" in step:
+                texts.extend(instructionTexts(step["itemListElement"]))
+            elif "text" in step:
+                texts.append(step["text"])
+    return texts
+
+def splitInstructions(texts):
+    # Since a single step can actually contain multiple steps, some further parsing is done
+    instructionsList = []
+    for text in texts:
+        for elem in cleanText(text).split("."):
+            for item in elem.split(";"): # There may be semicolons that separate steps
+                if item.strip() != "":
+                    instructionsList.append(item.strip().capitalize())
+    return instructionsList
+
+def getServings(recipeYield):
+    # The yield comes as a number, a string like "4 servings", or a list of both; the first number in it is the serving count
+    if isinstance(recipeYield, list):
+        recipeYield = recipeYield[0] if recipeYield else None
+    if isinstance(recipeYield, (int, float)) and not isinstance(recipeYield, bool):
+        return recipeYield if recipeYield > 0 else None
+    match = re.search(r"\d+", str(recipeYield or ""))
+    return int(match.group()) if match and int(match.group()) > 0 else None
+
+def cleanText(text):
+    # Collapse the newlines and runs of spaces the site leaves in, and undo any HTML entities
+    return " ".join(html.unescape(str(text)).split())
+
 def getRecipeName(recipeInfo):
     recipeNameTag = "name"
 
@@ -0,0 +1,365 @@
+# A long-running local HTTP service around Transformer. The spaCy model, the
+# knowledge base and every cache (ConceptNet, parses, pages, and finished
+# results) stay warm between requests, so only the first request pays for
+# loading anything. Identical requests that arrive while one is already being
+# worked on wait for that one instead of repeating it. Built on asyncio and the
+# standard library alone; the CPU-bound parsing runs on a small thread pool so
+# the event loop keeps answering (e.g. /metrics) in the meantime.
+#
+# Endpoints:
+#   POST /transform  {"url": ...} or {"recipe": {...}}, plus optional "type" (or a "types" list) and "seed"
+#   GET  /transform?url=...&type=...&seed=...
+#   GET  /metrics    request counts, cache hits, latency percentiles and per-stage totals (?format=prometheus for Prometheus text)
+#   GET  /health
+# /transform answers with the same entry transformRecipes makes for a recipe.
+#
+# For offline runs, point it at standInServer.py with --conceptnet-url and use
+# recipe URLs on the stand-in.
+
+from recipeTransformer import Transformer, loadNLP
+from conceptNet import ConceptNetClient, HTTPBackend, LocalDumpBackend, LRUCache
+from classificationIndex import loadClassificationIndex
+from similarityIndex import loadSimilarityIndex
+from bulkScraper import BulkScraper, PageCache, DEFAULT_CACHE_DIR
+from metrics import processMetrics, toPrometheus, percentile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from http import HTTPStatus
+import collections
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+MAX_BODY_SIZE = 10 * 1024 * 1024 # Bytes; a recipe is a few KB, so anything near this is a mistake
+
+class RecipeService:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: scraper (a bulkScraper.BulkScraper; one with the default page    #
+    # cache is made when None), transformWorkers (threads running spaCy and    #
+    # the transformations), resultCacheSize (finished results kept in memory), #
+    # resultTTL (seconds a finished result is reused for), latencyWindow (most #
+    # recent requests per endpoint the percentiles cover)                      #
+    # Returns: None                                                            #
+    # Notes: One transform thread is the safe default, since a spaCy pipeline  #
+    # is not guaranteed to be thread-safe; the scraping gets its own pool so   #
+    # slow pages never hold up parsing.                                        #
+    ############################################################################
+    def __init__(self, scraper = None, transformWorkers = 1, resultCacheSize = 1024, resultTTL = 60 * 60, latencyWindow = 2048):
+        self.scraper = scraper if scraper is not None else BulkScraper(PageCache())
+        self.scrapeExecutor = ThreadPoolExecutor(max_workers = self.scraper.workers)
+        self.transformExecutor = ThreadPoolExecutor(max_workers = transformWorkers)
+        self.results = LRUCache(resultCacheSize) # Request key -> (time stored, status, entry)
+        self.resultTTL = resultTTL
+        self.inFlight = dict() # Request key -> the task working on it
+        self.latencyWindow = latencyWindow
+        self.latencies = dict() # Endpoint -> deque of the latest latencies, in seconds
+        self.counts = collections.Counter() # Requests, errors, result cache hits and misses, coalesced requests
+        self.started = time.time()
+
+    ############################################################################
+    # Name: warm                                                               #
+    # Params: None                                                             #
+    # Returns: None (a coroutine)                                              #
+    # Notes: Loads the spaCy model and the knowledge base before the first     #
+    # request comes in, on the transform pool so the class-level setup in      #
+    # Transformer is never raced.                                              #
+    ############################################################################
+    async def warm(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.transformExecutor, loadNLP)
+        emptyRecipe = Transformer(recipeData = {"recipeName": "", "ingredients": [], "instructions": []})
+        await loop.run_in_executor(self.transformExecutor, emptyRecipe._rules) # Loads the knowledge base and compiles the rule index
+
+    ############################################################################
+    # Name: _requestKey                                                        #
+    # Params: source (a URL or a recipe dict), transformationTypes (list),     #
+    # seed                                                                     #
+    # Returns: String (hex SHA-256)                                            #
+    # Notes: Two requests with the same key get the same answer, which is what #
+    # the result cache and the coalescing go by. Without a seed, a cached      #
+    # answer repeats the random choices of the run that made it.               #
+    ############################################################################
+    def _requestKey(self, source, transformationTypes, seed):
+        content = json.dumps([source, transformationTypes, seed], sort_keys = True, ensure_ascii = False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    ############################################################################
+    # Name: _transformOne                                                      #
+    # Params: label, recipeData, transformationTypes, seed                     #
+    # Returns: Tuple of (HTTP status, entry)                                   #
+    # Notes: Runs on the transform pool. The entry is shaped like a            #
+    # transformRecipes one.                                                    #
+    ############################################################################
+    def _transformOne(self, label, recipeData, transformationTypes, seed):
+        try:
+            newTransformer = Transformer(recipeData = recipeData, seed = seed)
+            transformations = newTransformer.transformAll(transformationTypes)
+            return 200, {"source": label, "recipeName": newTransformer.recipeData["recipeName"],
+            "transformations": [result.toJSON() for result in transformations]}
+        except Exception as error:
+            return 500, {"source": label, "error": type(error).__name__ + ": " + str(error)}
+
+    ############################################################################
+    # Name: _compute                                                           #
+    # Params: url (or None), recipeData (or None), transformationTypes, seed   #
+    # Returns: Tuple of (HTTP status, entry) (a coroutine)                     #
+    # Notes: Scrapes first if need be; a page that can not be scraped is a     #
+    # 502.                                                                     #
+    ############################################################################
+    async def _compute(self, url, recipeData, transformationTypes, seed):
+        loop = asyncio.get_running_loop()
+        label = url
+        if recipeData is None:
+            recipeData = await loop.run_in_executor(self.scrapeExecutor, self.scraper.scrapeOne, url)
+            if "error" in recipeData:
+                return 502, {"source": url, "error": recipeData["error"]}
+        else:
+            label = recipeData.get("url", recipeData.get("recipeName", ""))
+        return await loop.run_in_executor(self.transformExecutor, self._transformOne, label, recipeData, transformationTypes, seed)
+
+    ############################################################################
+    # Name: transform                                                          #
+    # Params: url (or None), recipeData (or None; exactly one of the two is    #
+    # given), transformationTypes (list), seed                                 #
+    # Returns: Tuple of (HTTP status, entry) (a coroutine)                     #
+    # Notes: Answers from the result cache when it can. Otherwise, if the same #
+    # request is already being worked on, waits for that instead of starting   #
+    # another; only successful results are cached.                             #
+    ############################################################################
+    async def transform(self, url, recipeData, transformationTypes, seed):
+        key = self._requestKey(url if recipeData is None else recipeData, transformationTypes, seed)
+        cached = self.results.get(key)
+        if cached is not None and time.time() - cached[0] <= self.resultTTL:
+            self.counts["resultCacheHits"] += 1
+            return cached[1], cached[2]
+        self.counts["resultCacheMisses"] += 1
+
+        task = self.inFlight.get(key)
+        if task is not None:
+            self.counts["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._compute(url, recipeData, transformationTypes, seed))
+            self.inFlight[key] = task
+
+            def finished(task):
+                del self.inFlight[key]
+                if not task.cancelled() and task.exception() is None and task.result()[0] == 200:
+                    self.results.put(key, (time.time(),) + task.result())
+            task.add_done_callback(finished)
+        return await asyncio.shield(task) # One client hanging up must not cancel the work the others are waiting on
+
+    ############################################################################
+    # Name: metrics                                                            #
+    # Params: None                                                             #
+    # Returns: Dict                                                            #
+    # Notes: Latencies are in milliseconds, over the latest latencyWindow      #
+    # requests to each endpoint. "transformer" holds the stage timings, cache  #
+    # hits and network use of every recipe so far (see metrics.py), as long as #
+    # Transformer.collectMetrics is on.                                        #
+    ############################################################################
+    def metrics(self):
+        latency = dict()
+        for endpoint, recent in self.latencies.items():
+            values = sorted(recent)
+            latency[endpoint] = {"count": len(values), "p50": percentile(values, 0.5) * 1000, "p90": percentile(values, 0.9) * 1000,
+            "p99": percentile(values, 0.99) * 1000, "max": values[-1] * 1000}
+        return {"uptime": time.time() - self.started, "counts": dict(self.counts), "inFlight": len(self.inFlight),
+        "resultCacheEntries": len(self.results.entries), "latency": latency, "transformer": processMetrics.snapshot()}
+
+    ############################################################################
+    # Name: prometheusMetrics                                                  #
+    # Params: None                                                             #
+    # Returns: String in the Prometheus text exposition format                 #
+    # Notes: The service's own counters followed by the transformer's (see     #
+    # metrics.toPrometheus).                                                   #
+    ############################################################################
+    def prometheusMetrics(self):
+        lines = ["# TYPE recipe_service_requests_total counter", "recipe_service_requests_total " + str(self.counts["requests"]),
+        "# TYPE recipe_service_errors_total counter", "recipe_service_errors_total " + str(self.counts["errors"]),
+        "# TYPE recipe_service_in_flight gauge", "recipe_service_in_flight " + str(len(self.inFlight))]
+        return "\n".join(lines) + "\n" + toPrometheus(processMetrics.snapshot())
+
+    ############################################################################
+    # Name: _parseTransformRequest                                             #
+    # Params: method, query (dict from parse_qs), body (bytes)                 #
+    # Returns: Tuple of (url, recipeData, transformationTypes, seed)           #
+    # Notes: Raises a ValueError with a message for the client when the        #
+    # request does not make sense. A single "types" string counts as a list of #
+    # one.                                                                     #
+    ############################################################################
+    def _parseTransformRequest(self, method, query, body):
+        if method == "POST":
+            request = json.loads(body.decode("utf-8") or "{}")
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object")
+        else:
+            request = {"url": query.get("url", [None])[0], "types": query.get("type"), "seed": query.get("seed", [None])[0]}
+
+        url = request.get("url")
+        recipeData = request.get("recipe")
+        if (url is None) == (recipeData is None):
+            raise ValueError("Give exactly one of \"url\" and \"recipe\"")
+        if recipeData is not None and not all(key in recipeData for key in ("recipeName", "ingredients", "instructions")):
+            raise ValueError("A recipe needs recipeName, ingredients and instructions")
+
+        transformationTypes = request.get("types") or ([request["type"]] if request.get("type") else list(Transformer.transformationTypes))
+        if isinstance(transformationTypes, str): # "types": "to healthy" means the one transformation, not one per letter
+            transformationTypes = [transformationTypes]
+        if not isinstance(transformationTypes, list) or not all(isinstance(transformationType, str) for transformationType in transformationTypes):
+            raise ValueError("\"types\" should be a list of transformation names")
+        transformationTypes = [transformationType.lower() for transformationType in transformationTypes]
+        for transformationType in transformationTypes:
+            if transformationType not in Transformer.transformationTypes:
+                raise ValueError("Unknown transformation \"" + transformationType + "\"; expected one of " + ", ".join(Transformer.transformationTypes))
+        seed = request.get("seed")
+        return url, recipeData, transformationTypes, int(seed) if seed is not None else None
+
+    ############################################################################
+    # Name: handle                                                             #
+    # Params: method, target (request path and query), body (bytes)            #
+    # Returns: Tuple of (HTTP status, JSON-serializable body) (a coroutine)    #
+    # Notes: Routes a request and records how long it took.                    #
+    ############################################################################
+    async def handle(self, method, target, body):
+        start = time.perf_counter()
+        parts = urlsplit(target)
+        endpoint = parts.path
+        try:
+            if endpoint == "/transform" and method in ("GET", "POST"):
+                try:
+                    request = self._parseTransformRequest(method, parse_qs(parts.query), body)
+                except ValueError as error:
+                    status, response = 400, {"error": str(error)}
+                else:
+                    status, response = await self.transform(*request)
+            elif endpoint == "/metrics" and method == "GET":
+                prometheus = parse_qs(parts.query).get("format") == ["prometheus"]
+                status, response = 200, self.prometheusMetrics() if prometheus else self.metrics()
+            elif endpoint == "/health" and method == "GET":
+                status, response = 200, {"status": "ok"}
+            else:
+                endpoint = "other" # So stray paths do not each get their own latency entry
+                status, response = 404, {"error": "No such endpoint"}
+        except Exception as error:
+            status, response = 500, {"error": type(error).__name__ + ": " + str(error)}
+
+        self.counts["requests"] += 1
+        if status >= 400:
+            self.counts["errors"] += 1
+        self.latencies.setdefault(endpoint, collections.deque(maxlen = self.latencyWindow)).append(time.perf_counter() - start)
+        return status, response
+
+    ############################################################################
+    # Name: _serveConnection                                                   #
+    # Params: reader, writer (asyncio streams for one client connection)       #
+    # Returns: None (a coroutine)                                              #
+    # Notes: Just enough HTTP/1.1 for JSON clients: Content-Length bodies and  #
+    # keep-alive. Chunked uploads are refused.                                 #
+    ############################################################################
+    async def _serveConnection(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine.strip():
+                    break
+                try:
+                    method, target, version = requestLine.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keepAlive = headers.get("connection", "").lower() != "close" if version == "HTTP/1.1" else headers.get("connection", "").lower() == "keep-alive"
+                length = int(headers.get("content-length", "0") or 0)
+                if "chunked" in headers.get("transfer-encoding", "").lower() or length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {"error": "Send a body of at most " + str(MAX_BODY_SIZE) + " bytes with a Content-Length"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, response = await self.handle(method.upper(), target, body)
+                await self._respond(writer, status, response, keepAlive)
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass # The client went away
+        finally:
+            writer.close()
+
+    ############################################################################
+    # Name: _respond                                                           #
+    # Params: writer, status, response (JSON-serializable), keepAlive          #
+    # Returns: None (a coroutine)                                              #
+    # Notes: A string response goes out as plain text rather than JSON.        #
+    ############################################################################
+    async def _respond(self, writer, status, response, keepAlive):
+        if isinstance(response, str):
+            body, contentType = response.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, contentType = json.dumps(response).encode("utf-8"), "application/json"
+        head = "HTTP/1.1 " + str(status) + " " + HTTPStatus(status).phrase + "\r\nContent-Type: " + contentType + "\r\nContent-Length: " + \
+        str(len(body)) + "\r\nConnection: " + ("keep-alive" if keepAlive else "close") + "\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: host, port (0 picks a free one)                                  #
+    # Returns: asyncio Server (a coroutine)                                    #
+    # Notes: Warms everything up before it starts accepting connections.       #
+    ############################################################################
+    async def start(self, host = "127.0.0.1", port = 8080):
+        await self.warm()
+        return await asyncio.start_server(self._serveConnection, host, port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve recipe transformations over HTTP, keeping the model and caches warm.")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--conceptnet-url", help = "ConceptNet API to use instead of the public one (e.g. a standInServer.py)")
+    parser.add_argument("--conceptnet-index", help = "serve ConceptNet lookups from this local dump index (see conceptNet.py)")
+    parser.add_argument("--classification-index", help = "classify words with this precompiled index (see classificationIndex.py)")
+    parser.add_argument("--cache", default = DEFAULT_CACHE_DIR, help = "page cache directory")
+    parser.add_argument("--offline", action = "store_true", help = "only use pages already in the page cache")
+    parser.add_argument("--scrape-workers", type = int, default = 8, help = "concurrent page fetches")
+    parser.add_argument("--transform-workers", type = int, default = 1, help = "threads parsing and transforming")
+    parser.add_argument("--result-cache-size", type = int, default = 1024, help = "finished results kept in memory")
+    parser.add_argument("--result-ttl", type = float, default = 60 * 60, help = "seconds a finished result is reused for")
+    parser.add_argument("--similarity-index", help = "pick replacements that suit each recipe with this index (see similarityIndex.py) instead of at random")
+    parser.add_argument("--no-parse-cache", action = "store_true", help = "parse every recipe from scratch, without reading or writing the parse cache")
+    parser.add_argument("--no-stage-metrics", action = "store_true", help = "leave the per-stage timings, cache hits and network use out of /metrics")
+    args = parser.parse_args()
+
+    Transformer.collectMetrics = not args.no_stage_metrics
+    if args.no_parse_cache:
+        Transformer.parseCache = None
+    if args.conceptnet_index:
+        Transformer.conceptNet = ConceptNetClient(backend = LocalDumpBackend(args.conceptnet_index))
+    elif args.conceptnet_url:
+        Transformer.conceptNet = ConceptNetClient(backend = HTTPBackend(args.conceptnet_url, perSecond = None)) # Our own server needs no rate limit
+    if args.classification_index:
+        Transformer.classificationIndex = loadClassificationIndex(args.classification_index)
+    if args.similarity_index:
+        Transformer.similarityIndex = loadSimilarityIndex(args.similarity_index)
+
+    service = RecipeService(BulkScraper(PageCache(args.cache), args.scrape_workers, args.offline), args.transform_workers,
+    args.result_cache_size, args.result_ttl)
+
+    async def main():
+        server = await service.start(args.host, args.port)
+        print("Serving on http://" + args.host + ":" + str(server.sockets[0].getsockname()[1]))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,63 +1,121 @@
 # Where the Spacy code was adapted from: https://spacy.io/usage/linguistic-features
 
 from recipeScraper import openSession, formulateJSON
-import spacy
+from conceptNet import ConceptNetClient, LocalDumpBackend
+from classificationIndex import loadClassificationIndex
+from substitution import SubstitutionMatcher, referencedIngredients
+from transformationRules import RuleIndex, TRANSFORMATION_RULES
+from knowledgeBase import loadKnowledgeBase
+from parseCache import ParseCache, parseKey
+from recipeModel import IngredientRecord, InstructionRecord
+from quantities import QuantityColumns, findQuantity
+from similarityIndex import loadSimilarityIndex
+from corpusStore import CorpusStore, isCorpusStore
+from metrics import Metrics, processMetrics, instrumented, collecting, currentCollector, recordCacheLookup, toPrometheus, SamplingProfiler
+import argparse
+import json
 import sys
 import re
-import nltk
-import requests
 import random
 
-class Transformer:
-    recipeData = None
-
-    ingPredicates = dict()
-    instPredicates = dict()
-
-    transformedIng = dict()
-
-    finalIng = list()
-    finalInst = list()
+NLP_MODEL = "en_core_web_sm"
+PARSE_VERSION = 5 # Bump this whenever a change to the parsing (or NLP_MODEL) would parse recipes differently, so cached parses are dropped
+sharedNLP = None # The spaCy model, loaded on first use and shared by every Transformer in the process
+
+################################################################################
+# Name: loadNLP                                                                #
+# Params: None                                                                 #
+# Returns: spaCy Language object                                               #
+# Notes: Loading the model takes seconds, so it only happens the first time a  #
+# recipe is actually parsed rather than on import. Call this before forking    #
+# worker processes and they all inherit the loaded model instead of each       #
+# loading their own.                                                           #
+################################################################################
+def loadNLP():
+    global sharedNLP
+    if sharedNLP is None:
+        import spacy
+        # Only the dependency parse (dep_ and children) is ever used, so the other components are not even loaded
+        sharedNLP = spacy.load(NLP_MODEL, exclude = ["tagger", "attribute_ruler", "lemmatizer", "ner"])
+    return sharedNLP
 
-    nlp = spacy.load("en_core_web_sm")
-
-    replacementGuide = {"vegProtein": ["tofu"],
-                    "meatProtein": ["beef", "chicken", "pork", "pepperoni", "sausage", "turkey",
-                    "steak", "fish", "salmon", "shrimp", "lobster", "salami", "rennet", "poultry",
-                    "bacon", "lamb"],
-                    "pairedWords": ["stock", "broth", "sauce", "loin", "tenderloin", "sirloin", "breast"],
-                    "worcestershire sauce": ["soy sauce"],
-                    "standardDairy": ["milk", "cheese", "cream", "yogurt", "butter", "ghee"],
-                    "healthy": ["chicken", "turkey", "coconut oil", "poultry", "fish"], # This list was constructed by referring to https://www.heart.org/en/healthy-living/healthy-eating/eat-smart/nutrition-basics/meat-poultry-and-fish-picking-healthy-proteins
-                    "unhealthy": ["steak", "beef", "sausage", "butter", "ham", "salami", "bacon", "sirloin"],
-                    "spices": ["seasoning", "oregano"],
-                    "condiments": ["salt", "oil"],
-                    "plants": ["onions", "onion"]}
-    allFoods = set()
-    cookingVerbs = ["place"] # ConceptNet can be very bad at detecting what things are verbs
+class Transformer:
+    # Everything that describes one recipe (the scraped data, the parse, and the transformation output) is set up
+    # per instance in __init__. The class attributes below are read-only configuration shared by every instance.
 
-    spicesForStyleReplacement = set()
-    styleReplacementGuide = {"Mexican": {"sausage": "chorizo", "cheese": "queso fresco",
-    "spices": ["Chili Powder", "Cilantro", "Coriander", "Cumin", "Garlic Powder", "Onion Powder", "Smoked Paprika"]}}
+    nlp = property(lambda self: loadNLP()) # See loadNLP; nothing is loaded until the first parse
+    pipeBatchSize = 256 # Number of strings spaCy parses together in nlp.pipe
 
-    transformationType = None
-    queryOffset = 100 # Number of results returned by ConceptNet API call
+    knowledgeBase = None # Which words are foods, the cuisines, and the dietary profiles (see knowledgeBase.py); loaded on first use
+    transformationTypes = list(TRANSFORMATION_RULES) # "to vegetarian", "to healthy", "from vegetarian", "from healthy", and one per cuisine
+    ruleIndex = None # The knowledge base compiled together with TRANSFORMATION_RULES; built on first use (see _rules)
+    conceptNet = ConceptNetClient() # Cached ConceptNet lookups; swap in a LocalDumpBackend to run without the network
+    parseCache = ParseCache() # Parses of recipes we have seen before (see parseCache.py); None turns it off
+    classificationIndex = None # Precompiled answers from the ConceptNet dump (see classificationIndex.py); used instead of conceptNet when set
+    similarityIndex = None # Picks chooseFrom replacements that suit the recipe instead of random ones (see similarityIndex.py)
+    collectMetrics = False # Whether each Transformer records its own stage timings, cache hits and network use (see metrics.py)
 
     ############################################################################
     # Name: __init__                                                           #
-    # Params: url (the url from which a recipe is fetched)                     #
+    # Params: url (the url from which a recipe is fetched), recipeData (an     #
+    # already scraped recipe, in the formulateJSON format; used instead of url #
+    # when given), seed (for the random choices some transformations make;     #
+    # None means they differ from run to run)                                  #
     # Returns: None                                                            #
     # Notes: Makes a HTTP request to get the right information about the       #
-    # recipe and format it into a JSON. Also constructs a set of foods we know #
-    # about for later convenience.                                             #
+    # recipe and format it into a JSON, unless the recipe was scraped          #
+    # beforehand. The foods we know about come from the knowledge base, which  #
+    # is loaded once per process rather than per recipe.                       #
     ############################################################################
-    def __init__(self, url):
-        request = openSession(url)
-        self.recipeData = formulateJSON(request)
+    def __init__(self, url = None, recipeData = None, seed = None):
+        if recipeData is not None:
+            self.recipeData = recipeData
+        else:
+            request = openSession(url)
+            self.recipeData = formulateJSON(request)
+
+        # Everything parsed out of this recipe belongs to this instance alone, so one process can handle several recipes
+        self.ingDocs = None
+        self.instDocs = None
+        self.ingPredicates = list() # One recipeModel.IngredientRecord per ingredient the parser made sense of
+        self.instPredicates = list() # One recipeModel.InstructionRecord per instruction
+        self.spicesForStyleReplacement = set()
+        self.parsed = False # Whether _ingParse and _instParse have run; transformations all share the one parse
+
+        # The output of the latest transformation (see _resetTransformation)
+        self.transformationType = None
+        self.transformedIng = dict()
+        self.finalIng = list()
+        self.finalInst = list()
+
+        # What earlier transformations rendered, so switching transformations only redoes the lines that come out differently
+        self.instDependencies = None # Per instruction, the ingredient names it mentions (see _instructionDependencies)
+        self.ingLines = dict() # (ingredient index, replacement) -> rendered ingredient
+        self.instLines = dict() # (instruction index, substitutions it depends on, dropped words) -> rendered instruction
+        self.matchers = dict() # Substitutions -> SubstitutionMatcher compiled for them
+
+        self.rng = random.Random(seed) # For the random healthy meat and spice picks; give a seed to make them reproducible
+
+        # This recipe's numbers, which also add up into metrics.processMetrics; None unless collectMetrics is on
+        self.metrics = Metrics(parent = processMetrics) if self.collectMetrics else None
 
-        for key in self.replacementGuide.keys():
-            for food in self.replacementGuide[key]:
-                self.allFoods.add(food)
+    ############################################################################
+    # Name: _parseDocuments                                                    #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Runs every ingredient and instruction through spaCy in a single   #
+    # nlp.pipe batch and keeps the Docs, so the prefetching and both parsers   #
+    # share one parse. Does nothing if the Docs are already there              #
+    # (parseRecipes may have filled them in for a whole batch of recipes).     #
+    ############################################################################
+    @instrumented("_parseDocuments")
+    def _parseDocuments(self):
+        if self.ingDocs is not None and self.instDocs is not None:
+            return
+        ingredients = self.recipeData["ingredients"]
+        allDocs = list(self.nlp.pipe(ingredients + self.recipeData["instructions"], batch_size = self.pipeBatchSize))
+        self.ingDocs = allDocs[:len(ingredients)]
+        self.instDocs = allDocs[len(ingredients):]
 
     ############################################################################
     # Name: _ingParse                                                          #
@@ -65,65 +123,47 @@ class Transformer:
     # Returns: None                                                            #
     # Notes: Using the recipe data store in self.recipeData, this parses out   #
     # the relevant portions (ingredient name, quantity, and measurement units) #
-    # from the recipe data and saves these in the self.ingPredicates dict.     #
-    # By predicate, we mean something like "(isa beef ingredient)", but to be  #
-    # Pythonic, this is in a dict structure                                    #
-    # (ex. self.ingPredicates["beef"]["isa"] = "beef").                        #
-    # The parsing combines using a dependency parser and conceptNet to narrow  #
-    # the "isa" predicate to point to a food. Oddly enough, whether the root   #
-    # is an actual food can be separate from the often correct quantity and    #
-    # measurement parsing.                                                     #
+    # from the recipe data and saves these in self.ingPredicates. By           #
+    # predicate, we mean something like "(isa beef ingredient)", but to be     #
+    # Pythonic, this is an IngredientRecord holding where each part sits in    #
+    # the ingredient (ex. record.name = "beef"). The parsing combines using a  #
+    # dependency parser and conceptNet to narrow the name to point to a food.  #
+    # Oddly enough, whether the root is an actual food can be separate from    #
+    # the often correct quantity and measurement parsing. Amounts and units    #
+    # at the start of the ingredient are read by quantities.findQuantity, and  #
+    # the parse tree is only asked for them when that finds nothing.           #
     ############################################################################
+    @instrumented("_ingParse")
     def _ingParse(self):
+        self._parseDocuments()
         for i in range(len(self.recipeData["ingredients"])): # So we can distinguish between different ingredients with the same root
             ing = self.recipeData["ingredients"][i]
-            parsedText = self.nlp(ing)
-            additionalRoot = False # Turns true if the potential for a second root word pops up; semaphore to avoid storing that root word
-            mainToken = None # The actual ingredient name
-            for token in parsedText: # Construct the appropriate predicates
-                if token.dep_ == "ROOT" and not additionalRoot: # Now we can traverse the parse tree
-                    additionalRoot = True
-
-                    # Now let's check if the root word is actually food
-                    if self._isAFood(token.text.lower()):
-                        mainToken = token.text
-                    else: # If this fails, check every word in the sentence for food
-                        for newToken in parsedText:
-                            if self._isAFood(newToken.text.lower()):
-                                mainToken = newToken.text
-                                break # No need to keep going if we've got a food, as what came before the first food term was likely adjectives
-
-                    # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing.
-                    # That said, there is one last check after this
-                    if mainToken is None:
-                        mainToken = token.text
-
-                    # If you get beef sirloin, pork loin/tenderloin, or a kind of stock or broth,
-                    # replace both words (e.g. chicken broth), not just "sirloin" or "broth"
-                    if mainToken in self.replacementGuide["pairedWords"]:
-                        mainToken = ing[ing.index(token) - 1] + " " + token.text
-
-                    # Now assign values based on the ingredient name
-                    dictKey = mainToken + " " + str(i) # This is the key with which all info for this ingredient can be retrieved
-                    self.ingPredicates[dictKey] = dict()
-                    self.ingPredicates[dictKey]["isa"] = mainToken
-                    ing = ing.replace(mainToken, "isa") # Save a "cleaned" version of the sentence
-                    for child in token.children: # Only related words are considered to be useful
-                        requestObj = requests.get("http://api.conceptnet.io/c/en/" + child.text.lower() + "_" + mainToken.lower() + "?offset=0&limit=" + str(self.queryOffset)).json()
-
-                        for edge in requestObj["edges"]: # Check if there are two word phrases like ground beef, so we can make a note of the entire phrase
-                            eachEdge = edge["@id"].split(",") # Look for child.text + " " + token.text isa food
-                            if "isa" in eachEdge[0].lower() and "/" + child.text.lower() + "_" + mainToken.lower() + "/" in eachEdge[1].lower() and "food" in eachEdge[2].lower():
-                                self.ingPredicates[dictKey]["isa"] = child.text + " " + mainToken
-                                ing = ing.replace(child.text + " " + mainToken, "isa")
-                        if any([x.text.isdigit() for x in child.children]): # The measurement and amount, tied together by the parser
-                            for item in child.children:
-                                if item.text.isdigit():
-                                    self.ingPredicates[dictKey]["quantity"] = item.text
-                                    self.ingPredicates[dictKey]["measurement"] = child.text
-                                    ing = ing.replace(item.text, "quantity") # For later use
-                                    ing = ing.replace(child.text, "measurement") # For later use
-                    self.ingPredicates[dictKey]["sentence"] = ing
+            parsedText = self.ingDocs[i]
+            token = self._rootToken(parsedText)
+            if token is not None: # Now we can traverse the parse tree
+                nameSpan = self._findIngredientName(parsedText, token) # The actual ingredient name
+                mainToken = nameSpan.text
+
+                # Now assign values based on the ingredient name, keeping where each one sits in the sentence
+                record = IngredientRecord(ing, mainToken, nameSpan.start_char, nameSpan.end_char)
+                quantity = findQuantity(ing) # Fractions, unicode fractions, ranges and known units, when the ingredient starts with them
+                if quantity is not None:
+                    record.quantityStart, record.quantityEnd = quantity[2], quantity[3]
+                    if quantity[4] is not None and (quantity[6] <= record.nameStart or quantity[5] >= record.nameEnd): # Unless the parser took the unit for the name
+                        record.unitStart, record.unitEnd = quantity[5], quantity[6]
+                for child in token.children: # Only related words are considered to be useful
+                    if nameSpan.start <= child.i < nameSpan.end: # Already part of the name
+                        continue
+                    if self._isAFoodPhrase(child.text, mainToken): # Check if there are two word phrases like ground beef, so we can make a note of the entire phrase
+                        record.name = child.text + " " + mainToken
+                        if child.i == nameSpan.start - 1: # Right in front of the name, so it gets replaced along with it
+                            record.nameStart = child.idx
+                    if quantity is None and any([x.text.isdigit() for x in child.children]): # Otherwise the measurement and amount the parser tied together
+                        for item in child.children:
+                            if item.text.isdigit():
+                                record.quantityStart, record.quantityEnd = item.idx, item.idx + len(item.text)
+                                record.unitStart, record.unitEnd = child.idx, child.idx + len(child.text)
+                self.ingPredicates.append(record)
 
     ############################################################################
     # Name: _isAFood                                                           #
@@ -131,16 +171,21 @@ class Transformer:
     # or not)                                                                  #
     # Returns: Boolean                                                         #
     # Notes: Leverage ConceptNet to see if candidate is a food. Since          #
-    # ConceptNet is not particularly reliable, we also made use of our         #
-    # allFoods set (which was built in __init__). We also collect spices for   #
-    # the transformation to another cuisine.                                   #
+    # ConceptNet is not particularly reliable, we also made use of the foods   #
+    # in our knowledge base. We also collect spices for the transformation to  #
+    # another cuisine.                                                         #
     ############################################################################
+    @instrumented("_isAFood")
     def _isAFood(self, candidate):
-        requestJSON = requests.get("http://api.conceptnet.io/c/en/" + candidate + "?offset=0&limit=" + str(self.queryOffset)).json()
         finalVerdict = False # Is the ingredient a food or not
-        if candidate in self.allFoods: # First check against our set of foods
+        if self._knowledge().isFood(candidate): # First check against the foods we know about
             finalVerdict = True
-        else: # If it's not there, then see if ConceptNet calls it a food
+        elif self.classificationIndex is not None: # The precompiled index answers without going to ConceptNet at all
+            finalVerdict = self.classificationIndex.isFood(candidate)
+            if self.classificationIndex.isSpice(candidate):
+                self.spicesForStyleReplacement.add(candidate)
+        elif self._isLookupWord(candidate): # If it's not there, then see if ConceptNet calls it a food
+            requestJSON = self.conceptNet.query(candidate)
             for edge in requestJSON["edges"]:
                 eachEdge = edge["@id"].split(",")
                 if "isa" in eachEdge[0].lower() and "/" + candidate.lower() + "/" in eachEdge[1].lower() and "/food" in eachEdge[2].lower():
@@ -149,6 +194,144 @@ class Transformer:
                     self.spicesForStyleReplacement.add(candidate)
         return finalVerdict
 
+    ############################################################################
+    # Name: _isAFoodPhrase                                                     #
+    # Params: firstWord, secondWord (e.g. "ground" and "beef")                 #
+    # Returns: Boolean                                                         #
+    # Notes: Checks whether the two words together are a food in their own     #
+    # right, which is how we catch things like "ground beef" or "chicken       #
+    # broth".                                                                  #
+    ############################################################################
+    @instrumented("_isAFoodPhrase")
+    def _isAFoodPhrase(self, firstWord, secondWord):
+        if self.classificationIndex is not None:
+            return self.classificationIndex.isFoodPhrase(firstWord, secondWord)
+        if not self._isLookupWord(firstWord):
+            return False
+
+        phrase = firstWord.lower() + "_" + secondWord.lower()
+        requestObj = self.conceptNet.query(phrase)
+        for edge in requestObj["edges"]:
+            eachEdge = edge["@id"].split(",") # Look for firstWord + " " + secondWord isa food
+            if "isa" in eachEdge[0].lower() and "/" + phrase + "/" in eachEdge[1].lower() and "food" in eachEdge[2].lower():
+                return True
+        return False
+
+    ############################################################################
+    # Name: _isLookupWord                                                      #
+    # Params: text (one word as the parser split it)                           #
+    # Returns: Boolean                                                         #
+    # Notes: Whether the word is worth asking ConceptNet about: only letters,  #
+    # and not a number word like "two" (spaCy's is_alpha and like_num).        #
+    # _prefetchConcepts and every lookup use this same test, so anything the   #
+    # prefetch skips is never looked up later one request at a time.           #
+    ############################################################################
+    def _isLookupWord(self, text):
+        return text.isalpha() and not self.nlp.vocab[text].like_num
+
+    ############################################################################
+    # Name: _rootToken                                                         #
+    # Params: parsedText (a spaCy Doc)                                         #
+    # Returns: spaCy Token, or None                                            #
+    # Notes: If you have multiple root words, go with the first one. The first #
+    # one (reading left-to-right) is usually what you want.                    #
+    ############################################################################
+    def _rootToken(self, parsedText):
+        for token in parsedText:
+            if token.dep_ == "ROOT":
+                return token
+        return None
+
+    ############################################################################
+    # Name: _findIngredientName                                                #
+    # Params: parsedText (a spaCy Doc), rootToken (its root word)              #
+    # Returns: spaCy Span                                                      #
+    # Notes: Picks the word (or pair of words) that names the ingredient.      #
+    # Shared by _ingParse and _prefetchConcepts so both agree on which phrases #
+    # get looked up.                                                           #
+    ############################################################################
+    def _findIngredientName(self, parsedText, rootToken):
+        foodToken = None
+        # Now let's check if the root word is actually food
+        if self._isAFood(rootToken.text.lower()):
+            foodToken = rootToken
+        else: # If this fails, check every word in the sentence for food
+            for newToken in parsedText:
+                if self._isAFood(newToken.text.lower()):
+                    foodToken = newToken
+                    break # No need to keep going if we've got a food, as what came before the first food term was likely adjectives
+
+        # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing.
+        # That said, there is one last check after this
+        if foodToken is None:
+            foodToken = rootToken
+
+        # If you get beef sirloin, pork loin/tenderloin, or a kind of stock or broth,
+        # replace both words (e.g. chicken broth), not just "sirloin" or "broth"
+        if self._knowledge().isIn(foodToken.text, "pairedWords") and foodToken.i > 0:
+            return parsedText[foodToken.i - 1:foodToken.i + 1]
+        return parsedText[foodToken.i:foodToken.i + 1]
+
+    ############################################################################
+    # Name: _findActionToken                                                   #
+    # Params: parsedText (a spaCy Doc), rootToken (its root word)              #
+    # Returns: spaCy Token                                                     #
+    # Notes: Same idea as _findIngredientName, but for the primary method of   #
+    # an instruction.                                                          #
+    ############################################################################
+    def _findActionToken(self, parsedText, rootToken):
+        if self._isAnAction(rootToken.text): # Now let's check if the root word is actually a verb
+            return rootToken
+        for newToken in parsedText: # If the above fails, check every word in the sentence for the first verb that is an action
+            if self._isAnAction(newToken.text):
+                return newToken
+
+        # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing
+        return rootToken
+
+    ############################################################################
+    # Name: _prefetchConcepts                                                  #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Collects every ConceptNet concept the two parsers are going to    #
+    # ask about and resolves them all up front in concurrent batches, so the   #
+    # parsers only ever hit the cache. This takes two rounds, since the        #
+    # two-word phrases we check depend on which word turned out to be the      #
+    # food.                                                                    #
+    ############################################################################
+    @instrumented("_prefetchConcepts")
+    def _prefetchConcepts(self):
+        if self.classificationIndex is not None: # Nothing to fetch when the index answers everything
+            return
+
+        self._parseDocuments()
+
+        # First round: every single word that _isAFood, _isAnAction and _isACookingTool might look up. Punctuation
+        # and amounts never are (see _isLookupWord), and at a couple of requests a second they would be most of the wait
+        knowledgeBase = self._knowledge()
+        terms = set()
+        for parsedText in self.ingDocs:
+            for token in parsedText:
+                if self._isLookupWord(token.text) and not knowledgeBase.isFood(token.text):
+                    terms.add(token.text.lower())
+        for parsedText in self.instDocs:
+            for token in parsedText:
+                if self._isLookupWord(token.text) and not knowledgeBase.isCookingVerb(token.text):
+                    terms.add(token.text.lower())
+            rootToken = self._rootToken(parsedText)
+            if rootToken is not None:
+                terms.update(child.text for child in rootToken.children if self._isLookupWord(child.text))
+        self.conceptNet.prefetch(terms)
+
+        # Second round: the two-word phrases, now that finding the food is all cache hits
+        phrases = set()
+        for parsedText in self.ingDocs:
+            rootToken = self._rootToken(parsedText)
+            if rootToken is not None:
+                mainToken = self._findIngredientName(parsedText, rootToken).text
+                phrases.update(child.text.lower() + "_" + mainToken.lower() for child in rootToken.children if self._isLookupWord(child.text))
+        self.conceptNet.prefetch(phrases)
+
     ############################################################################
     # Name: _instParse                                                         #
     # Params: None                                                             #
@@ -159,38 +342,22 @@ class Transformer:
     # lot more here. Parsing instructions seems a lot more difficult than      #
     # parsing ingredients.                                                     #
     ############################################################################
+    @instrumented("_instParse")
     def _instParse(self):
+        self._parseDocuments()
         for i in range(len(self.recipeData["instructions"])):
             inst = self.recipeData["instructions"][i]
-            parsedText = self.nlp(inst)
-            additionalRoot = False # Turns true if the potential for a second root word pops up; semaphore to avoid storing that root word
-            mainToken = None # This is the root word that turns into the primary method
-            for token in parsedText:
-                if token.dep_ == "ROOT" and not additionalRoot: # If you have multiple root words, go with the first one
-                    additionalRoot = True # So we don't end up checking more root words - the first one (reading left-to-right) is usually what you want
-
-                    if self._isAnAction(token.text): # Now let's check if the root word is actually a verb
-                        mainToken = token.text
-                    else: # If the above fails, check every word in the sentence for the first verb that is an action
-                        for newToken in parsedText:
-                            if self._isAnAction(newToken.text) and mainToken is None:
-                                mainToken = newToken.text
-
-                    # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing
-                    if mainToken is None:
-                        mainToken = token.text
-
-                    # Now we can assign the primary method and get a cooking tool for it
-                    self.instPredicates[mainToken + str(i)] = dict()
-                    self.instPredicates[mainToken + str(i)]["primaryMethod"] = mainToken
-                    inst = inst.replace(mainToken, "primaryMethod")
-                    for child in token.children: # Now we start relying on ConceptNet to check if any of these children are cooking tools
-                        requestObj = requests.get("http://api.conceptnet.io/c/en/" + child.text + "?offset=0&limit=" + str(self.queryOffset)).json()
-                        for edge in requestObj["edges"]:
-                            if "usedfor" in edge["@id"].lower() and edge["end"]["label"].lower() == "cook":
-                                self.instPredicates[mainToken + str(i)]["toolFor"] = child.text
-                                inst = inst.replace(child.text, "toolFor")
-                    self.instPredicates[mainToken + str(i)]["sentence"] = inst
+            parsedText = self.instDocs[i]
+            token = self._rootToken(parsedText)
+            if token is not None:
+                mainToken = self._findActionToken(parsedText, token) # This is the root word that turns into the primary method
+
+                # Now we can assign the primary method and get a cooking tool for it
+                record = InstructionRecord(inst, mainToken.idx, mainToken.idx + len(mainToken.text))
+                for child in token.children: # Now we start relying on ConceptNet to check if any of these children are cooking tools
+                    if self._isACookingTool(child.text):
+                        record.toolStart, record.toolEnd = child.idx, child.idx + len(child.text)
+                self.instPredicates.append(record)
 
     ############################################################################
     # Name: _isAnAction                                                        #
@@ -199,11 +366,14 @@ class Transformer:
     # Notes: Similar to _isAFood. This is just for the primaryMethod and       #
     # checks for verbs.                                                        #
     ############################################################################
+    @instrumented("_isAnAction")
     def _isAnAction(self, candidate):
-        requestJSON = requests.get("http://api.conceptnet.io/c/en/" + candidate.lower() + "?offset=0&limit=" + str(self.queryOffset)).json()
-        if candidate.lower() in self.cookingVerbs: # Since ConceptNet can be bad at detecting what is a verb
+        if self._knowledge().isCookingVerb(candidate): # Since ConceptNet can be bad at detecting what is a verb
             return True
-        else:
+        elif self.classificationIndex is not None:
+            return self.classificationIndex.isVerb(candidate)
+        elif self._isLookupWord(candidate):
+            requestJSON = self.conceptNet.query(candidate.lower())
             for edge in requestJSON["edges"]:
                 eachEdge = edge["@id"].split(",") # Check if this word is ever used as a verb
                 if "mannerof" in eachEdge[0].lower() and ("/" + candidate.lower() + "/v/" in eachEdge[1].lower() or \
@@ -211,6 +381,26 @@ class Transformer:
                     return True
         return False
 
+    ############################################################################
+    # Name: _isACookingTool                                                    #
+    # Params: candidate (a word from an instruction)                           #
+    # Returns: Boolean                                                         #
+    # Notes: Similar to _isAnAction, but checks whether ConceptNet says the    #
+    # word is used for cooking.                                                #
+    ############################################################################
+    @instrumented("_isACookingTool")
+    def _isACookingTool(self, candidate):
+        if self.classificationIndex is not None:
+            return self.classificationIndex.isCookingTool(candidate)
+        if not self._isLookupWord(candidate):
+            return False
+
+        requestObj = self.conceptNet.query(candidate)
+        for edge in requestObj["edges"]:
+            if "usedfor" in edge["@id"].lower() and edge["end"]["label"].lower() == "cook":
+                return True
+        return False
+
     ############################################################################
     # Name: _decideTransformation                                              #
     # Params: None                                                             #
@@ -222,14 +412,51 @@ class Transformer:
         self.transformationType = input("""What would you like us to transform the given dish into?\n\nPlease enter one of the options below:
         - \"to vegetarian\" or \"from vegetarian\"
         - \"to healthy\" or \"from healthy\"
-        - \"to Mexican\"\nEnter choice here: """).lower()
-
-        allTypes = ["to vegetarian", "to healthy", "from vegetarian", "from healthy", "to mexican"]
+        - \"to Mexican\", \"to Italian\" or \"to Indian\"\nEnter choice here: """).lower()
 
-        while not self.transformationType in allTypes:
+        while not self.transformationType in self.transformationTypes:
             self.transformationType = input("\nI'm sorry, it looks like that was not a valid transformation. Could you please review the list of transformations and input again? We do need you to input the exact phrases above: ").lower()
         print("\nSo we are going to be transforming " + self.recipeData["recipeName"] + " in accordance with the \"" + self.transformationType + "\" option.")
 
+    ############################################################################
+    # Name: _knowledge                                                         #
+    # Params: None                                                             #
+    # Returns: knowledgeBase.KnowledgeBase                                     #
+    # Notes: Loads (and if need be compiles) knowledgeBase.json the first time #
+    # any Transformer needs it. Set Transformer.knowledgeBase beforehand to    #
+    # use a different one.                                                     #
+    ############################################################################
+    def _knowledge(self):
+        if type(self).knowledgeBase is None:
+            type(self).knowledgeBase = loadKnowledgeBase()
+        return type(self).knowledgeBase
+
+    ############################################################################
+    # Name: _rules                                                             #
+    # Params: None                                                             #
+    # Returns: transformationRules.RuleIndex                                   #
+    # Notes: Compiles the rule table against the knowledge base the first time #
+    # any Transformer needs it; after that every instance shares the one       #
+    # index.                                                                   #
+    ############################################################################
+    def _rules(self):
+        if self.ruleIndex is None:
+            type(self).ruleIndex = RuleIndex(self._knowledge(), TRANSFORMATION_RULES)
+        return self.ruleIndex
+
+    ############################################################################
+    # Name: useRules                                                           #
+    # Params: transformationRules (like TRANSFORMATION_RULES, e.g. a copy with #
+    # a rule edited)                                                           #
+    # Returns: None                                                            #
+    # Notes: Gives this Transformer alone its own rule table, for trying out   #
+    # rule changes. The parse and everything rendered so far are kept, so the  #
+    # next transform only redoes the lines the new rules change.               #
+    ############################################################################
+    def useRules(self, transformationRules):
+        self.ruleIndex = RuleIndex(self._knowledge(), transformationRules)
+        self.transformationTypes = list(transformationRules)
+
     ############################################################################
     # Name: _ingTransformation                                                 #
     # Params: None                                                             #
@@ -237,75 +464,34 @@ class Transformer:
     # Notes: Transform the ingredients in accordance with the transformation   #
     # the user specified. We also store a mapping between the old ingredients  #
     # and their transformed values to make the instruction transformation      #
-    # easier (this is what self.transformedIng is for).                        #
+    # easier (this is what self.transformedIng is for). What gets replaced by  #
+    # what is spelled out in transformationRules.TRANSFORMATION_RULES. An      #
+    # ingredient whose replacement was rendered before is not rendered again.  #
+    # With a similarityIndex, rules that pick from a list pick whatever suits  #
+    # this recipe best instead of picking at random.                           #
     ############################################################################
+    @instrumented("_ingTransformation")
     def _ingTransformation(self):
-        for ing in self.ingPredicates.keys():
-            allRelevantPred = self.ingPredicates[ing]
-            finalSent = allRelevantPred["sentence"]
-
-            # Now for types of transformations
-            if self.transformationType == "to vegetarian": # The use of "any" below is due to ingredient names like "ground beef" where "beef" is the only word in our dict
-                if any([x in self.replacementGuide["meatProtein"] for x in allRelevantPred["isa"].split(" ")]): # If you found a meat protein
-                    finalSent = finalSent.replace("isa", self.replacementGuide["vegProtein"][0]) # Then tofu is pretty much the go-to replacement
-                    self.transformedIng[allRelevantPred["isa"]] = self.replacementGuide["vegProtein"][0] # Keep track of the transformed ingredients
-                elif any([x in self.replacementGuide["pairedWords"] for x in allRelevantPred["isa"].split(" ")]): # Quick substitution for the liquids
-                    if not "sauce" in allRelevantPred["isa"]: # Sauce is a bit of a special case
-                        finalSent = finalSent.replace("isa", "vegetable broth") # Then vegetable broth is pretty much the go-to replacement (reference: https://www.myfrugalhome.com/broth-substitutes/)
-                        self.transformedIng[allRelevantPred["isa"]] = "vegetable broth" # Keep track of the transformed ingredients
-                    else:
-                        finalSent = finalSent.replace("isa", "soy sauce") # Soy sauce seems reasonable (reference: https://food52.com/blog/24403-best-worcestershire-sauce-substitutes)
-                        self.transformedIng[allRelevantPred["isa"]] = "soy sauce" # Keep track of the transformed ingredients
-
-            elif self.transformationType == "to healthy":
-                if any([item in self.replacementGuide["unhealthy"] for item in allRelevantPred["isa"].split(" ")]) and \
-                any([x in self.replacementGuide["meatProtein"] for x in allRelevantPred["isa"].split(" ")]): # Found an unhealthy meat protein
-                    meatReplacementOptions = list(set(self.replacementGuide["meatProtein"]).intersection(set(self.replacementGuide["healthy"])))
-                    replaceWith = meatReplacementOptions[random.randrange(len(meatReplacementOptions))] # Make a random healthy meat the replacement
-                    finalSent = finalSent.replace("isa", replaceWith)
-                    self.transformedIng[allRelevantPred["isa"]] = replaceWith # Keep track of the transformed ingredients
-                elif any([item in self.replacementGuide["unhealthy"] for item in allRelevantPred["isa"].split(" ")]) and \
-                not any([x in self.replacementGuide["meatProtein"] for x in allRelevantPred["isa"].split(" ")]): # Found an unhealthy non-meat protein (butter for us)
-                    finalSent = finalSent.replace("isa", "coconut oil")
-                    self.transformedIng[allRelevantPred["isa"]] = "coconut oil" # Keep track of the transformed ingredients
-
-            elif self.transformationType == "from healthy":
-                if any([item in self.replacementGuide["healthy"] for item in allRelevantPred["isa"].split(" ")]) and \
-                any([x in self.replacementGuide["meatProtein"] for x in allRelevantPred["isa"].split(" ")]): # If we found a healthy meat
-                    meatReplacementOptions = list(set(self.replacementGuide["meatProtein"]).intersection(set(self.replacementGuide["unhealthy"])))
-                    replaceWith = meatReplacementOptions[random.randrange(len(meatReplacementOptions))] # Make a random unhealthy meat the replacement
-                    finalSent = finalSent.replace("isa", replaceWith)
-                    self.transformedIng[allRelevantPred["isa"]] = replaceWith # Keep track of the transformed ingredients
-                elif any([item in self.replacementGuide["healthy"] for item in allRelevantPred["isa"].split(" ")]) and \
-                not any([x in self.replacementGuide["meatProtein"] for x in allRelevantPred["isa"].split(" ")]): # Found a healthy non-meat? (No use for now)
-                    print("No non-meat unhealthy substitutes.") # This is a just-in-case
-                    finalSent = finalSent.replace("isa", allRelevantPred["isa"])
-
-            elif self.transformationType == "from vegetarian":
-                if any([item == "tofu" for item in allRelevantPred["isa"].split(" ")]): # If tofu ever shows up, replace it with a meat protein
-                    finalSent = finalSent.replace("isa", "chicken") # Chicken works for pretty much anywhere tofu would show up
-                    self.transformedIng[allRelevantPred["isa"]] = "chicken" # Keep track of the transformed ingredients
-
-            elif self.transformationType == "to Mexican":
-                if any([item in self.styleReplacementGuide["Mexican"] for item in allRelevantPred["isa"].split(" ")]): # If any of these are to be replaced
-                    for item in allRelevantPred["isa"].split(" "):
-                        if item in self.styleReplacementGuide["Mexican"]: # Because we need the right key (just "cheese", not "grated cheese")
-                            finalSent = finalSent.replace("isa", self.styleReplacementGuide["Mexican"][item]) # Replace the ingredient with its Mexican equivalent
-                            self.transformedIng[allRelevantPred["isa"]] = self.styleReplacementGuide["Mexican"][item] # Keep track of the transformed ingredients
-                elif any([item in self.spicesForStyleReplacement for item in allRelevantPred["isa"].split(" ")]): # If any of these are a spice to be replaced
-                    replacementSpice = self.styleReplacementGuide["Mexican"]["spices"][random.randrange(len(self.styleReplacementGuide["Mexican"]["spices"]))] # Pick a random replacement spice
-                    finalSent = finalSent.replace("isa", replacementSpice) # Replace the ingredient with its Mexican equivalent spice
-                    self.transformedIng[allRelevantPred["isa"]] = replacementSpice # Keep track of the transformed ingredients
-
-            if allRelevantPred["isa"] not in self.transformedIng.keys(): # If the ingredient was not replaced, then leave it alone
-                finalSent = finalSent.replace("isa", allRelevantPred["isa"])
-            if "quantity" in allRelevantPred.keys():
-                finalSent = finalSent.replace("quantity", allRelevantPred["quantity"])
-            if "measurement" in allRelevantPred.keys():
-                finalSent = finalSent.replace("measurement", allRelevantPred["measurement"])
-
-            # Now we can collect the finalized instruction
-            self.finalIng.append(finalSent)
+        rules = self._rules()
+        chooser = None
+        if self.similarityIndex is not None: # The best fit for the rest of the recipe rather than a random pick
+            context = [record.name for record in self.ingPredicates]
+            chooser = lambda choices, ingredient: self.similarityIndex.choose(choices, ingredient, context)
+        for i in range(len(self.ingPredicates)):
+            record = self.ingPredicates[i]
+            # Classify the ingredient once; the first rule for this transformation that matches it decides its replacement
+            rule, replacement = rules.replacementFor(self.transformationType, record.name, self.spicesForStyleReplacement, self.rng, chooser)
+            if rule is not None and "warning" in rule:
+                print(rule["warning"], file = sys.stderr) # This is a just-in-case
+            if replacement is not None:
+                self.transformedIng[record.name] = replacement # Keep track of the transformed ingredients
+
+            # Only the name is swapped out; the quantity, measurement and everything else stay as written
+            key = (i, self.transformedIng.get(record.name))
+            line = self.ingLines.get(key)
+            if line is None:
+                line = self.ingLines[key] = record.render(name = key[1])
+            self.finalIng.append(line)
 
     ############################################################################
     # Name: _instTransformation                                                #
@@ -313,67 +499,80 @@ class Transformer:
     # Returns: None                                                            #
     # Notes: Using the transformed ingredients from before                     #
     # (self.transformedIng), we transform the ingredients into their           #
-    # appropriate versions within the instructions.                            #
+    # appropriate versions within the instructions. The matching itself is     #
+    # done by substitution.SubstitutionMatcher in one pass per instruction.    #
+    # The primary method and tool are left exactly as written. An instruction  #
+    # only depends on the substitutions for the ingredients it mentions (and   #
+    # the dropped words), so one whose substitutions are the same as in an     #
+    # earlier transformation is not rewritten again.                           #
     ############################################################################
+    @instrumented("_instTransformation")
     def _instTransformation(self):
-        for inst in self.instPredicates.keys():
-            finalInst = self.instPredicates[inst]["sentence"] # This is the sentence that goes through the cascade of transformation
-
-            # First replace the ingredient if needed
-            # Now to make the code easier and less subtle, there are two loops
-            for oldIng in self.transformedIng:
-                # If an entire phrase is in the original instruction and it is something that needs to be replaced
-                if len(oldIng.split(" ")) > 1 and all([x.lower() in finalInst.lower() for x in oldIng.split(" ")]):
-                    finalInst = finalInst.replace(oldIng, self.transformedIng[oldIng])
-                    finalInst = finalInst.replace(oldIng.lower(), self.transformedIng[oldIng])
-
-            # Now we handle individual words that show up in the original
-            for oldIng in self.transformedIng:
-                if oldIng.lower() in finalInst.lower() or any([x.lower() in finalInst.lower() for x in oldIng.split(" ")]):
-                    if len(oldIng) > 1: # If the "any" part of the above clause was what caused the condition to trigger
-                        # Then we need to iterate over those values to make sure any mention of that ingredient gets replaced
-                        for ing in oldIng.split(" "): # You may have an uppercase or lowercase version of the ingredient in the sentence
-                            if ing not in self.transformedIng[oldIng]: # Avoid extra replacing
-                                finalInst = finalInst.replace(ing, self.transformedIng[oldIng])
-                                finalInst = finalInst.replace(ing.lower(), self.transformedIng[oldIng])
-                    else:
-                        finalInst = finalInst.replace(oldIng, self.transformedIng[oldIng])
-                        finalInst = finalInst.replace(oldIng.lower(), self.transformedIng[oldIng])
-
-            # A note on why there are two loops above:
-            # There are cases where if you mention "beef stock", you would get "beef" replaced (as an individual word), and then "stock" replaced.
-            # The appropriate placement is tofu, but the instruction would now become "...tofu tofu..."
-            # Thus, instead of writing potentially subtle and hard to debug code, two loops were written. The first catches "chunks" like
-            # "beef stock", while the second then takes care of stragglers, so to speak.
-
-            # Get rid of the word meat if we're transforming to a vegetarian recipe
-            if self.transformationType == "to vegetarian" and "meat" in finalInst:
-                finalInst = finalInst.replace("meat ", "")
-
-            # Now substitute the primary method
-            finalInst = finalInst.replace("primaryMethod", self.instPredicates[inst]["primaryMethod"])
-
-            # Substituting the tool used, though we need to make sure it was found first
-            if "toolFor" in self.instPredicates[inst].keys():
-                finalInst = finalInst.replace("toolFor", self.instPredicates[inst]["toolFor"])
-
-            # Now we put back together the "cleaned" instruction
-            self.finalInst.append(finalInst)
+        droppedWords = tuple(self._rules().droppedWords(self.transformationType))
+        dependencies = self._instructionDependencies()
+
+        for i in range(len(self.instPredicates)):
+            substitutions = tuple((name, replacement) for name, replacement in self.transformedIng.items() if name in dependencies[i])
+            key = (i, substitutions, droppedWords)
+            line = self.instLines.get(key)
+            recordCacheLookup("instructionLines", line is not None)
+            if line is None:
+                # Everything around the primary method and tool goes through the cascade of transformation
+                line = self.instLines[key] = self.instPredicates[i].render(self._rewriter(substitutions, droppedWords))
+            self.finalInst.append(line)
 
         # If we are doing a style transformation, there's a small extra step
-        if (self.transformationType == "to mexican"):
-            self._instTransformationForStyle()
+        style = self._rules().style(self.transformationType)
+        if style is not None:
+            self._instTransformationForStyle(style)
 
     ############################################################################
-    # Name: _instTransformationForStyle                                        #
+    # Name: _instructionDependencies                                           #
     # Params: None                                                             #
+    # Returns: List with the set of ingredient names each instruction mentions #
+    # Notes: Worked out once per parse (see                                    #
+    # substitution.referencedIngredients).                                     #
+    ############################################################################
+    def _instructionDependencies(self):
+        if self.instDependencies is None:
+            names = set(record.name for record in self.ingPredicates)
+            self.instDependencies = [referencedIngredients(record.text, names) for record in self.instPredicates]
+        return self.instDependencies
+
+    ############################################################################
+    # Name: _rewriter                                                          #
+    # Params: substitutions (tuple of (ingredient, replacement) pairs),        #
+    # droppedWords (tuple of strings)                                          #
+    # Returns: Function from a stretch of instruction text to its rewritten    #
+    # form                                                                     #
+    # Notes: The matcher for each set of substitutions is compiled once and    #
+    # kept.                                                                    #
+    ############################################################################
+    def _rewriter(self, substitutions, droppedWords):
+        matcher = self.matchers.get(substitutions)
+        if matcher is None:
+            matcher = self.matchers[substitutions] = SubstitutionMatcher(dict(substitutions))
+
+        def rewrite(text):
+            # First replace the ingredients; whole phrases like "beef stock" take priority over their single words
+            text = matcher.substitute(text)
+
+            # Get rid of words that no longer apply (like "meat" if we're transforming to a vegetarian recipe)
+            for word in droppedWords:
+                text = text.replace(word, "")
+            return text
+        return rewrite
+
+    ############################################################################
+    # Name: _instTransformationForStyle                                        #
+    # Params: style (a cuisine in the knowledge base, like "Mexican")          #
     # Returns: None                                                            #
     # Notes: Check if any of the style transformation spices ended up not      #
     # getting mentioned in the ingredients. If they did, do nothing, else      #
     # add an extra step to toss those in.                                      #
     ############################################################################
-    def _instTransformationForStyle(self):
-        for spice in self.styleReplacementGuide["Mexican"]["spices"]:
+    def _instTransformationForStyle(self, style):
+        for spice in self._knowledge().spicesFor(style):
             alreadyAdded = False
 
             # Check if the spice was already substituted in
@@ -411,28 +610,407 @@ class Transformer:
             print(str(i + 1) + ". " + self.finalInst[i])
 
     ############################################################################
-    # Name: transform                                                          #
+    # Name: _parse                                                             #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Builds the predicates the first time it is called and does        #
+    # nothing after that, so any number of transformations can run off one     #
+    # parse. A recipe found in the parse cache is not parsed at all, and a     #
+    # fresh parse is added to it.                                              #
+    ############################################################################
+    def _parse(self):
+        if not self.parsed and not self._loadCachedParse():
+            self._prefetchConcepts() # Fetch everything ConceptNet needs to tell us in one go
+            self._ingParse()
+            self._instParse()
+            if self.parseCache is not None:
+                self.parseCache.put(self._parseKey(), [record.toList() for record in self.ingPredicates],
+                [record.toList() for record in self.instPredicates], self.spicesForStyleReplacement)
+        self.parsed = True
+
+    ############################################################################
+    # Name: _parseKey                                                          #
+    # Params: None                                                             #
+    # Returns: String                                                          #
+    # Notes: The parse cache key for this recipe. Besides the recipe itself it #
+    # covers the parser version, the spaCy model, the knowledge base, and      #
+    # whichever classifier answers the food/verb/tool questions (for           #
+    # ConceptNet, which server or dump index), so changing any of them misses  #
+    # the cache.                                                               #
+    ############################################################################
+    def _parseKey(self):
+        versions = ["parser " + str(PARSE_VERSION), NLP_MODEL, "knowledge " + self._knowledge().metadata["sourceHash"]]
+        if self.classificationIndex is not None:
+            versions.append("classification " + self.classificationIndex.fingerprint)
+        else:
+            versions.append("conceptnet " + self.conceptNet.fingerprint()) # The HTTP API and each dump classify words a little differently
+        return parseKey(self.recipeData, versions)
+
+    ############################################################################
+    # Name: _loadCachedParse                                                   #
+    # Params: None                                                             #
+    # Returns: Boolean (whether the parse came from the cache)                 #
+    # Notes: Fills in the predicates and spices straight from the parse cache, #
+    # so neither spaCy nor ConceptNet is needed for a recipe we have seen      #
+    # before. Called by parseRecipes as well, outside of transform, so it      #
+    # counts its own cache hit or miss.                                        #
+    ############################################################################
+    def _loadCachedParse(self):
+        if self.parseCache is None:
+            return False
+        with self._collecting():
+            cached = self.parseCache.get(self._parseKey())
+            recordCacheLookup("parseCache", cached is not None)
+        if cached is None:
+            return False
+        self.ingPredicates = [IngredientRecord.fromList(fields) for fields in cached["ingPredicates"]]
+        self.instPredicates = [InstructionRecord.fromList(fields) for fields in cached["instPredicates"]]
+        self.spicesForStyleReplacement = set(cached["spices"])
+        self.parsed = True
+        return True
+
+    ############################################################################
+    # Name: _resetTransformation                                               #
     # Params: None                                                             #
     # Returns: None                                                            #
+    # Notes: Clears out whatever the previous transformation left behind,      #
+    # since _ingTransformation and _instTransformation only ever add to these. #
+    # The lines rendered for earlier transformations are kept for reuse.       #
+    ############################################################################
+    def _resetTransformation(self):
+        self.transformedIng = dict()
+        self.finalIng = list()
+        self.finalInst = list()
+
+    ############################################################################
+    # Name: transform                                                          #
+    # Params: transformationType (one of transformationTypes, or None to ask   #
+    # the user)                                                                #
+    # Returns: TransformationResult                                            #
     # Notes: This is really the entire spindle (i.e. function that ties        #
-    # everything together). Putting this documentation block here for          #
-    # consistency.                                                             #
+    # everything together). With no transformationType we ask the user and     #
+    # print the result like always; otherwise nothing is asked or printed and  #
+    # the caller just gets the result back.                                    #
     ############################################################################
-    def transform(self):
-        # First build the data structures
-        newTransformer._ingParse()
-        newTransformer._instParse()
+    def transform(self, transformationType = None):
+        with self._collecting():
+            return self._transform(transformationType)
 
-        # Now we alert the user to what they decided to do
-        self._decideTransformation()
+    ############################################################################
+    # Name: _transform                                                         #
+    # Params: transformationType (as for transform)                            #
+    # Returns: TransformationResult                                            #
+    # Notes: The body of transform, timed as the "transform" stage.            #
+    ############################################################################
+    @instrumented("transform")
+    def _transform(self, transformationType):
+        # First build the data structures (only the first call actually parses)
+        self._parse()
+
+        if transformationType is None:
+            # Now we alert the user to what they decided to do
+            self._decideTransformation()
+        elif transformationType.lower() in self.transformationTypes:
+            self.transformationType = transformationType.lower()
+        else:
+            raise ValueError("Unknown transformation \"" + transformationType + "\"; expected one of " + ", ".join(self.transformationTypes))
 
+        self._resetTransformation()
         self._ingTransformation()
         self._instTransformation()
 
-        self._printNewIngredients()
-        self._printNewInstructions()
+        if transformationType is None:
+            self._printNewIngredients()
+            self._printNewInstructions()
+
+        return TransformationResult(self.recipeData["recipeName"], self.transformationType, self.finalIng, self.finalInst, self.transformedIng)
+
+    ############################################################################
+    # Name: transformAll                                                       #
+    # Params: transformationTypes (list of transformations, or None for all of #
+    # them)                                                                    #
+    # Returns: List of TransformationResult                                    #
+    # Notes: Parses once, then runs every transformation against the same      #
+    # predicates.                                                              #
+    ############################################################################
+    def transformAll(self, transformationTypes = None):
+        if transformationTypes is None:
+            transformationTypes = self.transformationTypes
+        return [self.transform(transformationType) for transformationType in transformationTypes]
+
+    ############################################################################
+    # Name: profileConflicts                                                   #
+    # Params: profile (a dietary profile in the knowledge base, like "vegan")  #
+    # Returns: List of ingredient names the profile avoids                     #
+    # Notes: Parses the recipe if that has not happened yet. An empty list     #
+    # means the recipe already fits the profile.                               #
+    ############################################################################
+    def profileConflicts(self, profile):
+        with self._collecting():
+            self._parse()
+        knowledgeBase = self._knowledge()
+        conflicts = []
+        for record in self.ingPredicates:
+            if any(knowledgeBase.avoids(profile, word) for word in record.name.split(" ")) and record.name not in conflicts:
+                conflicts.append(record.name)
+        return conflicts
+
+    ############################################################################
+    # Name: scaledIngredients                                                  #
+    # Params: factor (multiply every amount by this), system ("metric",        #
+    # "imperial", or None to keep the units)                                   #
+    # Returns: List of ingredient strings, one per ingredient in ingPredicates #
+    # Notes: Parses the recipe if that has not happened yet. For many recipes  #
+    # at once, use quantities.scaleRecipes or QuantityColumns directly.        #
+    ############################################################################
+    def scaledIngredients(self, factor = 1.0, system = None):
+        with self._collecting():
+            self._parse()
+        columns = QuantityColumns.fromRecords([self.ingPredicates]).scaled(factor)
+        if system is not None:
+            columns = columns.converted(system)
+        return columns.rendered()
+
+    ############################################################################
+    # Name: _collecting                                                        #
+    # Params: None                                                             #
+    # Returns: A metrics.collecting context manager                            #
+    # Notes: Makes this recipe's metrics the current collector. Without any    #
+    # (collectMetrics is off) whatever collector was already current stays so. #
+    ############################################################################
+    def _collecting(self):
+        return collecting(self.metrics if self.metrics is not None else currentCollector())
+
+class TransformationResult:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: recipeName, transformationType, ingredients and instructions     #
+    # (the transformed lists), substitutions (dict of original ingredient ->   #
+    # replacement)                                                             #
+    # Returns: None                                                            #
+    # Notes: What transform hands back. Copies the lists so later              #
+    # transformations on the same Transformer cannot change it.                #
+    ############################################################################
+    def __init__(self, recipeName, transformationType, ingredients, instructions, substitutions):
+        self.recipeName = recipeName
+        self.transformationType = transformationType
+        self.ingredients = list(ingredients)
+        self.instructions = list(instructions)
+        self.substitutions = dict(substitutions)
+
+    ############################################################################
+    # Name: toJSON                                                             #
+    # Params: None                                                             #
+    # Returns: Dict                                                            #
+    # Notes: A JSON-serializable version of the result.                        #
+    ############################################################################
+    def toJSON(self):
+        return {"recipeName": self.recipeName, "transformationType": self.transformationType,
+        "ingredients": self.ingredients, "instructions": self.instructions, "substitutions": self.substitutions}
+
+################################################################################
+# Name: parseRecipes                                                           #
+# Params: transformers (list of Transformer objects), nProcess (number of      #
+# processes spaCy may use), batchSize (strings per spaCy batch)                #
+# Returns: None                                                                #
+# Notes: Parses the ingredients and instructions of many recipes in one        #
+# nlp.pipe call and hands each Transformer its Docs. With nProcess > 1, spaCy  #
+# spreads the batches over several cores. Recipes already in the parse cache   #
+# are filled in from there and skip spaCy altogether.                          #
+################################################################################
+@instrumented("parseRecipes")
+def parseRecipes(transformers, nProcess = 1, batchSize = Transformer.pipeBatchSize):
+    transformers = [newTransformer for newTransformer in transformers if not newTransformer.parsed and not newTransformer._loadCachedParse()]
+    if not transformers: # Everything came from the cache, so there is no need to even load spaCy
+        return
+    texts = []
+    for t in range(len(transformers)):
+        for key in ("ingredients", "instructions"):
+            for text in transformers[t].recipeData[key]:
+                texts.append((text, (t, key)))
+
+    parsed = dict() # (transformer index, key) -> list of Docs in order
+    for doc, context in loadNLP().pipe(texts, as_tuples = True, n_process = nProcess, batch_size = batchSize):
+        parsed.setdefault(context, []).append(doc)
+
+    for t in range(len(transformers)):
+        transformers[t].ingDocs = parsed.get((t, "ingredients"), [])
+        transformers[t].instDocs = parsed.get((t, "instructions"), [])
+
+################################################################################
+# Name: readRecipeSources                                                      #
+# Params: sources (list of recipe URLs, JSON files and/or corpus stores),      #
+# containing (only take the recipes in a store that use this ingredient; None  #
+# for all of them)                                                             #
+# Returns: Generator of (source label, url, recipeData) tuples, where exactly  #
+# one of url and recipeData is None                                            #
+# Notes: JSON files may hold one scraped recipe, a list of them, or JSON Lines #
+# (like bulkScraper.py writes). Corpus stores (see corpusStore.py) are         #
+# streamed, a page of recipes at a time.                                       #
+################################################################################
+def readRecipeSources(sources, containing = None):
+    for source in sources:
+        if source.startswith("http://") or source.startswith("https://"):
+            yield source, source, None
+            continue
+        if isCorpusStore(source):
+            for recipeId, recipeData in CorpusStore(source).recipes(containing):
+                yield recipeData.get("url", source + ":" + str(recipeId)), None, recipeData
+            continue
+
+        with open(source, encoding = "utf-8") as recipeFile:
+            text = recipeFile.read()
+        try:
+            recipes = json.loads(text)
+            if isinstance(recipes, dict):
+                recipes = [recipes]
+        except ValueError: # Not a single JSON document, so it should be JSON Lines
+            recipes = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for i in range(len(recipes)):
+            yield recipes[i].get("url", source + ":" + str(i + 1)), None, recipes[i]
+
+################################################################################
+# Name: transformRecipes                                                       #
+# Params: recipeSources (list of (label, url, recipeData) tuples, as from      #
+# readRecipeSources), transformationTypes (list, or None for all of them),     #
+# seed (passed on to every Transformer)                                        #
+# Returns: List of dicts, one per source and in the same order                 #
+# Notes: Scrapes (or reads) every recipe first so spaCy can parse them all in  #
+# one batch, then runs each through the transformations. A recipe that fails   #
+# gets an entry with an "error" message instead of taking the others down with #
+# it. With Transformer.collectMetrics on, each entry also carries the recipe's #
+# "metrics" snapshot.                                                          #
+################################################################################
+def transformRecipes(recipeSources, transformationTypes = None, seed = None):
+    entries = [None] * len(recipeSources)
+    transformers = []
+    for i in range(len(recipeSources)):
+        label, url, recipeData = recipeSources[i]
+        try:
+            transformers.append((i, Transformer(url, recipeData, seed)))
+        except Exception as error:
+            entries[i] = {"source": label, "error": type(error).__name__ + ": " + str(error)}
+
+    try:
+        with collecting(processMetrics if Transformer.collectMetrics else currentCollector()): # The batched spaCy parse belongs to no one recipe
+            parseRecipes([newTransformer for i, newTransformer in transformers])
+    except Exception: # Then each Transformer parses on its own below, so whichever recipe is at fault reports the error
+        for i, newTransformer in transformers:
+            newTransformer.ingDocs = None
+            newTransformer.instDocs = None
+
+    for i, newTransformer in transformers:
+        label = recipeSources[i][0]
+        try:
+            transformations = newTransformer.transformAll(transformationTypes)
+            entries[i] = {"source": label, "recipeName": newTransformer.recipeData["recipeName"],
+            "transformations": [result.toJSON() for result in transformations]}
+            if newTransformer.metrics is not None:
+                entries[i]["metrics"] = newTransformer.metrics.snapshot()
+        except Exception as error:
+            entries[i] = {"source": label, "error": type(error).__name__ + ": " + str(error)}
+    return entries
+
+################################################################################
+# Name: transformInBatches                                                     #
+# Params: recipeSources (iterable of (label, url, recipeData) tuples, as from  #
+# readRecipeSources), transformationTypes, seed (as for transformRecipes),     #
+# batchSize (recipes parsed and transformed together)                          #
+# Returns: Generator of the transformRecipes entries, in input order           #
+# Notes: Only one batch of recipes (and their spaCy docs) is held at a time,   #
+# so recipeSources can be a corpus store of any size. Batches keep nlp.pipe    #
+# efficient.                                                                   #
+################################################################################
+def transformInBatches(recipeSources, transformationTypes = None, seed = None, batchSize = 32):
+    batch = []
+    for source in recipeSources:
+        batch.append(source)
+        if len(batch) == batchSize:
+            for entry in transformRecipes(batch, transformationTypes, seed):
+                yield entry
+            batch = []
+    if batch:
+        for entry in transformRecipes(batch, transformationTypes, seed):
+            yield entry
+
+################################################################################
+# Name: runBatch                                                               #
+# Params: argv (command line arguments)                                        #
+# Returns: Integer (exit status)                                               #
+# Notes: The non-interactive mode: every recipe is scraped (or read) and       #
+# parsed once, then run through each requested transformation, a batch of      #
+# recipes at a time. The output is one JSON list (or with --jsonl, one JSON    #
+# line) with an entry per recipe, written as each batch finishes; a recipe     #
+# that fails gets an "error" entry instead of stopping the run. --metrics and  #
+# --profile are both off unless asked for.                                     #
+################################################################################
+def runBatch(argv):
+    parser = argparse.ArgumentParser(description = "Transform many recipes without any prompts.")
+    parser.add_argument("sources", nargs = "+", help = "recipe URLs, JSON files of scraped recipes and/or corpus stores (see corpusStore.py)")
+    parser.add_argument("--containing", help = "only take the recipes in corpus stores that use this ingredient, like \"beef sirloin\"")
+    parser.add_argument("--type", action = "append", dest = "types", choices = Transformer.transformationTypes,
+    help = "transformation to apply (repeat for several; defaults to all of them)")
+    parser.add_argument("--output", help = "JSON output file (defaults to stdout)")
+    parser.add_argument("--jsonl", action = "store_true", help = "write one JSON line per recipe instead of one JSON list")
+    parser.add_argument("--batch-size", type = int, default = 32, help = "recipes parsed and transformed together (only this many are held in memory)")
+    parser.add_argument("--conceptnet-index", help = "serve ConceptNet lookups from this local dump index (see conceptNet.py)")
+    parser.add_argument("--classification-index", help = "classify words with this precompiled index (see classificationIndex.py)")
+    parser.add_argument("--seed", type = int, help = "seed the random replacement choices so runs are reproducible")
+    parser.add_argument("--similarity-index", help = "pick replacements that suit each recipe with this index (see similarityIndex.py) instead of at random")
+    parser.add_argument("--no-parse-cache", action = "store_true", help = "parse every recipe from scratch, without reading or writing the parse cache")
+    parser.add_argument("--metrics", help = "record stage timings, cache hits and network use per recipe, and write the totals to this file")
+    parser.add_argument("--metrics-format", choices = ["json", "prometheus"], default = "json", help = "format of the --metrics file")
+    parser.add_argument("--profile", help = "sample the run and write folded stacks for a flame graph to this file")
+    args = parser.parse_args(argv)
+
+    if args.no_parse_cache:
+        Transformer.parseCache = None
+    if args.conceptnet_index:
+        Transformer.conceptNet = ConceptNetClient(backend = LocalDumpBackend(args.conceptnet_index))
+    if args.classification_index:
+        Transformer.classificationIndex = loadClassificationIndex(args.classification_index)
+    if args.similarity_index:
+        Transformer.similarityIndex = loadSimilarityIndex(args.similarity_index)
+
+    if args.metrics:
+        Transformer.collectMetrics = True
+    profiler = SamplingProfiler().start() if args.profile else None
+    output = open(args.output, "w", encoding = "utf-8") if args.output else sys.stdout
+    failures = 0
+    written = 0
+    try:
+        if not args.jsonl:
+            output.write("[")
+        for entry in transformInBatches(readRecipeSources(args.sources, args.containing), args.types, args.seed, args.batch_size):
+            if "error" in entry:
+                failures += 1
+            if args.jsonl:
+                output.write(json.dumps(entry) + "\n")
+            else:
+                output.write(("," if written else "") + "\n" + "\n".join("  " + line for line in json.dumps(entry, indent = 2).splitlines()))
+            output.flush()
+            written += 1
+        if not args.jsonl:
+            output.write("\n]\n" if written else "]\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+
+    if args.metrics:
+        with open(args.metrics, "w", encoding = "utf-8") as metricsFile:
+            if args.metrics_format == "prometheus":
+                metricsFile.write(toPrometheus(processMetrics.snapshot()))
+            else:
+                json.dump(processMetrics.snapshot(), metricsFile, indent = 2)
+    return 1 if failures else 0
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1: # Anything on the command line means batch mode
+        sys.exit(runBatch(sys.argv[1:]))
+
     userRecipeURL = input("\nHello and welcome to the recipe transformer! Please enter an AllRecipes URL that gives us a recipe to transform: ")
     newTransformer = Transformer(userRecipeURL.strip())
     print("\nThank you! We will be asking for more input momentarily, so please wait as we get everything ready (this could take a while).")
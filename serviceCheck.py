@@ -0,0 +1,130 @@
+# An end-to-end check of recipeService.py that never touches the network. It
+# starts a StandIn serving the benchmark fixtures (saved pages plus recorded
+# ConceptNet answers), points the transformer's HTTPBackend at it, and drives a
+# RecipeService on a free local port through /transform and /metrics: a plain
+# request, identical requests arriving together (which must be coalesced into
+# one piece of work), a repeat (which must come from the result cache without
+# any network traffic), bad requests, and both metrics formats.
+#
+# Exits with 1 and lists what failed if anything is off, so it can run in CI.
+
+from recipeTransformer import Transformer
+from conceptNet import ConceptNetClient, HTTPBackend
+from standInServer import StandIn
+from recipeService import RecipeService
+from bulkScraper import BulkScraper, PageCache
+from benchmarkPipeline import DEFAULT_FIXTURES_DIR
+import requests
+import argparse
+import tempfile
+import asyncio
+import json
+import sys
+import os
+
+################################################################################
+# Name: runChecks                                                              #
+# Params: service (a RecipeService), serviceURL, standIn (the running          #
+# StandIn), standInURL, pageURLs (stand-in URLs of at least two saved pages)   #
+# Returns: List of strings, one per failed check (a coroutine)                 #
+# Notes: HTTP calls run on the default executor so the service keeps serving   #
+# on this loop meanwhile.                                                      #
+################################################################################
+async def runChecks(service, serviceURL, standIn, standInURL, pageURLs):
+    loop = asyncio.get_running_loop()
+    session = requests.Session() # One keep-alive connection, like a real client
+    failures = []
+
+    def check(condition, description):
+        if not condition:
+            failures.append(description)
+
+    def post(body):
+        response = session.post(serviceURL + "/transform", json = body, timeout = 120)
+        return response.status_code, response.json()
+
+    def get(path, headers = None):
+        return session.get(serviceURL + path, headers = headers, timeout = 120)
+
+    status, entry = await loop.run_in_executor(None, post, {"url": pageURLs[0], "types": ["to vegetarian", "to healthy"], "seed": 1})
+    check(status == 200, "POST /transform answered " + str(status) + ": " + json.dumps(entry)[:200])
+    if status == 200:
+        check([result["transformationType"] for result in entry["transformations"]] == ["to vegetarian", "to healthy"],
+        "POST /transform did not run the requested transformations")
+
+    # Eight identical requests at once: one scrape and one transform, the rest wait on it
+    coalescedBefore = service.counts["coalesced"]
+    body = json.dumps({"url": pageURLs[1], "type": "to mexican", "seed": 2}).encode("utf-8")
+    answers = await asyncio.gather(*[service.handle("POST", "/transform", body) for i in range(8)])
+    check(all(answer == answers[0] for answer in answers) and answers[0][0] == 200, "coalesced requests did not all get the same answer")
+    check(service.counts["coalesced"] - coalescedBefore == 7, "expected 7 coalesced requests, got " + str(service.counts["coalesced"] - coalescedBefore))
+
+    # A repeat comes out of the result cache, so the stand-in hears nothing
+    networkBefore = standIn.server.requestCount
+    hitsBefore = service.counts["resultCacheHits"]
+    response = await loop.run_in_executor(None, get, "/transform?url=" + requests.utils.quote(pageURLs[1], safe = "") + "&type=to+mexican&seed=2")
+    check(response.status_code == 200 and response.json() == answers[0][1], "GET /transform did not match the POST answer")
+    check(service.counts["resultCacheHits"] - hitsBefore == 1, "the repeated request missed the result cache")
+    check(standIn.server.requestCount == networkBefore, "the repeated request went to the network")
+
+    status, entry = await loop.run_in_executor(None, post, {"url": pageURLs[0], "types": "to healthy", "seed": 1})
+    check(status == 200, "a single \"types\" string was refused: " + json.dumps(entry)[:200])
+    for badRequest in [{"url": pageURLs[0], "type": "to martian"}, {}, {"url": pageURLs[0], "recipe": {}}]:
+        status, entry = await loop.run_in_executor(None, post, badRequest)
+        check(status == 400 and "error" in entry, json.dumps(badRequest) + " answered " + str(status) + " instead of 400")
+    status, entry = await loop.run_in_executor(None, post, {"url": standInURL + "/missing.html"})
+    check(status == 502, "a missing page answered " + str(status) + " instead of 502")
+
+    response = await loop.run_in_executor(None, get, "/metrics")
+    metrics = response.json()
+    check(response.status_code == 200 and metrics["counts"].get("requests", 0) >= 14, "/metrics did not count the requests")
+    check("/transform" in metrics["latency"], "/metrics has no /transform latencies")
+    check("transform" in metrics["transformer"]["stages"], "/metrics has no transformer stage timings")
+    # The last request asks the service to hang up, so no connection is left open when the loop shuts down
+    response = await loop.run_in_executor(None, get, "/metrics?format=prometheus", {"Connection": "close"})
+    check(response.status_code == 200 and "recipe_service_requests_total" in response.text, "/metrics?format=prometheus is not Prometheus text")
+    session.close()
+    return failures
+
+################################################################################
+# Name: checkService                                                           #
+# Params: fixturesDir (pages/, manifest.json and edges.json, as                #
+# benchmarkPipeline.py records them)                                           #
+# Returns: List of strings, one per failed check                               #
+# Notes: Uses a throwaway page cache and no ConceptNet or parse cache on disk, #
+# so every run does the same work.                                             #
+################################################################################
+def checkService(fixturesDir):
+    with open(os.path.join(fixturesDir, "manifest.json"), encoding = "utf-8") as manifestFile:
+        pageNames = sorted(json.load(manifestFile).values())
+    standIn = StandIn(os.path.join(fixturesDir, "pages"), conceptNetEdges = os.path.join(fixturesDir, "edges.json"))
+    standInURL = standIn.start()
+    Transformer.conceptNet = ConceptNetClient(backend = HTTPBackend(baseURL = standInURL, perSecond = None), cachePath = None)
+    Transformer.parseCache = None
+    Transformer.collectMetrics = True
+    try:
+        with tempfile.TemporaryDirectory() as pageCacheDir:
+            service = RecipeService(BulkScraper(PageCache(pageCacheDir), 4))
+
+            async def main():
+                server = await service.start("127.0.0.1", 0)
+                try:
+                    serviceURL = "http://127.0.0.1:" + str(server.sockets[0].getsockname()[1])
+                    return await runChecks(service, serviceURL, standIn, standInURL, [standInURL + "/" + pageName for pageName in pageNames[:2]])
+                finally:
+                    server.close()
+                    await server.wait_closed()
+
+            return asyncio.run(main())
+    finally:
+        standIn.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the recipe service end to end against a local stand-in, without the network.")
+    parser.add_argument("--fixtures", default = DEFAULT_FIXTURES_DIR, help = "fixtures directory (see benchmarkPipeline.py)")
+    args = parser.parse_args()
+    failures = checkService(args.fixtures)
+    for failure in failures:
+        print("Failed: " + failure, file = sys.stderr)
+    print("All service checks passed." if not failures else str(len(failures)) + " service checks failed.")
+    sys.exit(1 if failures else 0)
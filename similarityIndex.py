@@ -0,0 +1,250 @@
+# Ingredient embeddings learned offline from which foods show up together in a
+# corpus of scraped recipes, for picking substitutes that suit the recipe instead
+# of picking them at random. Building counts, for every pair of terms (the foods
+# the knowledge base knows, plus the other words of each ingredient once its
+# amount is taken off), how many recipes use both; turns those counts into
+# positive pointwise mutual information; and keeps the top singular vectors of
+# that matrix as one unit-length vector per term, saved in a .npz file.
+#
+# Choosing a replacement is then one small matrix-vector product: every allowed
+# candidate is scored by its cosine similarity to the ingredient being replaced
+# plus its similarity to the rest of the recipe, and the best one wins (ties go
+# to the earlier candidate, so the same recipe always gets the same answer).
+#
+# The transformer imports this module whether or not an index is in use, so
+# NumPy is only imported once an index is built or loaded (see _loadNumPy).
+
+from substitution import WORD_PATTERN
+from knowledgeBase import loadKnowledgeBase
+from conceptNet import LRUCache
+from quantities import findQuantity
+from collections import Counter
+import hashlib
+import sys
+import os
+
+INDEX_VERSION = 1 # Bump this whenever buildSimilarityIndex or the file layout changes
+np = None # NumPy, once _loadNumPy has imported it
+
+################################################################################
+# Name: _loadNumPy                                                             #
+# Params: None                                                                 #
+# Returns: None                                                                #
+# Notes: Building an index and opening one both call this first, and every     #
+# other use goes through an open SimilarityIndex.                              #
+################################################################################
+def _loadNumPy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+################################################################################
+# Name: ingredientTerms                                                        #
+# Params: text (an ingredient or ingredient name), knowledgeBase               #
+# Returns: List of terms: the foods in text as whole phrases ("coconut oil"    #
+# rather than "oil"), and its other words                                      #
+# Notes: The amount and unit are dropped first. A plural the knowledge base    #
+# does not have ("onions") is tried without its ending, and words shorter than #
+# three letters are left out.                                                  #
+################################################################################
+def ingredientTerms(text, knowledgeBase):
+    quantity = findQuantity(text)
+    if quantity is not None:
+        text = text[quantity[6] if quantity[4] is not None else quantity[3]:]
+    words = WORD_PATTERN.findall(text.lower())
+    terms = []
+    i = 0
+    while i < len(words):
+        length, mask = knowledgeBase.longestMatch(words, i)
+        if length and mask & knowledgeBase.foodMask:
+            terms.append(" ".join(words[i:i + length]))
+            i += length
+            continue
+        word = words[i]
+        for ending in ("es", "s"):
+            if word.endswith(ending) and knowledgeBase.isFood(word[:-len(ending)]):
+                word = word[:-len(ending)]
+                break
+        if len(word) >= 3 and not word.isdigit():
+            terms.append(word)
+        i += 1
+    return terms
+
+################################################################################
+# Name: buildSimilarityIndex                                                   #
+# Params: recipes (iterable of scraped recipe dicts), indexPath (.npz file to  #
+# write), dimensions (length of each vector), minCount (terms in fewer recipes #
+# than this are left out), maxTerms (only this many of the most common terms   #
+# are kept), knowledgeBase (defaults to the usual one)                         #
+# Returns: Integer (number of terms in the index)                              #
+# Notes: Reads the recipes once. maxTerms bounds the co-occurrence matrix      #
+# (terms x terms) and so the time the decomposition takes.                     #
+################################################################################
+def buildSimilarityIndex(recipes, indexPath, dimensions = 64, minCount = 2, maxTerms = 4000, knowledgeBase = None):
+    _loadNumPy()
+    if knowledgeBase is None:
+        knowledgeBase = loadKnowledgeBase()
+    recipeTerms = []
+    counts = Counter()
+    for recipe in recipes:
+        terms = set()
+        for ingredient in recipe.get("ingredients", []):
+            terms.update(ingredientTerms(ingredient, knowledgeBase))
+        if terms:
+            recipeTerms.append(terms)
+            counts.update(terms)
+
+    common = sorted((term for term, count in counts.items() if count >= minCount), key = lambda term: (-counts[term], term))
+    vocabulary = sorted(common[:maxTerms]) # Sorted, and ties broken by name, so the same corpus always builds the same file
+    rows = dict((vocabulary[row], row) for row in range(len(vocabulary)))
+    together = np.zeros((len(vocabulary), len(vocabulary)), dtype = np.float64)
+    for terms in recipeTerms:
+        present = np.array(sorted(rows[term] for term in terms if term in rows), dtype = np.intp)
+        together[np.ix_(present, present)] += 1
+    np.fill_diagonal(together, 0)
+
+    # Positive PMI, with the context counts smoothed (raised to 0.75) so rare foods do not get outsized scores
+    total = together.sum()
+    vectors = np.zeros((len(vocabulary), dimensions), dtype = np.float32)
+    if total > 0:
+        rowTotals = together.sum(axis = 1)
+        contextTotals = rowTotals ** 0.75
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            pmi = np.log(together * contextTotals.sum() / (np.outer(rowTotals, contextTotals)))
+        ppmi = np.where(np.isfinite(pmi) & (pmi > 0), pmi, 0)
+
+        left, singular, right = np.linalg.svd(ppmi)
+        kept = min(dimensions, len(singular))
+        vectors[:, :kept] = left[:, :kept] * np.sqrt(singular[:kept])
+        lengths = np.linalg.norm(vectors, axis = 1, keepdims = True)
+        vectors = np.where(lengths > 0, vectors / np.where(lengths > 0, lengths, 1), 0).astype(np.float32)
+
+    fingerprint = hashlib.sha256(("\n".join(vocabulary)).encode("utf-8") + vectors.tobytes()).hexdigest()
+    directory = os.path.dirname(os.path.abspath(indexPath))
+    os.makedirs(directory, exist_ok = True)
+    with open(indexPath, "wb") as indexFile: # An open file, so numpy does not tack ".npz" onto the name
+        np.savez_compressed(indexFile, version = INDEX_VERSION, vocabulary = np.array(vocabulary), vectors = vectors,
+        counts = np.array([counts[term] for term in vocabulary], dtype = np.int64), fingerprint = fingerprint)
+    return len(vocabulary)
+
+class SimilarityIndex:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (a file made by buildSimilarityIndex), knowledgeBase        #
+    # (defaults to the usual one), cacheSize (choices remembered)              #
+    # Returns: None                                                            #
+    # Notes: Raises a ValueError for files from another version.               #
+    ############################################################################
+    def __init__(self, path, knowledgeBase = None, cacheSize = 4096):
+        _loadNumPy()
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(path + " is not a version " + str(INDEX_VERSION) + " similarity index; please rebuild it")
+            self.vocabulary = [str(term) for term in data["vocabulary"]]
+            self.vectors = data["vectors"]
+            self.fingerprint = str(data["fingerprint"])
+        self.rows = dict((self.vocabulary[row], row) for row in range(len(self.vocabulary)))
+        self.knowledgeBase = knowledgeBase
+        self.candidates = dict() # Choices tuple -> (candidate vectors, which of them are in the index)
+        self.textVectors = LRUCache(cacheSize) # Ingredient name -> (its vector or None,)
+        self.chosen = LRUCache(cacheSize) # (choices, ingredient, context) -> the pick
+
+    ############################################################################
+    # Name: vectorFor                                                          #
+    # Params: text (an ingredient name, like "beef sirloin")                   #
+    # Returns: Unit-length array, or None if none of its terms are in the      #
+    # index                                                                    #
+    # Notes: The vectors of several terms are averaged. Remembered, since the  #
+    # same names come up recipe after recipe.                                  #
+    ############################################################################
+    def vectorFor(self, text):
+        found = self.textVectors.get(text)
+        if found is None:
+            if self.knowledgeBase is None:
+                self.knowledgeBase = loadKnowledgeBase()
+            rows = [self.rows[term] for term in ingredientTerms(text, self.knowledgeBase) if term in self.rows]
+            vector = None
+            if rows:
+                vector = self.vectors[rows].mean(axis = 0)
+                length = float(np.linalg.norm(vector))
+                vector = vector / length if length > 0 else None
+            found = (vector,) # Wrapped, since LRUCache.get gives None for a miss
+            self.textVectors.put(text, found)
+        return found[0]
+
+    ############################################################################
+    # Name: _candidatesFor                                                     #
+    # Params: choices (tuple of candidate replacements)                        #
+    # Returns: Tuple of (matrix with one row per candidate, Boolean array of   #
+    # which candidates are in the index)                                       #
+    # Notes: Worked out once per choices tuple; RuleIndex hands out the same   #
+    # tuple every time. Unknown candidates get a row of zeros.                 #
+    ############################################################################
+    def _candidatesFor(self, choices):
+        found = self.candidates.get(choices)
+        if found is None:
+            matrix = np.zeros((len(choices), self.vectors.shape[1]), dtype = np.float32)
+            known = np.zeros(len(choices), dtype = bool)
+            for i in range(len(choices)):
+                vector = self.vectorFor(choices[i])
+                if vector is not None:
+                    matrix[i] = vector
+                    known[i] = True
+            found = self.candidates[choices] = (matrix, known)
+        return found
+
+    ############################################################################
+    # Name: choose                                                             #
+    # Params: choices (tuple of candidate replacements), ingredient (the       #
+    # ingredient name being replaced), context (the recipe's other ingredient  #
+    # names)                                                                   #
+    # Returns: String (one of choices), or None if none of them are in the     #
+    # index                                                                    #
+    # Notes: Scores each candidate by similarity to the ingredient plus        #
+    # similarity to the recipe as a whole. A candidate the recipe already uses #
+    # only wins if nothing else is known. Deterministic, and cached.           #
+    ############################################################################
+    def choose(self, choices, ingredient, context):
+        context = tuple(sorted(set(context)))
+        key = (choices, ingredient, context)
+        cached = self.chosen.get(key)
+        if cached is not None:
+            return cached
+
+        matrix, known = self._candidatesFor(choices)
+        if not known.any():
+            return None
+        target = np.zeros(self.vectors.shape[1], dtype = np.float32)
+        for vector in [self.vectorFor(ingredient)] + [self.vectorFor(name) for name in context if name != ingredient]:
+            if vector is not None:
+                target += vector
+        scores = matrix @ target
+        scores[~known] = -np.inf
+        used = np.array([choice.lower() in context for choice in choices], dtype = bool) # Swapping beef for the chicken already in the recipe helps no one
+        if (known & ~used).any():
+            scores[used] = -np.inf
+        choice = choices[int(np.argmax(scores))] # argmax takes the first of equal scores
+        self.chosen.put(key, choice)
+        return choice
+
+openIndexes = dict() # Path -> SimilarityIndex, so every Transformer in a process shares one
+
+################################################################################
+# Name: loadSimilarityIndex                                                    #
+# Params: path (a file made by buildSimilarityIndex)                           #
+# Returns: SimilarityIndex                                                     #
+# Notes: Loads each file only once per process.                                #
+################################################################################
+def loadSimilarityIndex(path):
+    if path not in openIndexes:
+        openIndexes[path] = SimilarityIndex(path)
+    return openIndexes[path]
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "build":
+        from recipeTransformer import readRecipeSources # Only the command line needs it, and it imports this module too
+        recipes = (recipeData for label, url, recipeData in readRecipeSources(sys.argv[2:-1]) if recipeData is not None)
+        print("Indexed " + str(buildSimilarityIndex(recipes, sys.argv[-1])) + " terms.")
+    else:
+        print("Usage: python similarityIndex.py build <recipes.jsonl>... <similarity.npz>")
@@ -0,0 +1,168 @@
+# A local stand-in for both ConceptNet and the recipe site, so the service (and
+# anything else that goes over HTTP) can be run and tested without the network.
+# Concept lookups (/c/en/...) are answered from a ConceptNet dump index (see
+# conceptNet.py) and/or a JSON file of edges, in the same shape the live API
+# uses; every other path is served from a directory of saved recipe pages.
+#
+# Point the transformer at it with HTTPBackend(baseURL = "http://127.0.0.1:<port>")
+# and use http://127.0.0.1:<port>/<page>.html as the recipe URL.
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from conceptNet import LocalDumpBackend, conceptNode
+from urllib.parse import urlsplit, unquote
+import threading
+import argparse
+import json
+import os
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = "StandIn/1.0"
+
+    ############################################################################
+    # Name: do_GET                                                             #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Concepts no source knows about get an empty edge list, just like  #
+    # the live API answers for unknown words.                                  #
+    ############################################################################
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        self.server.requestCount += 1
+        if path.startswith("/c/en/"):
+            self._send(200, "application/json", json.dumps(self.server.standIn.concept(path)).encode("utf-8"))
+            return
+        page = self.server.standIn.page(path)
+        if page is None:
+            self._send(404, "text/plain", b"Not found")
+        else:
+            self._send(200, "text/html; charset=utf-8", page)
+
+    ############################################################################
+    # Name: _send                                                              #
+    # Params: status, contentType, body (bytes)                                #
+    # Returns: None                                                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def _send(self, status, contentType, body):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    ############################################################################
+    # Name: log_message                                                        #
+    # Params: format, args (as for BaseHTTPRequestHandler)                     #
+    # Returns: None                                                            #
+    # Notes: Quiet unless the stand-in was started with verbose on.            #
+    ############################################################################
+    def log_message(self, format, *args):
+        if self.server.standIn.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class StandIn:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: pagesDirectory (saved recipe pages; may be None),                #
+    # conceptNetIndexPath (a dump index; may be None), conceptNetEdges (path   #
+    # of a JSON file mapping terms or concept URIs to edge lists or whole      #
+    # responses, like benchmarkPipeline.py records; may be None), verbose (log #
+    # every request)                                                           #
+    # Returns: None                                                            #
+    # Notes: Nothing is listening until listen or start is called.             #
+    ############################################################################
+    def __init__(self, pagesDirectory = None, conceptNetIndexPath = None, conceptNetEdges = None, verbose = False):
+        self.pagesDirectory = os.path.abspath(pagesDirectory) if pagesDirectory else None
+        self.dump = LocalDumpBackend(conceptNetIndexPath) if conceptNetIndexPath else None
+        self.edges = dict()
+        if conceptNetEdges:
+            with open(conceptNetEdges, encoding = "utf-8") as edgesFile:
+                for term, edges in json.load(edgesFile).items():
+                    self.edges[term if term.startswith("/c/en/") else "/c/en/" + term] = edges
+        self.verbose = verbose
+        self.server = None
+
+    ############################################################################
+    # Name: concept                                                            #
+    # Params: uri (concept URI from the request path)                          #
+    # Returns: Dict with an "edges" list                                       #
+    # Notes: The JSON edges come first, then the dump.                         #
+    ############################################################################
+    def concept(self, uri):
+        node = conceptNode(uri)
+        if node in self.edges:
+            edges = self.edges[node]
+            return edges if isinstance(edges, dict) else {"edges": edges} # Either a whole response or just its edges
+        if self.dump is not None:
+            return self.dump.fetch(node)
+        return {"edges": []}
+
+    ############################################################################
+    # Name: page                                                               #
+    # Params: path (request path)                                              #
+    # Returns: Bytes, or None if there is no such page                         #
+    # Notes: Paths that would climb out of pagesDirectory are refused.         #
+    ############################################################################
+    def page(self, path):
+        if self.pagesDirectory is None:
+            return None
+        pagePath = os.path.abspath(os.path.join(self.pagesDirectory, path.lstrip("/")))
+        if not pagePath.startswith(self.pagesDirectory + os.sep) or not os.path.isfile(pagePath):
+            return None
+        with open(pagePath, "rb") as pageFile:
+            return pageFile.read()
+
+    ############################################################################
+    # Name: listen                                                             #
+    # Params: host, port (0 picks a free one)                                  #
+    # Returns: String (the base URL it is listening on)                        #
+    # Notes: Binds the socket; requests are only answered once                 #
+    # self.server.serve_forever runs.                                          #
+    ############################################################################
+    def listen(self, host = "127.0.0.1", port = 0):
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.standIn = self
+        self.server.requestCount = 0 # Lets tests check how often the network would have been hit
+        return "http://" + host + ":" + str(self.server.server_address[1])
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: host, port (as for listen)                                       #
+    # Returns: String (the base URL)                                           #
+    # Notes: Serves from a daemon thread, so tests and benchmarks can run it   #
+    # alongside whatever they are exercising.                                  #
+    ############################################################################
+    def start(self, host = "127.0.0.1", port = 0):
+        baseURL = self.listen(host, port)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return baseURL
+
+    ############################################################################
+    # Name: stop                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None needed.                                                      #
+    ############################################################################
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve saved recipe pages and ConceptNet answers locally.")
+    parser.add_argument("--pages", help = "directory of saved recipe pages")
+    parser.add_argument("--conceptnet-index", help = "ConceptNet dump index to answer concept lookups from (see conceptNet.py)")
+    parser.add_argument("--conceptnet-edges", help = "JSON file mapping terms to ConceptNet edge lists")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8081)
+    parser.add_argument("--verbose", action = "store_true", help = "log every request")
+    args = parser.parse_args()
+
+    standIn = StandIn(args.pages, args.conceptnet_index, args.conceptnet_edges, args.verbose)
+    print("Serving on " + standIn.listen(args.host, args.port))
+    try:
+        standIn.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
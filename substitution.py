@@ -0,0 +1,197 @@
+# Swaps transformed ingredients into instruction sentences in a single pass.
+# Every phrase from Transformer.transformedIng, plus the individual words of the
+# multi-word ones, goes into one lookup table keyed by lowercased words. Each
+# sentence is then split into words once, and at every word the longest phrase
+# starting there wins, so "beef stock" beats "beef" and whole words are the only
+# thing ever matched. Since each stretch of text is consumed once, a replacement
+# can never be replaced again. Small tables, which is what almost every recipe
+# has, are also compiled into one alternation regex that finds the same matches
+# without the per-word Python work. Python's re tries every alternative at every
+# position, though, so for big tables that would bring back exactly the
+# instructions x substitutions cost the word scan gets rid of.
+
+import re
+
+WORD_PATTERN = re.compile(r"[^\W_]+(?:['-][^\W_]+)*") # Words, keeping "half-and-half" and "confectioners'" style words whole
+PHRASE_PATTERN = re.compile(r"[^\W_]+(?:['-][^\W_]+)*(?: [^\W_]+(?:['-][^\W_]+)*)*") # Words as above with single spaces between, none of them special to re
+SMALL_TABLE = 32 # Phrases; up to this many, one regex beats scanning the words in Python
+STOP_WORDS = {"a", "an", "and", "as", "at", "for", "in", "of", "on", "or", "the", "to", "with"} # Never worth replacing on their own
+
+class SubstitutionMatcher:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: substitutions (dict of original ingredient -> replacement, like  #
+    # Transformer.transformedIng)                                              #
+    # Returns: None                                                            #
+    # Notes: Builds the table once, so one matcher serves every instruction of #
+    # a transformation. Like the old two loops, a multi-word ingredient is     #
+    # matched as a whole first, and its words are also matched alone so that   #
+    # shortened mentions ("the beef" for "beef sirloin") get replaced too.     #
+    # Words that already appear in the replacement are left out ("broth" for   #
+    # "chicken broth" -> "vegetable broth").                                   #
+    ############################################################################
+    def __init__(self, substitutions):
+        self.replacements = dict()
+        for original, replacement in substitutions.items():
+            self.replacements[" ".join(original.lower().split())] = replacement
+        for original, replacement in substitutions.items():
+            words = original.lower().split()
+            if len(words) > 1:
+                for word in words:
+                    if len(word) > 2 and word not in STOP_WORDS and word not in replacement.lower() and word not in self.replacements:
+                        self.replacements[word] = replacement
+
+        self.pattern = None # The regex for a small table
+        self.forms = dict() # Every phrase plus its plural forms -> (replacement, capitalized, lowercased), for the regex's matches
+        phrases = sorted(self.replacements, key = lambda phrase: -len(phrase.split())) # Longer phrases first, so they win
+        if 0 < len(phrases) <= SMALL_TABLE and all(PHRASE_PATTERN.fullmatch(phrase) for phrase in phrases):
+            # re only skips straight to the letters a match can start with when the pattern opens with a plain set of
+            # characters, so the first letter is matched on its own and each phrase checks it with a lookbehind
+            firstLetters = set(phrase[0] for phrase in phrases) | set(phrase[0].upper() for phrase in phrases)
+            alternatives = "|".join("(?<=" + phrase[0] + ")" + phrase[1:].replace(" ", r"\s+") for phrase in phrases)
+            # Only whole words as WORD_PATTERN splits them, with an optional plural ending on the last one
+            self.pattern = re.compile("[" + "".join(sorted(firstLetters)) + r"](?<![^\W_].)(?<![^\W_]['-].)(?i:(?:" + alternatives +
+            r")(?:e?s)?)(?![^\W_]|['-][^\W_])")
+            for phrase, replacement in self.replacements.items():
+                capitalized = replacement[0].upper() + replacement[1:] if replacement[:1].islower() else replacement
+                self.forms[phrase] = (replacement, capitalized, replacement.lower())
+            for phrase in phrases:
+                for form in (phrase + "es", phrase + "s"):
+                    if form not in self.forms: # The same choice _lookup makes: "es" comes off before "s"
+                        self.forms[form] = self.forms[form[:-2] if form.endswith("es") and form[:-2] in self.replacements else form[:-1]]
+
+        self.longestPhrase = max([len(phrase.split()) for phrase in self.replacements] + [0]) # In words
+        self.firstWords = set() # Every word a match can start with, plural endings included, so most words are skipped with one set check
+        for phrase in self.replacements:
+            firstWord = phrase.split()[0]
+            self.firstWords.update((firstWord, firstWord + "s", firstWord + "es"))
+
+    ############################################################################
+    # Name: _lookup                                                            #
+    # Params: words (list of lowercased words)                                 #
+    # Returns: String (the replacement), or None                               #
+    # Notes: The last word may also carry a plural ending the table does not   #
+    # have ("onions" for "onion").                                             #
+    ############################################################################
+    def _lookup(self, words):
+        phrase = " ".join(words)
+        if phrase in self.replacements:
+            return self.replacements[phrase]
+        for ending in ("es", "s"):
+            if phrase.endswith(ending) and phrase[:-len(ending)] in self.replacements:
+                return self.replacements[phrase[:-len(ending)]]
+        return None
+
+    ############################################################################
+    # Name: substitute                                                         #
+    # Params: sentence (an instruction)                                        #
+    # Returns: String                                                          #
+    # Notes: One scan over the sentence, with the regex for a small table (see #
+    # _substituteSmall) or else over its words. A replacement keeps a leading  #
+    # capital ("Beef" becomes "Tofu"). Neighbouring matches separated only by  #
+    # whitespace that map to the same replacement collapse into one, so "beef  #
+    # stock" can never come out as "tofu tofu" even when only its words were   #
+    # transformed.                                                             #
+    ############################################################################
+    def substitute(self, sentence):
+        if self.pattern is not None and sentence.isascii() and "\0" not in sentence: # Lowercasing cannot surprise it then
+            return self._substituteSmall(sentence)
+        if not self.replacements:
+            return sentence
+        lowerSentence = sentence.lower()
+        if len(lowerSentence) == len(sentence):
+            words = list(WORD_PATTERN.finditer(lowerSentence)) # Spans line up with the original sentence
+            lowered = [word.group() for word in words]
+        else: # A few non-ASCII letters change length when lowercased, so lowercase word by word instead
+            words = list(WORD_PATTERN.finditer(sentence))
+            lowered = [word.group().lower() for word in words]
+        starts = [i for i in range(len(lowered)) if lowered[i] in self.firstWords] # Only words a match can start at
+        if not starts:
+            return sentence # Nothing to replace, which is the common case
+
+        pieces = []
+        position = 0 # Where the unreplaced text starts
+        lastReplacement = None
+        for i in starts:
+            if words[i].start() < position: # Already part of the previous match
+                continue
+
+            replacement = None
+            for length in range(min(self.longestPhrase, len(words) - i), 0, -1): # Longest phrase first
+                # A phrase may only span words with nothing but whitespace between them
+                if length == 1 or all(sentence[words[j].end():words[j + 1].start()].isspace() for j in range(i, i + length - 1)):
+                    replacement = self._lookup(lowered[i:i + length])
+                    if replacement is not None:
+                        break
+            if replacement is None:
+                continue
+
+            between = sentence[position:words[i].start()]
+            if sentence[words[i].start()].isupper() and replacement[:1].islower():
+                replacement = replacement[0].upper() + replacement[1:]
+            if lastReplacement is not None and not between.strip() and replacement.lower() == lastReplacement.lower():
+                pass # Swallow the repeat along with the whitespace before it
+            else:
+                pieces.append(between)
+                pieces.append(replacement)
+                lastReplacement = replacement
+            position = words[i + length - 1].end()
+        pieces.append(sentence[position:])
+        return "".join(pieces)
+
+    ############################################################################
+    # Name: _substituteSmall                                                   #
+    # Params: sentence (an instruction)                                        #
+    # Returns: String                                                          #
+    # Notes: Lets re.sub do the scanning and the joining. A repeat of the      #
+    # previous replacement right after it becomes a "\0", which is then        #
+    # dropped along with the whitespace in front of it, as in substitute.      #
+    ############################################################################
+    def _substituteSmall(self, sentence):
+        forms = self.forms
+        lastEnd, lastReplacement = 0, None # lastReplacement is lowercased
+        swallowed = [] # Length of the whitespace in front of each repeat
+
+        def replace(match):
+            nonlocal lastEnd, lastReplacement
+            start, end = match.span()
+            text = match.group()
+            form = forms.get(text) or forms.get(text.lower())
+            if form is None: # A phrase with more than one space in it
+                form = forms[" ".join(text.lower().split())]
+            if form[2] == lastReplacement and not sentence[lastEnd:start].strip():
+                swallowed.append(start - lastEnd)
+                lastEnd = end
+                return "\0"
+            lastEnd, lastReplacement = end, form[2]
+            return form[1] if sentence[start].isupper() else form[0]
+
+        substituted = self.pattern.sub(replace, sentence)
+        if not swallowed:
+            return substituted
+        pieces = substituted.split("\0")
+        return "".join(piece[:len(piece) - length] for piece, length in zip(pieces, swallowed)) + pieces[-1]
+
+################################################################################
+# Name: referencedIngredients                                                  #
+# Params: sentence (an instruction), ingredients (iterable of ingredient       #
+# names)                                                                       #
+# Returns: Set of the ingredient names the sentence might mention              #
+# Notes: An ingredient counts when any of its words shows up in the sentence,  #
+# plural endings aside. That is every way a SubstitutionMatcher could match it #
+# (and sometimes more), so a sentence comes out the same from a matcher built  #
+# with just these ingredients as from one built with all of them.              #
+################################################################################
+def referencedIngredients(sentence, ingredients):
+    words = set()
+    for word in WORD_PATTERN.findall(sentence.lower()):
+        words.add(word)
+        for ending in ("es", "s"):
+            if word.endswith(ending):
+                words.add(word[:-len(ending)])
+    referenced = set()
+    for ingredient in ingredients:
+        lowerIngredient = ingredient.lower()
+        if any(word in words for word in lowerIngredient.split() + WORD_PATTERN.findall(lowerIngredient)):
+            referenced.add(ingredient)
+    return referenced
@@ -0,0 +1,202 @@
+# Describes every transformation as data and compiles it for _ingTransformation.
+# Each transformation is an ordered list of rules, and the first rule that matches
+# an ingredient decides what replaces it. Rules are written in terms of the
+# categories in the knowledge base (see knowledgeBase.py), which already stores a
+# category bitmask for every word, so classifying an ingredient is one lookup per
+# word and checking a rule is two mask tests. New transformations are added here
+# as data rather than as more elif branches, and a new cuisine only needs its
+# knowledge base entry plus a styleTransformation line below.
+#
+# A rule can have:
+#   when:       categories that must each be matched by some word of the ingredient
+#   unless:     categories that none of its words may match
+#   and exactly one of
+#   replaceWith: a fixed replacement
+#   chooseFrom:  categories to pick a random replacement from (words in all of them)
+#   swapWith:    a cuisine from the knowledge base; the matching word is swapped for its counterpart
+#   keep:        leave the ingredient alone (with an optional warning for stderr)
+# Any category name that is not in the knowledge base stands for just that word (e.g. "sauce").
+# Each cuisine has two categories of its own: "<cuisine>Swaps" (the words it swaps) and
+# "<cuisine>Spices". SPICE is filled in per recipe from the spices found while parsing.
+
+SPICE = "spice"
+
+################################################################################
+# Name: styleTransformation                                                    #
+# Params: cuisine (a cuisine in the knowledge base, like "Mexican")            #
+# Returns: Dict (a TRANSFORMATION_RULES entry)                                 #
+# Notes: Every cuisine works the same way: swap the ingredients it has a       #
+# counterpart for, replace spices with a random one of its own, and toss in    #
+# its spices that never came up (see Transformer._instTransformationForStyle). #
+################################################################################
+def styleTransformation(cuisine):
+    return {"rules": [
+        {"when": [cuisine + "Swaps"], "swapWith": cuisine}, # E.g. sausage to chorizo, cheese to queso fresco
+        {"when": [SPICE], "chooseFrom": [cuisine + "Spices"]}],
+        "style": cuisine}
+
+TRANSFORMATION_RULES = {
+    "to vegetarian": {"rules": [
+        {"when": ["meatProtein"], "replaceWith": "tofu"}, # Tofu is pretty much the go-to replacement
+        {"when": ["pairedWords"], "unless": ["sauce"], "replaceWith": "vegetable broth"}, # Reference: https://www.myfrugalhome.com/broth-substitutes/
+        {"when": ["pairedWords"], "replaceWith": "soy sauce"}], # Reference: https://food52.com/blog/24403-best-worcestershire-sauce-substitutes
+        "dropFromInstructions": ["meat "]},
+    "to healthy": {"rules": [
+        {"when": ["unhealthy", "meatProtein"], "chooseFrom": ["meatProtein", "healthy"]}, # A random healthy meat
+        {"when": ["unhealthy"], "unless": ["meatProtein"], "replaceWith": "coconut oil"}]}, # Butter, for us
+    "from vegetarian": {"rules": [
+        {"when": ["tofu"], "replaceWith": "chicken"}]}, # Chicken works for pretty much anywhere tofu would show up
+    "from healthy": {"rules": [
+        {"when": ["healthy", "meatProtein"], "chooseFrom": ["meatProtein", "unhealthy"]}, # A random unhealthy meat
+        {"when": ["healthy"], "unless": ["meatProtein"], "keep": True, "warning": "No non-meat unhealthy substitutes."}]},
+    "to mexican": styleTransformation("Mexican"),
+    "to italian": styleTransformation("Italian"),
+    "to indian": styleTransformation("Indian")
+}
+
+class RuleIndex:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: knowledgeBase (a knowledgeBase.KnowledgeBase),                   #
+    # transformationRules (like TRANSFORMATION_RULES)                          #
+    # Returns: None                                                            #
+    # Notes: Turns every rule into (when mask, unless mask, rule, choices),    #
+    # with the chooseFrom options worked out ahead of time. Categories the     #
+    # knowledge base does not have (single words like "sauce", and SPICE) get  #
+    # bits above its own. Raises a ValueError for a rule without exactly one   #
+    # action.                                                                  #
+    ############################################################################
+    def __init__(self, knowledgeBase, transformationRules = TRANSFORMATION_RULES):
+        self.knowledgeBase = knowledgeBase
+        self.extraBits = dict() # Category -> bit, for categories that are not in the knowledge base
+        self.extraWordMasks = dict() # Word -> mask of the extra categories it stands for
+        self._bitOf(SPICE)
+
+        self.transformations = dict() # Transformation type -> its spec
+        self.rules = dict() # Transformation type -> list of (when mask, unless mask, rule, choices)
+        for transformationType, spec in transformationRules.items():
+            self.transformations[transformationType] = spec
+            self.rules[transformationType] = []
+            for rule in spec["rules"]:
+                if len([action for action in ("replaceWith", "chooseFrom", "swapWith", "keep") if action in rule]) != 1:
+                    raise ValueError("Every rule needs exactly one of replaceWith, chooseFrom, swapWith or keep: " + repr(rule))
+                choices = None
+                if "chooseFrom" in rule:
+                    choices = tuple(self._membersOfAll(rule["chooseFrom"]))
+                self.rules[transformationType].append((self._maskOf(rule.get("when", [])), self._maskOf(rule.get("unless", [])), rule, choices))
+
+    ############################################################################
+    # Name: _bitOf                                                             #
+    # Params: category                                                         #
+    # Returns: Integer                                                         #
+    # Notes: A category the knowledge base does not have becomes a one-word    #
+    # category (SPICE aside, which is filled in per recipe).                   #
+    ############################################################################
+    def _bitOf(self, category):
+        bit = self.knowledgeBase.bit(category)
+        if bit is None:
+            if category not in self.extraBits:
+                self.extraBits[category] = 1 << (len(self.knowledgeBase.categories) + len(self.extraBits))
+                if category != SPICE:
+                    self.extraWordMasks[category.lower()] = self.extraWordMasks.get(category.lower(), 0) | self.extraBits[category]
+            bit = self.extraBits[category]
+        return bit
+
+    ############################################################################
+    # Name: _maskOf                                                            #
+    # Params: categories (list of names)                                       #
+    # Returns: Integer                                                         #
+    # Notes: The bits of all of the categories together.                       #
+    ############################################################################
+    def _maskOf(self, categories):
+        mask = 0
+        for category in categories:
+            mask |= self._bitOf(category)
+        return mask
+
+    ############################################################################
+    # Name: _wordMask                                                          #
+    # Params: word                                                             #
+    # Returns: Integer                                                         #
+    # Notes: Every category the word belongs to, from the knowledge base and   #
+    # our own extra ones.                                                      #
+    ############################################################################
+    def _wordMask(self, word):
+        return self.knowledgeBase.mask(word) | self.extraWordMasks.get(word.lower(), 0)
+
+    ############################################################################
+    # Name: _membersOfAll                                                      #
+    # Params: categories (list of names)                                       #
+    # Returns: List of words                                                   #
+    # Notes: The words in every one of the categories, in the first one's      #
+    # order. A fixed order (unlike a set intersection) is what makes a seeded  #
+    # random choice reproducible.                                              #
+    ############################################################################
+    def _membersOfAll(self, categories):
+        mask = self._maskOf(categories)
+        return [word for word in self.knowledgeBase.members(categories[0]) if self._wordMask(word) & mask == mask]
+
+    ############################################################################
+    # Name: classify                                                           #
+    # Params: words (the words of an ingredient name), spices (set of words    #
+    # found to be spices while parsing)                                        #
+    # Returns: Integer (mask of every category some word belongs to)           #
+    # Notes: One pass over the words.                                          #
+    ############################################################################
+    def classify(self, words, spices = ()):
+        mask = 0
+        for word in words:
+            mask |= self._wordMask(word)
+            if word in spices:
+                mask |= self.extraBits[SPICE]
+        return mask
+
+    ############################################################################
+    # Name: replacementFor                                                     #
+    # Params: transformationType, ingredient (the ingredient name, like        #
+    # "ground beef"), spices (as for classify), rng (random.Random used for    #
+    # chooseFrom), chooser (function of (choices, ingredient) giving the       #
+    # chooseFrom pick, or None when it has no opinion; e.g.                    #
+    # similarityIndex.SimilarityIndex.choose)                                  #
+    # Returns: Tuple of (the rule that matched, or None; the replacement, or   #
+    # None to leave the ingredient alone)                                      #
+    # Notes: Raises a KeyError for transformation types that have no rules.    #
+    # Without a chooser (or when it has no opinion) chooseFrom picks at        #
+    # random.                                                                  #
+    ############################################################################
+    def replacementFor(self, transformationType, ingredient, spices, rng, chooser = None):
+        words = ingredient.split(" ")
+        mask = self.classify(words, spices)
+        for whenMask, unlessMask, rule, choices in self.rules[transformationType]:
+            if mask & whenMask == whenMask and not mask & unlessMask:
+                if "replaceWith" in rule:
+                    return rule, rule["replaceWith"]
+                if "chooseFrom" in rule:
+                    choice = chooser(choices, ingredient) if chooser is not None else None
+                    return rule, choice if choice is not None else choices[rng.randrange(len(choices))]
+                if "swapWith" in rule: # The first word the cuisine has a counterpart for (just "cheese", not "grated cheese")
+                    for word in words:
+                        swap = self.knowledgeBase.swapFor(rule["swapWith"], word)
+                        if swap is not None:
+                            return rule, swap
+                return rule, None
+        return None, None
+
+    ############################################################################
+    # Name: droppedWords                                                       #
+    # Params: transformationType                                               #
+    # Returns: List of strings to cut out of the instructions                  #
+    # Notes: Like "meat " when going vegetarian.                               #
+    ############################################################################
+    def droppedWords(self, transformationType):
+        return self.transformations[transformationType].get("dropFromInstructions", [])
+
+    ############################################################################
+    # Name: style                                                              #
+    # Params: transformationType                                               #
+    # Returns: String (a cuisine in the knowledge base), or None               #
+    # Notes: Style transformations get the extra step in                       #
+    # Transformer._instTransformationForStyle.                                 #
+    ############################################################################
+    def style(self, transformationType):
+        return self.transformations[transformationType].get("style")